@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+asyncio counterpart of toolkit.Toolkit. Every check is a coroutine that
+returns the same result string as the matching Toolkit method, so
+element.Element formatting applies unchanged, but one process can keep
+thousands of checks in flight at once.
+
+>>> import asyncio
+>>> from aiotoolkit import AsyncToolkit, probe_many
+>>> element = AsyncToolkit(node='yahoo.com')
+>>> print(asyncio.run(element.check_socket(80, 'TCP')))
+open
+>>> asyncio.run(probe_many(['yahoo.com', 'google.com'], 'check_socket', 443))
+['open', 'open']
+
+"""
+
+import asyncio
+import errno
+import os
+import socket
+import ssl
+import urllib.parse
+
+from icmp import Pinger
+from result import Status
+from toolkit import Toolkit
+
+_REDIRECTS = (301, 302, 303, 307, 308)
+_NO_HEAD = (405, 501)  # servers that refuse HEAD; retried with GET
+_CONTEXT = None
+
+
+class AsyncToolkit:
+    """Container class for the coroutines check_dns(), check_host(),
+    check_socket() and check_url().
+
+    Checks sharing a semaphore never run more than its value at once.
+
+    Example:
+        element = AsyncToolkit(node, semaphore)
+        result = await element.check_socket(port, kind)
+    """
+    def __init__(self, node=None, semaphore=None):
+        """Initializes instance variables node and semaphore.
+
+        :param node: string, name or IP address of an IP element.
+        :param semaphore: asyncio.Semaphore, optional concurrency limit shared
+        with other AsyncToolkit objects.
+        """
+        self.node = node
+        self.semaphore = semaphore
+
+    async def check_dns(self, nservers, qtype, fresh=False):
+        """Coroutine version of Toolkit.check_dns(). Shares
+        Toolkit.dns_cache with the blocking version.
+
+        :param nservers: list of strings, DNS servers.
+        :param qtype: string, one of the these query types: A, CNAME, MX, PTR.
+        :param fresh: bool, bypass the cache and force a new lookup.
+        :return: string, name resolution data otherwise an exception.
+        """
+        import dns.exception
+        import dns.resolver
+        _cache = Toolkit.dns_cache
+        _key = _cache.key(self.node, qtype, nservers)
+        if not fresh:
+            _cached = _cache.get(_key)
+            if _cached is not None:
+                return _cached[1]
+        async with self._limit():
+            try:
+                _resolver = _cache.async_resolver(nservers)
+                _answer = await _resolver.resolve(
+                    Toolkit.query_name(self.node, qtype), qtype)
+                _data = Toolkit.format_answer(_answer, qtype)
+            except dns.exception.SyntaxError:
+                return 'Error; check IP address.'
+            except dns.rdatatype.UnknownRdatatype:
+                return 'Error; check query type.'
+            except dns.resolver.NoAnswer:
+                _cache.put_negative(
+                    _key, (Status.FAIL, 'Error; check query type.', []))
+                return 'Error; check query type.'
+            except dns.resolver.NXDOMAIN:
+                _cache.put_negative(
+                    _key, (Status.FAIL, 'Error; check hostname.', []))
+                return 'Error; check hostname.'
+            except dns.exception.Timeout:
+                return 'Timeout; check connection and DNS server.'
+            else:
+                _result = ', '.join(_data)
+                _cache.put(_key, (Status.OK, _result, _data),
+                           _answer.rrset.ttl)
+                return _result
+
+    async def check_host(self, count='9', timeout=1.0, interval=.2):
+        """Coroutine version of Toolkit.check_host(). The in-process
+        icmp.Pinger runs in the loop's executor; the ping command is only
+        run, without a shell, when ICMP sockets are not permitted.
+
+        :param count: string, number of echo requests.
+        :param timeout: float, seconds to wait for replies after the last
+        echo request.
+        :param interval: float, seconds between echo requests.
+        :return: string, containing ping related information, otherwise
+        ping's error output.
+        """
+        _loop = asyncio.get_running_loop()
+        async with self._limit():
+            _result = await _loop.run_in_executor(
+                None, Toolkit(self.node).ping, count, timeout, interval)
+            if _result is not None:
+                return _result.summary()
+            return await self._ping_command(count, interval)
+
+    async def _ping_command(self, count, interval):
+        # Keeps the loss line plus one line of context on each side, as
+        # `grep -1 loss` does in Toolkit.probe_host().
+        _args = ['ping', '-c', str(count), '-i', str(interval), '-s', '1350',
+                 str(self.node)]
+        try:
+            _process = await asyncio.create_subprocess_exec(
+                *_args, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+            _stdout, _stderr = await _process.communicate()
+        except OSError as e:  # no ping binary
+            return 'Unable to run ping: {}'.format(e)
+        _lines = _stdout.decode('utf-8', 'replace').splitlines()
+        _keep = set()
+        for i, line in enumerate(_lines):
+            if 'loss' in line:
+                _keep.update((i - 1, i, i + 1))
+        _match = [_lines[i] for i in sorted(_keep) if 0 <= i < len(_lines)]
+        if not _match:
+            return _stderr.decode('utf-8', 'replace').strip() or \
+                'ping exited with status {}.'.format(_process.returncode)
+        return '\n'.join(_match).strip()
+
+    async def check_socket(self, port, kind='TCP', timeout=None):
+        """Coroutine version of Toolkit.check_socket(). Uses a non-blocking
+        connect multiplexed on the event loop.
+
+        :param port: integer, TCP/UDP port number.
+        :param kind: string, port type TCP or UDP.
+        :param timeout: float, seconds to wait for the connect; None waits for
+        the OS connect timeout like Toolkit.check_socket().
+        :return: string, open otherwise and exception.
+        """
+        _loop = asyncio.get_running_loop()
+        if kind == 'udp' or kind == 'UDP':
+            _type = socket.SOCK_DGRAM
+        else:
+            _type = socket.SOCK_STREAM
+        async with self._limit():
+            try:
+                if not 0 <= port <= 65535:
+                    raise OverflowError('connect(): port must be 0-65535.')
+                _info = await _loop.getaddrinfo(
+                    self.node, port, family=socket.AF_INET, type=_type)
+                _addr = _info[0][4]
+                _sock = socket.socket(socket.AF_INET, _type)
+                try:
+                    _sock.setblocking(False)
+                    await asyncio.wait_for(
+                        self._connect(_loop, _sock, _addr), timeout)
+                finally:
+                    _sock.close()
+            except asyncio.TimeoutError:
+                return str(socket.timeout('timed out'))
+            except socket.error as e:
+                return str(e)
+            except OverflowError as e:
+                return str(e)
+            else:
+                return 'open'
+
+    async def check_url(self, url, timeout=None, context=None):
+        """Coroutine version of Toolkit.check_url(). Sends a HEAD request
+        over an asyncio connection and follows redirects as urlopen does, so
+        URL checks are multiplexed on the event loop like socket checks.
+        Servers answering HEAD with 405 or 501 are asked again with GET,
+        whose body is never read.
+
+        :param url: string, URL/URI to check.
+        :param timeout: float, seconds allowed for the whole check,
+        redirects included; None waits indefinitely.
+        :param context: ssl.SSLContext for https URLs; defaults to
+        ssl.create_default_context().
+        :return: string, HTTP code otherwise and exception.
+        """
+        async with self._limit():
+            try:
+                _status, _reason = await asyncio.wait_for(
+                    self._head(url, context), timeout)
+            except asyncio.TimeoutError:
+                return '<urlopen error timed out>'
+            except OSError as e:  # includes TLS errors
+                return '<urlopen error {}>'.format(e)
+            except ValueError as e:
+                return str(e)
+        if _status < 400:
+            return str(_status)
+        return 'HTTP Error {}: {}'.format(_status, _reason)
+
+    async def _head(self, url, context=None, max_redirects=5):
+        _loop = asyncio.get_running_loop()
+        _method = 'HEAD'
+        _redirects = 0
+        while True:
+            _parts = urllib.parse.urlsplit(url)
+            if _parts.scheme not in ('http', 'https') or not _parts.hostname:
+                raise ValueError('unknown url type: {!r}'.format(url))
+            _https = _parts.scheme == 'https'
+            _path = urllib.parse.urlunsplit(('', '', _parts.path or '/',
+                                             _parts.query, ''))
+            _family, _type, _proto, _, _address = (await _loop.getaddrinfo(
+                _parts.hostname, _parts.port or (443 if _https else 80),
+                type=socket.SOCK_STREAM))[0]
+            _sock = socket.socket(_family, _type, _proto)
+            try:
+                _sock.setblocking(False)
+                await self._connect(_loop, _sock, _address)
+                _reader, _writer = await asyncio.open_connection(
+                    sock=_sock,
+                    ssl=(context or _default_context()) if _https else None,
+                    server_hostname=_parts.hostname if _https else None)
+            except BaseException:
+                _sock.close()
+                raise
+            try:
+                _writer.write('{} {} HTTP/1.1\r\nHost: {}\r\n'
+                              'User-Agent: flaco\r\nAccept-Encoding: identity'
+                              '\r\nConnection: close\r\n\r\n'
+                              .format(_method, _path, _parts.netloc)
+                              .encode('latin-1'))
+                await _writer.drain()
+                _line = (await _reader.readline()).decode('latin-1')
+                _headers = {}
+                while True:
+                    _header = (await _reader.readline()).decode('latin-1')
+                    if not _header.strip():
+                        break
+                    _name, _, _value = _header.partition(':')
+                    _headers[_name.strip().lower()] = _value.strip()
+            finally:
+                _writer.close()
+            _fields = _line.strip().split(' ', 2)
+            if len(_fields) < 2 or not _fields[1].isdigit():
+                raise ConnectionError('Bad status line {!r}'.format(_line))
+            _status = int(_fields[1])
+            _reason = _fields[2] if len(_fields) > 2 else ''
+            if _status in _NO_HEAD and _method == 'HEAD':
+                _method = 'GET'
+                continue
+            if _status not in _REDIRECTS or not _headers.get('location') \
+                    or _redirects == max_redirects:
+                return _status, _reason
+            _redirects += 1
+            url = urllib.parse.urljoin(url, _headers['location'])
+
+    @staticmethod
+    async def _connect(loop, sock, addr):
+        # Same error text as a blocking connect(): '[Errno 111] Connection
+        # refused' rather than asyncio's 'Connect call failed'.
+        _err = sock.connect_ex(addr)
+        if _err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            _ready = loop.create_future()
+            loop.add_writer(sock.fileno(), lambda: _ready.done() or
+                            _ready.set_result(None))
+            try:
+                await _ready
+            finally:
+                loop.remove_writer(sock.fileno())
+            _err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if _err:
+            raise OSError(_err, os.strerror(_err))
+
+    def _limit(self):
+        if self.semaphore is None:
+            return _NoLimit()
+        return self.semaphore
+
+
+def _default_context():
+    # Loading the CA store takes milliseconds; do it once per process.
+    global _CONTEXT
+    if _CONTEXT is None:
+        _CONTEXT = ssl.create_default_context()
+    return _CONTEXT
+
+
+class _NoLimit:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+async def probe_many(nodes, check, *args, concurrency=500, **kwargs):
+    """Runs the same AsyncToolkit check against many nodes with at most
+    concurrency checks in flight. Results are returned in node order.
+
+    check_host is batched: every node is pinged by one icmp.Pinger in the
+    loop's executor rather than one thread per node.
+
+    Example:
+        asyncio.run(probe_many(nodes, 'check_socket', 443, timeout=2))
+
+    :param nodes: iterable of strings, names or IP addresses.
+    :param check: string, AsyncToolkit method name such as 'check_dns'.
+    :param concurrency: integer, maximum checks in flight.
+    :return: list of strings, one result per node.
+    """
+    _semaphore = asyncio.Semaphore(concurrency)
+    if check == 'check_host':
+        return await _ping_many(list(nodes), _semaphore, *args, **kwargs)
+    return await asyncio.gather(*[
+        getattr(AsyncToolkit(node, _semaphore), check)(*args, **kwargs)
+        for node in nodes])
+
+
+async def _ping_many(nodes, semaphore, count='9', timeout=1.0, interval=.2):
+    _pinger = Pinger(timeout=timeout, interval=interval, size=1350)
+    try:
+        _results = await asyncio.get_running_loop().run_in_executor(
+            None, _pinger.ping, nodes, count)
+    except PermissionError:
+        return await asyncio.gather(*[
+            AsyncToolkit(node, semaphore).check_host(count, timeout, interval)
+            for node in nodes])
+    return [_results[node].summary() for node in nodes]
+
+
+def main():
+    element = AsyncToolkit(node='yahoo.com')
+    print(asyncio.run(element.check_dns(['8.8.8.8'], 'A')))
+    print()
+    print(asyncio.run(element.check_host('3')))
+    print()
+    print(asyncio.run(element.check_socket(80, 'TCP')))
+    print()
+    print(asyncio.run(element.check_url('https://yahoo.com')))
+    print()
+    print(asyncio.run(probe_many(
+        ['yahoo.com', 'google.com'], 'check_socket', 443, timeout=2)))
+
+if __name__ == "__main__":
+    main()
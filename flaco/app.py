@@ -1,7 +1,22 @@
 __author__ = 'rafael'
+import sys
+
+from breaker import STATE_FILE, BreakerBoard
 from element import Element
+from toolkit import Toolkit
+from inventory import BulkRunner, Inventory
 
 def main():
+    # An inventory file replaces the hard-coded element below:
+    #   python app.py my_inventory.json
+    Toolkit.breakers = BreakerBoard(STATE_FILE)
+    if len(sys.argv) > 1:
+        inventory = Inventory.load(sys.argv[1])
+        runner = BulkRunner()
+        print(runner.report(inventory, runner.run(inventory)))
+        runner.http_pool.close()
+        return
+
     # Varible definition here:
     resolvers = ['8.8.8.8']
     query_type = 'A'
@@ -22,6 +37,7 @@ def main():
         print(port)
     for url in yahoo.check_url(urls):
         print(url)
+    Toolkit.breakers.save()
 
 
 if __name__ == '__main__':
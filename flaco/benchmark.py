@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Reproducible benchmarks for the Toolkit and SSH paths. Every benchmark runs
+against loopback stand-in servers (see loopback.py), so no network access is
+needed. Each operation is run at several concurrency levels; throughput and
+latency percentiles are written as JSON and compared with a stored baseline.
+Operations listed in BUDGETS must also stay under a fixed latency per
+command, with or without a baseline.
+
+    python benchmark.py --concurrency 1,8,32 --output bench.json
+    python benchmark.py --baseline baseline.json --save-baseline
+    python benchmark.py --baseline baseline.json   # exits 1 on regression
+
+>>> from benchmark import Harness, measure
+>>> with Harness() as harness:
+...     operation, iterations = harness.operations()['check_socket']
+...     print(measure(operation, 500, concurrency=8)['errors'])
+0
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import ssl
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from goten import percentile
+from loopback import (DNSServer, FilteredPort, HTTPServer, SSHServer,
+                      TCPListener, UDPListener, self_signed)
+from pool import ConnectionPool
+from result import Status
+from ssh import SSH
+from toolkit import Toolkit
+from urlpool import HTTPPool
+
+METRICS = ('ops_per_sec', 'p50', 'p95', 'p99')
+
+# Commands issued per commander_batch operation.
+BATCH = 10
+
+# Benchmark -> (commands per operation, p50 budget per command in ms).
+# Checked on every run, baseline or not: a per-command delay (like the old
+# fixed sleep after each exec) blows the budget at any concurrency.
+BUDGETS = {'commander_batch': (BATCH, 50.0)}
+
+
+class Harness:
+    """Starts the stand-in servers and builds one callable per benchmark.
+
+    Example:
+        with Harness() as harness:
+            operation, iterations = harness.operations()['check_dns']
+    """
+    def __init__(self, scp_size=1 << 20, filtered_timeout=0.2):
+        """
+        :param scp_size: integer, bytes in the file served for get_scp.
+        :param filtered_timeout: float, connect timeout used against the
+        filtered port.
+        """
+        self.scp_size = scp_size
+        self.filtered_timeout = filtered_timeout
+        self._directory = tempfile.TemporaryDirectory()
+        self._servers = []
+        self._pools = []
+        self._dns_port = None
+
+    def start(self):
+        _certificate = self_signed(self._directory.name)
+        self.dns = self._start(DNSServer())
+        self.tcp = self._start(TCPListener())
+        self.filtered = self._start(FilteredPort())
+        self.udp = self._start(UDPListener())
+        self.http = self._start(HTTPServer())
+        self.https = self._start(HTTPServer(certificate=_certificate))
+        self.ssh = self._start(SSHServer())
+        self.ssh.files['/config/startup-config'] = os.urandom(self.scp_size)
+        # urlopen() and HTTPPool trust the stand-in certificate only.
+        self.context = ssl.create_default_context(cafile=_certificate[0])
+        urllib.request.install_opener(urllib.request.build_opener(
+            urllib.request.HTTPSHandler(context=self.context)))
+        # The resolver is shared process wide; stop() puts its port back.
+        _resolver = Toolkit.dns_cache.resolver(['127.0.0.1'])
+        self._dns_port = _resolver.port
+        _resolver.port = self.dns.port
+        return self
+
+    def stop(self):
+        for pool in self._pools:
+            if isinstance(pool, HTTPPool):
+                pool.close()
+            else:
+                pool.close_all()
+        for server in reversed(self._servers):
+            server.stop()
+        urllib.request.install_opener(None)
+        if self._dns_port is not None:
+            Toolkit.dns_cache.resolver(['127.0.0.1']).port = self._dns_port
+            self._dns_port = None
+        self._directory.cleanup()
+
+    def _start(self, server):
+        self._servers.append(server.start())
+        return server
+
+    def operations(self):
+        """Returns the benchmarks.
+
+        :return: dict, name -> (callable, default iterations). Each callable
+        runs one operation and raises if the outcome is not the expected one.
+        """
+        _http_pool = HTTPPool(timeout=5, context=self.context)
+        _ssh_pool = ConnectionPool(max_per_host=64)
+        self._pools += [_http_pool, _ssh_pool]
+        _node = Toolkit('bench.flaco.test')
+        _local = Toolkit('127.0.0.1')
+        _destination = os.path.join(self._directory.name, 'scp')
+        os.makedirs(_destination, exist_ok=True)
+
+        def check_dns():
+            _expect(_node.probe_dns(['127.0.0.1'], 'A', fresh=True))
+
+        def check_dns_cached():
+            _expect(_node.probe_dns(['127.0.0.1'], 'A'))
+
+        def check_socket():
+            _expect(_local.probe_socket(self.tcp.port, 'TCP', timeout=2))
+
+        def check_socket_udp():
+            _expect(_local.probe_socket(self.udp.port, 'UDP', timeout=2))
+
+        def check_socket_filtered():
+            _expect(_local.probe_socket(self.filtered.port, 'TCP',
+                                        timeout=self.filtered_timeout),
+                    Status.TIMEOUT)
+
+        def check_url():
+            _expect(_local.probe_url(self.http.url, timeout=5))
+
+        def check_url_https():
+            _expect(_local.probe_url(self.https.url, timeout=5))
+
+        def check_url_pooled():
+            _expect(_local.probe_url(self.https.url, pool=_http_pool))
+
+        def check_host():
+            _expect(_local.probe_host('1'))
+
+        def commander():
+            _ssh = SSH(self.ssh.username, self.ssh.password, self.ssh.port,
+                       timeout=5)
+            if not _ssh.commander('127.0.0.1', ['show version']):
+                raise RuntimeError('commander returned no output')
+
+        def commander_pooled():
+            _ssh = SSH(self.ssh.username, self.ssh.password, self.ssh.port,
+                       timeout=5, pool=_ssh_pool)
+            if not _ssh.commander('127.0.0.1', ['show version']):
+                raise RuntimeError('commander returned no output')
+
+        def commander_batch():
+            _ssh = SSH(self.ssh.username, self.ssh.password, self.ssh.port,
+                       timeout=5, pool=_ssh_pool)
+            _output = _ssh.commander(
+                '127.0.0.1', ['show version {}'.format(index)
+                              for index in range(BATCH)])
+            if not _output or len(_output) != BATCH:
+                raise RuntimeError('commander returned short output')
+
+        def get_scp():
+            _target = tempfile.mkdtemp(dir=_destination)
+            _ssh = SSH(self.ssh.username, self.ssh.password, self.ssh.port,
+                       timeout=5, pool=_ssh_pool)
+            _ssh.get_scp('127.0.0.1', '/config/startup-config', _target)
+            _path = os.path.join(_target, 'startup-config')
+            if os.path.getsize(_path) != self.scp_size:
+                raise RuntimeError('short SCP transfer')
+            os.remove(_path)
+            os.rmdir(_target)
+
+        return {'check_dns': (check_dns, 2000),
+                'check_dns_cached': (check_dns_cached, 20000),
+                'check_socket': (check_socket, 2000),
+                'check_socket_udp': (check_socket_udp, 2000),
+                'check_socket_filtered': (check_socket_filtered, 20),
+                'check_url': (check_url, 1000),
+                'check_url_https': (check_url_https, 300),
+                'check_url_pooled': (check_url_pooled, 1000),
+                'check_host': (check_host, 200),
+                'commander': (commander, 50),
+                'commander_pooled': (commander_pooled, 300),
+                'commander_batch': (commander_batch, 50),
+                'get_scp': (get_scp, 50)}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _expect(result, status=Status.OK):
+    if result.status is not status:
+        raise RuntimeError('{} {}: {}'.format(result.check, result.status,
+                                              result.detail))
+
+
+def measure(operation, iterations, concurrency=1):
+    """Runs operation iterations times on concurrency threads.
+
+    :return: dict, iterations, errors, seconds, ops_per_sec and the mean,
+    p50, p95 and p99 latency in milliseconds.
+    """
+    def timed(_):
+        _start = time.perf_counter()
+        try:
+            operation()
+            _failed = None
+        except (Exception, SystemExit) as e:  # SSH.get_client() calls exit()
+            _failed = str(e) or repr(e)
+        return time.perf_counter() - _start, _failed
+
+    _start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        _samples = list(executor.map(timed, range(iterations)))
+    _elapsed = time.perf_counter() - _start
+    _latencies = [sample for sample, _ in _samples]
+    _errors = [error for _, error in _samples if error]
+    return {'iterations': iterations,
+            'errors': len(_errors),
+            'first_error': _errors[0] if _errors else None,
+            'seconds': round(_elapsed, 4),
+            'ops_per_sec': round(iterations / _elapsed, 2) if _elapsed else 0,
+            'mean': round(sum(_latencies) / len(_latencies) * 1000, 3),
+            'p50': round(percentile(_latencies, 50) * 1000, 3),
+            'p95': round(percentile(_latencies, 95) * 1000, 3),
+            'p99': round(percentile(_latencies, 99) * 1000, 3)}
+
+
+def run(names=None, levels=(1, 8, 32), scale=1.0, report=None):
+    """Runs the selected benchmarks at every concurrency level.
+
+    :param names: list of benchmark names; None runs all of them.
+    :param levels: tuple of integers, concurrency levels.
+    :param scale: float, multiplies the default iteration counts.
+    :param report: callable, called with (name, concurrency, stats) after
+    each measurement.
+    :return: dict, the JSON document: {'meta': {...}, 'results':
+    {name: {concurrency: stats}}}.
+    """
+    _document = {'meta': {'python': platform.python_version(),
+                          'implementation': platform.python_implementation(),
+                          'platform': platform.platform(),
+                          'cpus': os.cpu_count(),
+                          'started': time.time(),
+                          'levels': list(levels),
+                          'scale': scale},
+                 'results': {}}
+    _cwd = os.getcwd()
+    with Harness() as harness, tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)  # SSH._connect() writes paramiko.log to the cwd
+        try:
+            _operations = harness.operations()
+            for name in names or _operations:
+                if name not in _operations:
+                    raise ValueError('Unknown benchmark {!r}.'.format(name))
+                _operation, _iterations = _operations[name]
+                _iterations = max(1, int(_iterations * scale))
+                _operation()  # warm up connections, caches and imports
+                for level in levels:
+                    _stats = measure(_operation, max(_iterations, level),
+                                     level)
+                    _document['results'].setdefault(name, {})[str(level)] = \
+                        _stats
+                    if report is not None:
+                        report(name, level, _stats)
+        finally:
+            os.chdir(_cwd)
+    return _document
+
+
+def compare(document, baseline, tolerance=0.25, slack=0.5):
+    """Finds regressions against a baseline document: throughput lower, or
+    a latency percentile higher, by more than tolerance, or new errors.
+
+    :param tolerance: float, allowed relative change.
+    :param slack: float, milliseconds a percentile may grow on top of the
+    tolerance, so sub-millisecond jitter is not reported.
+    :return: list of strings, one per regression.
+    """
+    _regressions = []
+    for name, levels in document['results'].items():
+        for level, stats in levels.items():
+            _base = baseline.get('results', {}).get(name, {}).get(level)
+            if _base is None:
+                continue
+            _label = '{} @{}'.format(name, level)
+            if stats['errors'] > _base['errors']:
+                _regressions.append('{}: errors {} -> {}'.format(
+                    _label, _base['errors'], stats['errors']))
+            if stats['ops_per_sec'] < _base['ops_per_sec'] * (1 - tolerance):
+                _regressions.append('{}: ops_per_sec {} -> {}'.format(
+                    _label, _base['ops_per_sec'], stats['ops_per_sec']))
+            for metric in METRICS[1:]:
+                if stats[metric] > _base[metric] * (1 + tolerance) + slack:
+                    _regressions.append('{}: {} {}ms -> {}ms'.format(
+                        _label, metric, _base[metric], stats[metric]))
+    return _regressions
+
+
+def over_budget(document, budgets=None):
+    """Finds operations whose median latency per command exceeds its
+    budget; no baseline needed.
+
+    :param budgets: dict, name -> (commands per operation, budget in ms);
+    defaults to BUDGETS.
+    :return: list of strings, one per violation.
+    """
+    _violations = []
+    for name, (commands, budget) in (budgets or BUDGETS).items():
+        for level, stats in document['results'].get(name, {}).items():
+            _per_command = stats['p50'] / commands
+            if _per_command > budget:
+                _violations.append('{} @{}: {:.3f}ms per command > {}ms '
+                                   'budget'.format(name, level, _per_command,
+                                                   budget))
+    return _violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark flaco checks against loopback stand-ins.')
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--concurrency', default='1,8,32',
+                        help='comma-separated concurrency levels')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier for the iteration counts')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='JSON results file')
+    parser.add_argument('--baseline', help='baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the results to --baseline as well')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative regression (default 0.25)')
+    parser.add_argument('--slack', type=float, default=0.5,
+                        help='latency slack in ms on top of the tolerance')
+    args = parser.parse_args(argv)
+    _levels = tuple(int(level) for level in args.concurrency.split(','))
+
+    def report(name, level, stats):
+        print('{:<22} c={:<4} {:>10.1f} ops/s  p50 {:>8.3f}ms  '
+              'p95 {:>8.3f}ms  p99 {:>8.3f}ms  errors {}'.format(
+                  name, level, stats['ops_per_sec'], stats['p50'],
+                  stats['p95'], stats['p99'], stats['errors']))
+
+    _document = run(args.names, _levels, args.scale, report)
+    with open(args.output, 'w') as target:
+        json.dump(_document, target, indent=2)
+    _regressions = over_budget(_document)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as target:
+            json.dump(_document, target, indent=2)
+        print('Baseline saved to {}'.format(args.baseline))
+    elif args.baseline:
+        with open(args.baseline, 'r') as source:
+            _regressions += compare(_document, json.load(source),
+                                    args.tolerance, args.slack)
+    for regression in _regressions:
+        print('REGRESSION {}'.format(regression))
+    return 1 if _regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Per-host circuit breakers shared by Toolkit checks and SSH jobs. A host that
+fails threshold times in a row is opened: checks and SSH connects to it fail
+fast with the reason of the last failure instead of waiting out a connect
+timeout. While open, one half-open attempt is let through after a retry
+interval that doubles every time the host is still down, up to maximum. A
+success closes the breaker again. State can be saved to a JSON file and is
+loaded from it on the next run.
+
+>>> from breaker import BreakerBoard
+>>> from toolkit import Toolkit
+>>> board = BreakerBoard('breakers.json', threshold=3)
+>>> Toolkit.breakers = board          # every Toolkit and Element uses it
+>>> Toolkit('10.255.255.1').check_socket(22, 'TCP', timeout=1)
+'timed out'
+>>> board.state('10.255.255.1')      # after three timeouts
+'open'
+>>> Toolkit('10.255.255.1').check_socket(22, 'TCP', timeout=1)
+'Circuit open for 10.255.255.1 (retry in 30s): timed out'
+>>> board.save()
+
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import metrics
+from result import CheckResult, Status
+
+STATE_FILE = 'breakers.json'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Results that show a host is unreachable, per check. A refused connection
+# or an HTTP error proves the host is up and closes its breaker.
+DOWN = {'host': (Status.FAIL, Status.TIMEOUT, Status.ERROR),
+        'socket': (Status.TIMEOUT, Status.ERROR),
+        'url': (Status.TIMEOUT, Status.ERROR)}
+
+
+class CircuitOpen(OSError):
+    """Raised instead of connecting to a host whose breaker is open. The
+    status attribute holds the result.Status of the last failure.
+    """
+    status = Status.ERROR
+
+
+class Breaker:
+    """Failure state of one host.
+
+    Attributes:
+        failures: integer, consecutive failures.
+        trips: integer, failed attempts since the breaker opened; sets the
+        retry interval.
+        retry_at: float, time.time() the next half-open attempt is allowed.
+        status: string, result.Status value of the last failure.
+        reason: string, detail of the last failure.
+    """
+    __slots__ = ('failures', 'trips', 'retry_at', 'status', 'reason')
+
+    def __init__(self, failures=0, trips=0, retry_at=0.0,
+                 status=Status.ERROR.value, reason=''):
+        self.failures = failures
+        self.trips = trips
+        self.retry_at = retry_at
+        self.status = status
+        self.reason = reason
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class BreakerBoard:
+    """Thread-safe set of breakers keyed by host name or address.
+
+    Example:
+        board = BreakerBoard('breakers.json')
+        board.allow(node)       # raises CircuitOpen while open
+        board.failure(node, Status.TIMEOUT, 'timed out')
+        board.save()
+    """
+    def __init__(self, path=None, threshold=3, base=30, maximum=3600):
+        """Initialize the board and load its saved state.
+
+        :param path: string, JSON state file; None keeps state in memory.
+        :param threshold: integer, consecutive failures that open a breaker.
+        :param base: float, seconds before the first half-open attempt.
+        :param maximum: float, upper bound of the retry interval.
+        """
+        self.path = path
+        self.threshold = threshold
+        self.base = base
+        self.maximum = maximum
+        self._breakers = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def key(host):
+        return str(host).strip().lower().rstrip('.')
+
+    def interval(self, trips):
+        """Seconds between half-open attempts after trips failures."""
+        return min(self.maximum, self.base * 2 ** max(0, trips - 1))
+
+    def state(self, host):
+        """:return: string, CLOSED, OPEN or HALF_OPEN."""
+        with self._lock:
+            _breaker = self._breakers.get(self.key(host))
+            if _breaker is None or _breaker.failures < self.threshold:
+                return CLOSED
+            return HALF_OPEN if time.time() >= _breaker.retry_at else OPEN
+
+    def allow(self, host):
+        """Lets an attempt on host through, or fails fast.
+
+        While the breaker is open, the first caller after retry_at gets the
+        half-open attempt; the retry time moves on so concurrent callers
+        keep failing fast until that attempt reports back.
+
+        :raises CircuitOpen: the breaker of host is open.
+        """
+        _key = self.key(host)
+        with self._lock:
+            _breaker = self._breakers.get(_key)
+            if _breaker is None or _breaker.failures < self.threshold:
+                return
+            _now = time.time()
+            if _now >= _breaker.retry_at:
+                _breaker.retry_at = _now + self.interval(_breaker.trips)
+                return
+            _wait = _breaker.retry_at - _now
+            _message = 'Circuit open for {} (retry in {:.0f}s): {}'.format(
+                host, _wait, _breaker.reason)
+            _error = CircuitOpen(_message)
+            _error.status = Status(_breaker.status)
+        metrics.BREAKER_REJECTS.inc()
+        raise _error
+
+    def success(self, host):
+        """Closes the breaker of host."""
+        with self._lock:
+            self._breakers.pop(self.key(host), None)
+
+    def failure(self, host, status, reason):
+        """Counts a failed attempt; opens the breaker at threshold and backs
+        off the half-open attempts while it stays open.
+
+        :param status: result.Status of the failure.
+        :param reason: string, reported by fail-fast attempts.
+        """
+        _key = self.key(host)
+        with self._lock:
+            _breaker = self._breakers.setdefault(_key, Breaker())
+            _breaker.failures += 1
+            _breaker.status = status.value
+            _breaker.reason = str(reason)
+            if _breaker.failures < self.threshold:
+                return
+            _breaker.trips += 1
+            _breaker.retry_at = time.time() + self.interval(_breaker.trips)
+        if _breaker.trips == 1:
+            metrics.BREAKER_TRIPS.inc()
+
+    def record(self, host, result):
+        """Counts a result.CheckResult as a success or failure of host
+        according to DOWN.
+        """
+        if result.status in DOWN.get(result.check, ()):
+            self.failure(host, result.status, result.detail)
+        else:
+            self.success(host)
+
+    def record_many(self, host, results):
+        """Counts results of one host as a single attempt: a success if any
+        of them shows the host up, otherwise a failure with the first one.
+        """
+        for result in results:
+            if result.status not in DOWN.get(result.check, ()):
+                self.success(host)
+                return
+        if results:
+            self.failure(host, results[0].status, results[0].detail)
+
+    def rejected(self, host, check, target, params=()):
+        """Returns the fail-fast result.CheckResult for host, or None if an
+        attempt may go ahead.
+        """
+        try:
+            self.allow(host)
+        except CircuitOpen as e:
+            return CheckResult(check, target, e.status, 0.0, str(e), params)
+        return None
+
+    def snapshot(self):
+        """:return: dict, host -> breaker fields."""
+        with self._lock:
+            return {host: breaker.as_dict()
+                    for host, breaker in self._breakers.items()}
+
+    def update(self, states):
+        """Replaces the breakers of some hosts, e.g. with the states a
+        worker process collected for its share of the hosts.
+
+        :param states: dict, host -> snapshot() fields, or None to close.
+        """
+        with self._lock:
+            for host, fields in states.items():
+                if fields is None:
+                    self._breakers.pop(self.key(host), None)
+                else:
+                    self._breakers[self.key(host)] = Breaker(**fields)
+
+    def load(self):
+        """Replaces the breakers with the ones saved in self.path."""
+        with open(self.path, 'r') as source:
+            _saved = json.load(source)
+        with self._lock:
+            self._breakers = {host: Breaker(**fields)
+                              for host, fields in _saved.items()}
+
+    def save(self):
+        """Writes the breakers to self.path, atomically replacing it."""
+        if self.path is None:
+            return
+        import tempfile
+        _state = self.snapshot()
+        _directory = os.path.dirname(os.path.abspath(self.path))
+        _fd, _temporary = tempfile.mkstemp(dir=_directory, suffix='.tmp')
+        try:
+            with os.fdopen(_fd, 'w') as target:
+                json.dump(_state, target, indent=1, sort_keys=True)
+            os.replace(_temporary, self.path)
+        except BaseException:
+            os.unlink(_temporary)
+            raise
+
+
+def guarded(check, subject):
+    """Decorator for Toolkit probe methods: when the instance has a
+    BreakerBoard in self.breakers, an open host fails fast and every result
+    is recorded on the host's breaker.
+
+    :param check: string, check label.
+    :param subject: callable with the probe's signature returning (host,
+    target, params) for the call; a None host is not guarded.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            _board = self.breakers
+            if _board is None:
+                return method(self, *args, **kwargs)
+            _host, _target, _params = subject(self, *args, **kwargs)
+            if _host is None:
+                return method(self, *args, **kwargs)
+            _rejected = _board.rejected(_host, check, _target, _params)
+            if _rejected is not None:
+                return _rejected
+            _result = method(self, *args, **kwargs)
+            _board.record(_host, _result)
+            return _result
+        return wrapper
+    return decorate
+
+
+def main():
+    _board = BreakerBoard(sys.argv[1] if len(sys.argv) > 1 else STATE_FILE)
+    for host, fields in sorted(_board.snapshot().items()):
+        print('{:<32} {:<9} failures {:<4} {}'.format(
+            host, _board.state(host), fields['failures'], fields['reason']))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Incremental store for collected command output such as running configs.
+Each (device, command) output is fingerprinted, without the lines matched by
+the ignore patterns; only outputs whose fingerprint changed are written, as
+collected, to a content-addressed blob directory, and a unified diff against
+the previous version is kept with every change. A SQLite index
+answers "what changed where since T" without reading old outputs.
+
+Layout of a store directory:
+    objects/ab/cdef...   zlib compressed blobs named by their SHA-256
+    index.db             versions, diffs and last-seen times
+
+goten writes into a store with the 'store' job format, or directly:
+
+>>> from configstore import ConfigStore
+>>> store = ConfigStore('configs')
+>>> store.record('192.168.64.1', 'show running-config', running_config)
+Change('192.168.64.1', 'show running-config', 'changed', +3, -1)
+>>> for change in store.changes(since=time.time() - 86400):
+...     print(change.device, change.command, change.added, change.removed)
+...     print(store.diff(change))
+>>> store.close()
+
+    python configstore.py configs 2024-05-01      # changes since a date
+
+"""
+
+import difflib
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from sink import split_key
+
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    command TEXT NOT NULL,
+    collected REAL NOT NULL,
+    digest TEXT NOT NULL,
+    fingerprint TEXT,
+    previous TEXT,
+    diff TEXT,
+    added INTEGER NOT NULL DEFAULT 0,
+    removed INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS versions_collected ON versions (collected);
+CREATE INDEX IF NOT EXISTS versions_series
+    ON versions (device, command, collected);
+CREATE TABLE IF NOT EXISTS latest (
+    device TEXT NOT NULL,
+    command TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    fingerprint TEXT,
+    changed REAL NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (device, command));
+'''
+
+
+class Change:
+    """One recorded version of a (device, command) output.
+
+    Attributes:
+        device: string, IP address or hostname.
+        command: string, command that produced the output.
+        kind: string, NEW, CHANGED or UNCHANGED.
+        collected: float, time.time() of the collection.
+        digest: string, SHA-256 of the stored output, as collected; for
+        UNCHANGED, that of the stored version it matched.
+        fingerprint: string, SHA-256 of the output without ignored lines;
+        versions differ when their fingerprints do.
+        previous: string, digest of the prior version; None when NEW.
+        diff: string, digest of the unified diff blob; None unless CHANGED.
+        added: integer, lines added since the prior version.
+        removed: integer, lines removed since the prior version.
+    """
+    __slots__ = ('device', 'command', 'kind', 'collected', 'digest',
+                 'fingerprint', 'previous', 'diff', 'added', 'removed')
+
+    def __init__(self, device, command, kind, collected, digest,
+                 previous=None, diff=None, added=0, removed=0,
+                 fingerprint=None):
+        self.device = device
+        self.command = command
+        self.kind = kind
+        self.collected = collected
+        self.digest = digest
+        self.fingerprint = fingerprint
+        self.previous = previous
+        self.diff = diff
+        self.added = added
+        self.removed = removed
+
+    def __repr__(self):
+        return 'Change({!r}, {!r}, {!r}, +{}, -{})'.format(
+            self.device, self.command, self.kind, self.added, self.removed)
+
+
+class ConfigStore:
+    """Content-addressed output store with a SQLite change index. Thread
+    safe; one store may be shared by every worker of a job.
+
+    Example:
+        store = ConfigStore('configs', ignore=[r'^! Last configuration'])
+        store.record(device, command, output)
+    """
+    def __init__(self, path, ignore=(), context=3):
+        """Opens or creates the store directory.
+
+        :param path: string, store directory.
+        :param ignore: list of regular expressions; matching lines, such as
+        timestamps printed in every config, are dropped before fingerprinting
+        and diffing so they do not count as changes. Stored outputs keep
+        them.
+        :param context: integer, context lines in the unified diffs.
+        """
+        self.path = path
+        self.ignore = [re.compile(pattern) for pattern in ignore]
+        self.context = context
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, 'index.db'),
+                                   check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        for table in ('versions', 'latest'):
+            _columns = [row[1] for row in self._db.execute(
+                'PRAGMA table_info({})'.format(table))]
+            if 'fingerprint' not in _columns:
+                # Older stores kept the normalized output, so its digest is
+                # also its fingerprint.
+                self._db.execute('ALTER TABLE {} ADD COLUMN fingerprint TEXT'
+                                 .format(table))
+                self._db.execute('UPDATE {} SET fingerprint = digest'
+                                 .format(table))
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def normalize(self, output):
+        """Returns output without the lines matching self.ignore."""
+        if not self.ignore:
+            return output
+        return ''.join(line for line in output.splitlines(True)
+                       if not any(pattern.search(line)
+                                  for pattern in self.ignore))
+
+    def record(self, device, command, output, collected=None):
+        """Stores one output if it differs from the last version of
+        (device, command).
+
+        :param device: string, IP address or hostname.
+        :param command: string, command that produced output.
+        :param output: string, command output.
+        :param collected: float, time.time() of the collection; now when
+        None.
+        :return: Change object.
+        """
+        device = device.strip()
+        collected = time.time() if collected is None else collected
+        _data = output.encode('utf-8')
+        _digest = hashlib.sha256(_data).hexdigest()
+        _text = self.normalize(output)
+        _fingerprint = hashlib.sha256(_text.encode('utf-8')).hexdigest() \
+            if self.ignore else _digest
+        with self._lock:
+            _row = self._db.execute(
+                'SELECT digest, fingerprint FROM latest WHERE device = ? AND '
+                'command = ?', (device, command)).fetchone()
+            _previous, _previous_fingerprint = _row if _row else (None, None)
+            if _previous_fingerprint == _fingerprint:
+                self._db.execute(
+                    'UPDATE latest SET seen = ? WHERE device = ? AND '
+                    'command = ?', (collected, device, command))
+                self._db.commit()
+                return Change(device, command, UNCHANGED, collected,
+                              _previous, _previous, fingerprint=_fingerprint)
+        # Blobs are immutable and named by content, so they are written
+        # and diffed outside the lock.
+        self.put(_data, _digest)
+        _change = Change(device, command, NEW, collected, _digest,
+                         fingerprint=_fingerprint)
+        if _previous is not None:
+            _change.kind = CHANGED
+            _change.previous = _previous
+            _lines = list(difflib.unified_diff(
+                self.normalize(self.get(_previous).decode('utf-8'))
+                .splitlines(True),
+                _text.splitlines(True), '{} {}'.format(device, command),
+                '{} {}'.format(device, command), n=self.context))
+            for line in _lines[2:]:
+                if line.startswith('+'):
+                    _change.added += 1
+                elif line.startswith('-'):
+                    _change.removed += 1
+            _change.diff = self.put(''.join(_lines).encode('utf-8'))
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO versions (device, command, collected, digest, '
+                'fingerprint, previous, diff, added, removed, size) VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (device, command, collected, _digest, _fingerprint,
+                 _change.previous, _change.diff, _change.added,
+                 _change.removed, len(_data)))
+            self._db.execute(
+                'INSERT OR REPLACE INTO latest (device, command, digest, '
+                'fingerprint, changed, seen) VALUES (?, ?, ?, ?, ?, ?)',
+                (device, command, _digest, _fingerprint, collected,
+                 collected))
+            self._db.commit()
+        return _change
+
+    def put(self, data, digest=None):
+        """Writes a blob unless it is already stored.
+
+        :param data: bytes.
+        :param digest: string, SHA-256 of data when already known.
+        :return: string, digest.
+        """
+        digest = digest or hashlib.sha256(data).hexdigest()
+        _path = self._blob(digest)
+        if os.path.exists(_path):
+            return digest
+        os.makedirs(os.path.dirname(_path), exist_ok=True)
+        _fd, _temporary = tempfile.mkstemp(dir=os.path.dirname(_path),
+                                           suffix='.tmp')
+        with os.fdopen(_fd, 'wb') as target:
+            target.write(zlib.compress(data))
+        os.replace(_temporary, _path)
+        return digest
+
+    def get(self, digest):
+        """:return: bytes, the blob stored under digest."""
+        with open(self._blob(digest), 'rb') as source:
+            return zlib.decompress(source.read())
+
+    def output(self, change):
+        """:return: string, the output recorded by a Change."""
+        return self.get(change.digest).decode('utf-8')
+
+    def diff(self, change):
+        """:return: string, unified diff of a CHANGED Change; '' otherwise.
+        """
+        if change.diff is None:
+            return ''
+        return self.get(change.diff).decode('utf-8')
+
+    def changes(self, since, until=None, device=None, command=None):
+        """Versions recorded in [since, until), oldest first.
+
+        :param since: float, time.time() lower bound.
+        :param until: float, upper bound; None means now.
+        :param device: string, only this device.
+        :param command: string, only this command.
+        :return: list of Change objects, NEW or CHANGED.
+        """
+        _query = ['SELECT device, command, collected, digest, previous, '
+                  'diff, added, removed, fingerprint FROM versions WHERE '
+                  'collected >= ?']
+        _args = [since]
+        for column, value in (('collected <', until), ('device =', device),
+                              ('command =', command)):
+            if value is not None:
+                _query.append('AND {} ?'.format(column))
+                _args.append(value)
+        _query.append('ORDER BY collected, id')
+        with self._lock:
+            _rows = self._db.execute(' '.join(_query), _args).fetchall()
+        return [Change(device, command, NEW if previous is None else CHANGED,
+                       collected, digest, previous, diff, added, removed,
+                       fingerprint)
+                for device, command, collected, digest, previous, diff,
+                added, removed, fingerprint in _rows]
+
+    def history(self, device, command):
+        """:return: list of Change objects of one (device, command)."""
+        return self.changes(0, device=device.strip(), command=command)
+
+    def latest(self, device=None):
+        """Last version of every (device, command).
+
+        :return: list of dicts with device, command, digest, changed and
+        seen (time.time() of the last collection, changed or not).
+        """
+        _query = 'SELECT device, command, digest, changed, seen FROM latest'
+        _args = ()
+        if device is not None:
+            _query += ' WHERE device = ?'
+            _args = (device.strip(),)
+        with self._lock:
+            _rows = self._db.execute(_query + ' ORDER BY device, command',
+                                     _args).fetchall()
+        return [dict(zip(('device', 'command', 'digest', 'changed', 'seen'),
+                         row)) for row in _rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _blob(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest[2:])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StoreWriter:
+    """sink.JobWriter stand-in that records every command output of a job
+    in a ConfigStore instead of appending it to a job file.
+
+    Example:
+        with StoreWriter('configs') as job:
+            job.write_device(device, ssh.commander(device, commands))
+    """
+    def __init__(self, path, ignore=()):
+        self.store = ConfigStore(path, ignore)
+        self.devices = 0
+        self.counts = {NEW: 0, CHANGED: 0, UNCHANGED: 0}
+        self.errors = {}
+
+    def write_device(self, device, outputs=None, error=None):
+        """Records one device's outputs; same arguments as
+        JobWriter.write_device(). Each output is recorded with the
+        collection time from its SSH.commander() key.
+
+        :return: list of Change objects.
+        """
+        self.devices += 1
+        if error is not None:
+            self.errors[device.strip()] = error
+            return []
+        _changes = []
+        for key, value in (outputs or {}).items():
+            _stamp, _command = split_key(key)
+            try:
+                _collected = parse_time(_stamp) if _stamp else None
+            except ValueError:
+                _collected = None
+            _change = self.store.record(device, _command, value, _collected)
+            self.counts[_change.kind] += 1
+            _changes.append(_change)
+        return _changes
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_time(value):
+    """Parses an epoch timestamp or an ISO 8601 date/time in local time.
+
+    :return: float, time.time() value.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: configstore.py STORE [SINCE [DEVICE]]')
+        return
+    _since = parse_time(sys.argv[2]) if len(sys.argv) > 2 \
+        else time.time() - 86400
+    _device = sys.argv[3] if len(sys.argv) > 3 else None
+    with ConfigStore(sys.argv[1]) as store:
+        for change in store.changes(_since, device=_device):
+            print('{} {} [{}] {} +{} -{}'.format(
+                datetime.fromtimestamp(change.collected).isoformat(' ',
+                                                                   'seconds'),
+                change.device, change.command, change.kind, change.added,
+                change.removed))
+            if change.diff is not None:
+                print(store.diff(change))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Long-running health-check service. Element checks are scheduled on a heap
+with per-check intervals and jitter and run on a bounded worker pool inside
+one process, so resolvers, the DNS cache and pooled HTTP connections stay
+warm between runs. The latest result of every check is kept in memory.
+
+>>> from daemon import HealthDaemon
+>>> from element import Element
+>>> service = HealthDaemon(workers=64)
+>>> service.add_element(Element('yahoo.com', 'Web Server'), interval=60,
+...                     resolvers=['8.8.8.8'], ports=(80, 443),
+...                     urls=('https://yahoo.com',))
+>>> service.start()
+>>> service.latest()['yahoo.com check_socket']['result']
+['\\t\\tTCP port 80: open', '\\t\\tTCP port 443: open']
+>>> service.stop()
+
+"""
+
+import argparse
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from element import Element
+from result import CheckResult
+from urlpool import HTTPPool
+
+
+class ScheduledCheck:
+    """One recurring call of an Element (or Toolkit) method.
+
+    Attributes:
+        name: string, unique key for latest().
+        target: object whose method is called.
+        method: string, method name such as 'probe_dns'.
+        args: tuple, positional arguments.
+        kwargs: dict, keyword arguments.
+        interval: float, seconds between runs.
+        jitter: float, up to this many seconds are added to each run time
+        so checks with the same interval do not fire together.
+        render: callable turning each result.CheckResult returned by the
+        method into the value kept by latest(); None keeps the result.
+        due: float, time.monotonic() of the next planned run before jitter.
+    """
+    __slots__ = ('name', 'target', 'method', 'args', 'kwargs', 'interval',
+                 'jitter', 'render', 'due', 'running')
+
+    def __init__(self, name, target, method, args=(), kwargs=None,
+                 interval=60, jitter=0, render=None):
+        self.name = name
+        self.target = target
+        self.method = method
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.interval = interval
+        self.jitter = jitter
+        self.render = render
+        self.due = time.monotonic()
+        self.running = False
+
+
+class HealthDaemon:
+    """Heap based scheduler for recurring checks.
+
+    Example:
+        service = HealthDaemon()
+        service.add(name, element, 'probe_host', interval=30)
+        service.run()   # blocks; or start() / stop()
+    """
+    def __init__(self, workers=32, http_pool=None, store=None):
+        """Initialize the service.
+
+        :param workers: integer, checks allowed to run at once.
+        :param http_pool: urlpool.HTTPPool shared by every URL check;
+        defaults to a new pool with a 10 second timeout.
+        :param store: history.ResultStore; result.CheckResult values
+        returned by scheduled probe_*() methods are recorded in it.
+        """
+        self.workers = workers
+        self.http_pool = http_pool or HTTPPool(timeout=10)
+        self.store = store
+        self.runs = 0
+        self.skipped = 0
+        self._heap = []
+        self._sequence = itertools.count()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add(self, name, target, method, args=(), kwargs=None, interval=60,
+            jitter=None, render=None):
+        """Schedules target.method(*args, **kwargs) every interval seconds.
+        The first run happens within jitter seconds.
+
+        :param jitter: float, defaults to 10% of interval.
+        :param render: callable, see ScheduledCheck.render.
+        :return: ScheduledCheck object.
+        """
+        if jitter is None:
+            jitter = interval * 0.1
+        _check = ScheduledCheck(name, target, method, args, kwargs, interval,
+                                jitter, render)
+        self._push(_check.due + random.uniform(0, jitter), _check)
+        return _check
+
+    def add_element(self, element, interval=60, jitter=None, resolvers=None,
+                    qtype='A', ping=True, ports=None, kind='TCP',
+                    port_timeout=2, urls=None):
+        """Schedules the usual set of checks for one Element, as app.main
+        runs them once. The probe_*() methods are scheduled, so self.store
+        records their results, and latest() holds them rendered as the
+        matching check_*() method returns them.
+
+        :param element: element.Element object.
+        :param resolvers: list of strings, DNS servers; no DNS check if None.
+        :param ping: bool, schedule the ping check.
+        :param ports: tuple of ports, no socket check if None.
+        :param port_timeout: float, per-port connect timeout.
+        :param urls: tuple of URLs, no URL check if None; checked over
+        self.http_pool.
+        :return: list of ScheduledCheck objects.
+        """
+        _node = element.node
+        _checks = []
+        if resolvers:
+            _checks.append(self.add('{} check_dns'.format(_node), element,
+                                    'probe_dns', (resolvers, qtype),
+                                    interval=interval, jitter=jitter,
+                                    render=element.render))
+        if ping:
+            _checks.append(self.add('{} check_host'.format(_node), element,
+                                    'probe_host', interval=interval,
+                                    jitter=jitter, render=element.render))
+        if ports:
+            _checks.append(self.add('{} check_socket'.format(_node), element,
+                                    'probe_sockets', (ports, kind),
+                                    {'timeout': port_timeout},
+                                    interval=interval, jitter=jitter,
+                                    render=element.render))
+        if urls:
+            _checks.append(self.add('{} check_url'.format(_node), element,
+                                    'probe_urls', (urls,),
+                                    {'pool': self.http_pool},
+                                    interval=interval, jitter=jitter,
+                                    render=element.render))
+        return _checks
+
+    def latest(self):
+        """Returns a snapshot of the most recent result of every check.
+
+        :return: dict, name -> {'result', 'started', 'duration', 'error'};
+        started is a time.time() timestamp.
+        """
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._latest.items()}
+
+    def run(self):
+        """Runs the scheduler loop in the calling thread until stop()."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stopping.is_set():
+                with self._lock:
+                    _due = self._heap[0][0] if self._heap else None
+                _now = time.monotonic()
+                if _due is None or _due > _now:
+                    self._wakeup.wait(None if _due is None else _due - _now)
+                    self._wakeup.clear()
+                    continue
+                with self._lock:
+                    _, _, _check = heapq.heappop(self._heap)
+                # Fixed-rate schedule from the planned time, not from when
+                # the run finished, so checks do not drift; after a stall
+                # the schedule restarts from now instead of bursting.
+                _check.due = max(_check.due + _check.interval, _now)
+                self._push(_check.due + random.uniform(0, _check.jitter),
+                           _check)
+                if _check.running:
+                    self.skipped += 1  # previous run still going
+                    continue
+                _check.running = True
+                self.runs += 1
+                executor.submit(self._execute, _check)
+
+    def start(self):
+        """Runs the scheduler loop in a background thread."""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name='flaco-daemon',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops scheduling, waits for running checks and closes pooled
+        HTTP connections.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.http_pool.close()
+
+    def _push(self, when, check):
+        with self._lock:
+            heapq.heappush(self._heap, (when, next(self._sequence), check))
+        self._wakeup.set()
+
+    def _execute(self, check):
+        _started = time.time()
+        _clock = time.monotonic()
+        _entry = {'started': _started, 'result': None, 'error': None}
+        _result = None
+        try:
+            _result = getattr(check.target, check.method)(*check.args,
+                                                          **check.kwargs)
+            _entry['result'] = _result
+            if check.render is not None:
+                _entry['result'] = [check.render(item) for item in _result] \
+                    if isinstance(_result, list) else check.render(_result)
+        except Exception as e:
+            _entry['error'] = str(e) or repr(e)
+        finally:
+            check.running = False
+        _entry['duration'] = time.monotonic() - _clock
+        with self._lock:
+            self._latest[check.name] = _entry
+        if self.store is not None and (
+                isinstance(_result, CheckResult) or isinstance(
+                    _result, list) and _result and
+                isinstance(_result[0], CheckResult)):
+            self.store.record(_result, _started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the example health checks until Ctrl-C.')
+    parser.add_argument('--metrics-port', type=int, default=9108,
+                        help='Prometheus scrape port (9108); 0 disables '
+                             'the exporter')
+    args = parser.parse_args(argv)
+    if args.metrics_port:
+        metrics.serve(port=args.metrics_port)  # Prometheus scrape target
+    service = HealthDaemon(workers=64)
+    service.add_element(Element('yahoo.com', 'Web Server'), interval=60,
+                        resolvers=['8.8.8.8'], ports=(80, 443),
+                        urls=('https://yahoo.com', 'http://yahoo.com'))
+    service.start()
+    try:
+        while True:
+            time.sleep(30)
+            for name, entry in sorted(service.latest().items()):
+                print('{} [{:.3f}s]: {}'.format(
+                    name, entry['duration'], entry['error'] or entry['result']))
+    except KeyboardInterrupt:
+        print('\nGoodbye')
+        service.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Batched DNS queries: many (name, qtype) pairs against many resolvers, sent
+concurrently over UDP with TCP fallback for truncated answers. Results come
+back as a matrix of the same strings Toolkit.check_dns() returns, and
+resolvers that disagree on a query are flagged (split-horizon check).
+
+>>> from dnsbatch import batch_query
+>>> result = batch_query([('yahoo.com', 'A'), ('yahoo.com', 'MX')],
+...                      ['10.0.0.53', '8.8.8.8'])
+>>> result.matrix[('yahoo.com', 'A')]['8.8.8.8']
+'98.139.183.24, 206.190.36.45, 98.138.253.109'
+>>> result.disagreements()
+[('yahoo.com', 'A')]
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import dns.exception
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
+
+from toolkit import Toolkit
+
+
+class BatchResult:
+    """Result matrix of a batch_query() call.
+
+    Attributes:
+        queries: list of (name, qtype) tuples in request order.
+        nameservers: list of resolver addresses in request order.
+        matrix: dict, (name, qtype) -> {nameserver: result string}.
+        records: dict, (name, qtype) -> {nameserver: frozenset of records
+        or NXDOMAIN/NoAnswer error string}, None when the resolver could not
+        be asked. Used to compare resolvers independent of record order.
+    """
+    def __init__(self, queries, nameservers):
+        self.queries = queries
+        self.nameservers = nameservers
+        self.matrix = {query: {} for query in queries}
+        self.records = {query: {} for query in queries}
+
+    def disagreements(self):
+        """Returns the queries whose resolvers returned different record
+        sets, or answers from some and NXDOMAIN/NoAnswer from others.
+        Resolvers that timed out or answered with an error are left out of
+        the comparison.
+
+        :return: list of (name, qtype) tuples.
+        """
+        return [query for query in self.queries
+                if len(set(self.records[query].values()) - {None}) > 1]
+
+    def render(self):
+        """Formats the matrix for display, one line per query and resolver,
+        with disagreeing queries marked.
+
+        :return: string.
+        """
+        _split = set(self.disagreements())
+        _lines = []
+        for query in self.queries:
+            _flag = ' [DISAGREE]' if query in _split else ''
+            _lines.append('{} {}{}'.format(query[0], query[1], _flag))
+            for nameserver in self.nameservers:
+                _lines.append('\t{}: {}'.format(
+                    nameserver, self.matrix[query][nameserver]))
+        return '\n'.join(_lines)
+
+
+def resolve_one(name, qtype, nameserver, timeout=2.0, port=53):
+    """Sends one query straight to nameserver, over UDP first and TCP if the
+    answer is truncated.
+
+    :param name: string, name or IP address (PTR).
+    :param qtype: string, query type such as A, AAAA, CNAME, MX, PTR.
+    :param nameserver: string, resolver IP address.
+    :param timeout: float, seconds to wait per transport.
+    :param port: integer, resolver port.
+    :return: tuple, (result string as Toolkit.check_dns() formats it,
+    comparable value: frozenset of records, the NXDOMAIN/NoAnswer error
+    string, or None when the query failed or the resolver answered with an
+    error such as SERVFAIL or REFUSED).
+    """
+    try:
+        _rdtype = dns.rdatatype.from_text(qtype.upper())
+        _query = dns.message.make_query(
+            Toolkit.query_name(name, qtype), _rdtype)
+        _response, _ = dns.query.udp_with_fallback(
+            _query, nameserver, timeout=timeout, port=port)
+    except dns.exception.SyntaxError:
+        return 'Error; check IP address.', None
+    except dns.rdatatype.UnknownRdatatype:
+        return 'Error; check query type.', None
+    except (dns.exception.Timeout, OSError):
+        return 'Timeout; check connection and DNS server.', None
+    except ValueError:  # nameserver is not an IP address
+        return 'Error; check DNS server address.', None
+    _rcode = _response.rcode()
+    if _rcode == dns.rcode.NXDOMAIN:
+        return 'Error; check hostname.', 'Error; check hostname.'
+    if _rcode != dns.rcode.NOERROR:
+        # The resolver failed; its answer says nothing about the records.
+        return 'Error; DNS server answered {}.'.format(
+            dns.rcode.to_text(_rcode)), None
+    # A recursive answer carries the whole CNAME chain; keep the rrsets of
+    # the requested type, as the stub resolver behind check_dns() does.
+    _rdatas = [rdata for rrset in _response.answer
+               if rrset.rdtype == _rdtype for rdata in rrset]
+    if not _rdatas:
+        return 'Error; check query type.', 'Error; check query type.'
+    _data = Toolkit.format_answer(_rdatas, qtype)
+    return ', '.join(_data), frozenset(_data)
+
+
+def batch_query(queries, nameservers, timeout=2.0, max_workers=32):
+    """Runs every (name, qtype) pair against every nameserver concurrently.
+
+    Example:
+        result = batch_query([(name, 'A'), (name, 'AAAA'), (name, 'MX')],
+                             [internal_dns, external_dns])
+        print(result.render())
+
+    :param queries: iterable of (name, qtype) tuples.
+    :param nameservers: iterable of strings, resolver IP addresses.
+    :param timeout: float, seconds to wait per query and transport.
+    :param max_workers: integer, maximum queries in flight.
+    :return: BatchResult object.
+    """
+    queries = list(dict.fromkeys(queries))
+    nameservers = list(dict.fromkeys(nameservers))
+    _result = BatchResult(queries, nameservers)
+    _jobs = [(query, nameserver)
+             for query in queries for nameserver in nameservers]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        _futures = [executor.submit(resolve_one, query[0], query[1],
+                                    nameserver, timeout)
+                    for query, nameserver in _jobs]
+        for (query, nameserver), future in zip(_jobs, _futures):
+            _text, _records = future.result()
+            _result.matrix[query][nameserver] = _text
+            _result.records[query][nameserver] = _records
+    return _result
+
+
+def main():
+    _queries = [('yahoo.com', qtype) for qtype in ('A', 'AAAA', 'MX', 'CNAME')]
+    print(batch_query(_queries, ['8.8.8.8', '1.1.1.1']).render())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+In-memory DNS answer cache and shared resolvers for Toolkit.check_dns().
+
+Entries are keyed by (name, qtype, nameservers) and expire with the TTL of
+the answer. NXDOMAIN and NoAnswer results are cached for negative_ttl
+seconds. The cache holds at most max_entries and evicts the least recently
+used entry first.
+
+>>> from dnscache import DNSCache
+>>> cache = DNSCache(max_entries=10000, negative_ttl=60)
+>>> cache.put(('yahoo.com', 'A', ('8.8.8.8',)), '98.139.183.24', ttl=300)
+>>> cache.get(('yahoo.com', 'A', ('8.8.8.8',)))
+'98.139.183.24'
+>>> cache.stats()
+{'entries': 1, 'hits': 1, 'misses': 0}
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class DNSCache:
+    """Thread-safe TTL and LRU bounded cache of check_dns() results, plus one
+    reusable dns.resolver.Resolver (and dns.asyncresolver.Resolver) per
+    nameserver set.
+
+    Example:
+        cache = DNSCache()
+        resolver = cache.resolver(nservers)
+    """
+    def __init__(self, max_entries=10000, negative_ttl=60, min_ttl=0,
+                 max_ttl=86400):
+        """Initialize the cache.
+
+        :param max_entries: integer, entries kept before LRU eviction.
+        :param negative_ttl: float, seconds NXDOMAIN/NoAnswer results are
+        cached; 0 disables negative caching.
+        :param min_ttl: float, floor applied to record TTLs.
+        :param max_ttl: float, ceiling applied to record TTLs.
+        """
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._resolvers = {}
+        self._async_resolvers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(node, qtype, nservers):
+        """Builds the cache key for a query.
+
+        :return: tuple, (name, upper-case qtype, tuple of nameservers).
+        """
+        return str(node).lower().rstrip('.'), qtype.upper(), tuple(nservers)
+
+    def resolver(self, nservers):
+        """Returns the shared resolver for a nameserver set, creating it on
+        first use. Avoids re-reading resolv.conf on every query.
+
+        :param nservers: list of strings, DNS servers.
+        :return: dns.resolver.Resolver object.
+        """
+        import dns.resolver  # deferred so non-DNS checks start faster
+        _key = tuple(nservers)
+        with self._lock:
+            _resolver = self._resolvers.get(_key)
+            if _resolver is None:
+                _resolver = dns.resolver.Resolver()
+                _resolver.nameservers = list(nservers)
+                self._resolvers[_key] = _resolver
+            return _resolver
+
+    def async_resolver(self, nservers):
+        """Same as resolver() for dns.asyncresolver.Resolver, used by
+        aiotoolkit.AsyncToolkit.check_dns(). Async resolvers hold no
+        per-loop state, so one serves every event loop.
+
+        :param nservers: list of strings, DNS servers.
+        :return: dns.asyncresolver.Resolver object.
+        """
+        import dns.asyncresolver
+        _key = tuple(nservers)
+        with self._lock:
+            _resolver = self._async_resolvers.get(_key)
+            if _resolver is None:
+                _resolver = dns.asyncresolver.Resolver()
+                _resolver.nameservers = list(nservers)
+                self._async_resolvers[_key] = _resolver
+            return _resolver
+
+    def get(self, key):
+        """Returns the cached value for key, or None if it is missing or
+        expired.
+        """
+        with self._lock:
+            _entry = self._entries.get(key)
+            if _entry is None or _entry[0] <= time.monotonic():
+                if _entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return _entry[1]
+
+    def put(self, key, value, ttl):
+        """Stores value for ttl seconds, clamped to [min_ttl, max_ttl].
+        Values with a TTL of zero or less are not stored.
+        """
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put_negative(self, key, value):
+        """Stores an NXDOMAIN/NoAnswer result for negative_ttl seconds."""
+        self.put(key, value, self.negative_ttl)
+
+    def invalidate(self, key=None):
+        """Drops one entry, or every entry when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """:return: dict, entry count and hit/miss counters."""
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses}
@@ -25,8 +25,16 @@ Dispatch and format output.
 
 __author__ = 'rafael'
 
+import urllib.parse
+
+import metrics
+from result import CheckResult, Status
+from scanner import CLOSED, FILTERED, OPEN, PortScanner, parse_ports
 from toolkit import Toolkit
 
+_SCAN_STATUS = {OPEN: Status.OK, CLOSED: Status.FAIL,
+                FILTERED: Status.TIMEOUT}
+
 
 class Element(Toolkit):
     """This is an interface class for the application. Inherits class
@@ -34,6 +42,10 @@ class Element(Toolkit):
     methods, but each of its methods calls the corresponding parent methods.
     Formats the return values from toolkit.Toolkit() methods for display.
 
+    The check_*() methods render the result.CheckResult records returned by
+    the probe_*() methods; use those directly to aggregate on status and
+    latency instead of text.
+
     Example:
         yahoo = Element(node, etype)
     """
@@ -58,8 +70,7 @@ class Element(Toolkit):
             element = Element(node, etype)
             print(element.check_dns(nservers, qtype))
         """
-        return '\t\tDNS {} records: {}'.format(
-            qtype, super().check_dns(nservers, qtype))
+        return self.render(self.probe_dns(nservers, qtype))
 
     def check_host(self):
         """Calls Toolkit.check_host() and filter the returned value to capture
@@ -71,52 +82,155 @@ class Element(Toolkit):
             element = Element(node, etype)
             print(element.check_host())
         """
-        _output = super().check_host()
-        try:
-            _filter = _output.split('received, ')[1]  # filter
-            _refined = _filter[0:16].strip(', ')      # 0% packet loss
-            return '\t\tPing: {}'.format(_refined)
-        except IndexError:
-            return 'connection error'
+        return self.render(self.probe_host())
 
-    def check_socket(self, ports, kind):
+    def check_socket(self, ports, kind, timeout=None, concurrency=1000):
         """Calls Toolkit.check_socket() for each element (port) in the tuple.
         Formats the returned value as such: 'TCP port 80: open'. Inserts each
         returned value into _port_list. Returns _port_list.
 
+        When a timeout is given the ports are swept in parallel by
+        scanner.PortScanner instead, and ports may include ranges such as
+        '8000-8010'. Ports that are not open report their scanner state.
+
         :param ports: tuple, tuple containing integers (TCP/UDP ports).
         :param kind: string, port type TCP or UDP.
+        :param timeout: float, per-port connect timeout for the parallel sweep.
+        :param concurrency: integer, maximum connects in flight in the sweep.
         :return: list, list of formatted strings as:'\t\tTCP port 80: open'
 
         Example:
             element = Element(node, etype)
             element.check_socket(ports, kind)
         """
-        _port_list = []
-        for port in ports:
-            _result = super().check_socket(port)
-            _port_stat = '{} port {}: {}'.format(kind, port, _result)
-            _port_list.append('\t\t{}'.format(_port_stat))
-        return _port_list
-
-    def check_url(self, urls):
+        return [self.render(result) for result in
+                self.probe_sockets(ports, kind, timeout, concurrency)]
+
+    def probe_sockets(self, ports, kind, timeout=None, concurrency=1000):
+        """Same checks as check_socket() returning a list of
+        result.CheckResult records in port order. In the parallel sweep an
+        unanswered port is TIMEOUT and an unreachable one ERROR.
+
+        :return: list of result.CheckResult objects.
+        """
+        if timeout is None:
+            return [self.probe_socket(port, kind) for port in ports]
+        _ports = parse_ports(ports)
+        if self.breakers is not None:
+            _rejected = self.breakers.rejected(self.node, 'socket', self.node)
+            if _rejected is not None:
+                return [CheckResult('socket', self.node, _rejected.status, 0.0,
+                                    _rejected.detail, (kind, port))
+                        for port in _ports]
+        _results = {}
+        _scanner = PortScanner(timeout=timeout, concurrency=concurrency)
+        with metrics.CHECKS_IN_FLIGHT.track('socket'):
+            for result in _scanner.scan([self.node], _ports, kind):
+                _detail = result.detail if result.state == OPEN \
+                    else '{} ({})'.format(result.state, result.detail)
+                _results[result.port] = CheckResult(
+                    'socket', self.node,
+                    _SCAN_STATUS.get(result.state, Status.ERROR),
+                    result.latency or timeout, _detail, (kind, result.port))
+                metrics.observe(_results[result.port])
+        _results = [_results[port] for port in _ports]
+        if self.breakers is not None:
+            self.breakers.record_many(self.node, _results)
+        return _results
+
+    def check_url(self, urls, pool=None):
         """Calls Toolkit.check_socket() for each URL in tuple urls.
         Format the returned value as such: 'URL http://yahoo.com: open'.
         Insert each returned value into _url_list. Returns _url_list.
 
+        When an urlpool.HTTPPool is given the URLs are checked concurrently
+        over its persistent connections.
+
         :param urls: tuple, tuple containing formatted strings for each URL/URI
+        :param pool: urlpool.HTTPPool, optional connection pool.
         :return: list, list of strings in the form of url: result.
 
         Example:
             element = Element(node, etype)
             element.check_url(urls)
         """
-        _url_list = []
-        for url in urls:
-            _result = super().check_url(url)
-            _url_stat = 'URL {}: {}'.format(url, _result)
-            _url_list.append('\t\t{}'.format(_url_stat))
-        return _url_list
+        return [self.render(result) for result in self.probe_urls(urls, pool)]
+
+    def probe_urls(self, urls, pool=None):
+        """Same checks as check_url() returning a list of
+        result.CheckResult records in url order.
+
+        :return: list of result.CheckResult objects.
+        """
+        if pool is not None:
+            _results = {}
+            _hosts = {url: urllib.parse.urlsplit(url).hostname
+                      for url in urls} if self.breakers is not None else {}
+            for url, host in _hosts.items():
+                _rejected = host and self.breakers.rejected(host, 'url', url)
+                if _rejected:
+                    _results[url] = _rejected
+            _live = [url for url in urls if url not in _results]
+            with metrics.CHECKS_IN_FLIGHT.track('url'):
+                _checked = [self.url_result(result)
+                            for result in pool.check_many(_live)]
+            for url, result in zip(_live, _checked):
+                metrics.observe(result)
+                if _hosts.get(url):
+                    self.breakers.record(_hosts[url], result)
+                _results[url] = result
+            return [_results[url] for url in urls]
+        return [self.probe_url(url) for url in urls]
+
+    @classmethod
+    def render(cls, result):
+        """Renders a result.CheckResult the way the matching check_*()
+        method displays it.
+
+        :param result: result.CheckResult object.
+        :return: string.
+        """
+        if result.check == 'dns':
+            return cls.format_dns(result.params[0], result.detail)
+        if result.check == 'host':
+            return cls.format_host(result.detail)
+        if result.check == 'socket':
+            return cls.format_socket(result.params[0], result.params[1],
+                                     result.detail)
+        return cls.format_url(result.target, result.detail)
+
+    @staticmethod
+    def format_dns(qtype, result):
+        """Formats a Toolkit.check_dns() result for display."""
+        return '\t\tDNS {} records: {}'.format(qtype, result)
+
+    @staticmethod
+    def format_host(output):
+        """Filters a Toolkit.check_host() result down to the packet loss
+        counter for display.
+        """
+        try:
+            _filter = output.split('received, ')[1]  # filter
+            _refined = _filter[0:16].strip(', ')     # 0% packet loss
+            return '\t\tPing: {}'.format(_refined)
+        except IndexError:
+            return 'connection error'
+
+    @staticmethod
+    def format_socket(kind, port, result):
+        """Formats a Toolkit.check_socket() result as
+        '\\t\\tTCP port 80: open'.
+        """
+        _port_stat = '{} port {}: {}'.format(kind, port, result)
+        return '\t\t{}'.format(_port_stat)
+
+    @staticmethod
+    def format_url(url, result):
+        """Formats a Toolkit.check_url() result as
+        '\\t\\tURL http://yahoo.com: 200'.
+        """
+        _url_stat = 'URL {}: {}'.format(url, result)
+        return '\t\t{}'.format(_url_stat)
 
     def get_element(self):
         """Format self.node for display.
@@ -1,18 +1,65 @@
 #!/usr/bin/env python3
 
 __author__ = 'rafael'
-__version__ = '3.1.0'
+__version__ = '3.2.0'
 
+"""
+Gohan runs DNS, ping, socket and URL checks. Without arguments it starts the
+interactive menu; with a subcommand it checks every target given on the
+command line, in files or on stdin concurrently and streams one result per
+line as JSON Lines or CSV:
+
+    gohan.py dns -r 8.8.8.8 -r 1.1.1.1 -q A -q MX yahoo.com google.com
+    gohan.py ping -c 3 -f hosts.txt --format csv > ping.csv
+    gohan.py socket -p 22 -p 8000-8010 -f hosts.txt
+    cat urls.txt | gohan.py url -w 128 | jq 'select(.status != "ok")'
+
+The exit status is 0 when every check is ok and 1 otherwise. dnspython and
+the HTTP modules are only imported by the checks that need them.
+"""
+
+import argparse
+import csv
+import json
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from breaker import STATE_FILE, BreakerBoard
+from result import CheckResult, Status
 from toolkit import Toolkit
 
+# Resolvers behind the menu's int, ext and both choices. Set INTERNAL_DNS to
+# the site resolver; 'both' compares the two, so they must differ.
+INTERNAL_DNS = '8.8.8.8'
+EXTERNAL_DNS = '1.1.1.1'
+
 
 def get_dns(node, nservers='8.8.8.8', qtype='A'):
     """Calls Toolkit.check_dns([nservers], qtype) and format the
-    returned value.
+    returned value. When nservers is a list or qtype is a list, every query
+    type is checked against every resolver in one batch and resolvers that
+    disagree are flagged.
     """
-    dns = Toolkit(node=node)
-    result = dns.check_dns([nservers], qtype)
-    print('Record=[{}] Resolution=[{}]'.format(node, result))
+    if isinstance(nservers, str) and isinstance(qtype, str):
+        dns = Toolkit(node=node)
+        result = dns.check_dns([nservers], qtype)
+        print('Record=[{}] Resolution=[{}]'.format(node, result))
+        return
+    from dnsbatch import batch_query
+    if isinstance(nservers, str):
+        nservers = [nservers]
+    if isinstance(qtype, str):
+        qtype = [qtype]
+    result = batch_query([(node, kind) for kind in qtype], nservers)
+    split = result.disagreements()
+    for query in result.queries:
+        for resolver in result.nameservers:
+            print('Record=[{}] Type=[{}] Resolver=[{}] Resolution=[{}]{}'
+                  .format(node, query[1], resolver,
+                          result.matrix[query][resolver],
+                          ' Disagree=[yes]' if query in split else ''))
 
 
 def get_ping(node, count='25'):
@@ -45,17 +92,24 @@ def get_url(site):
 def input_handler(selection):
     if selection == '1':
         hostname = input('Hostname > ')
-        resolver = input('Enter DNS server [int] or ext > ')
-        if resolver == '' or resolver == 'int':
-            resolver = '8.8.8.8'  # Internal DNS server
-        elif resolver == 'ext' or resolver == 'EXT':
-            resolver = '8.8.8.8'  # External DNS server
-        else:
-            print('Enter internal [int] or ext.')
-            input_handler('1')
-        query_type = input('Enter query type [A-Record], CNAME, MX, PTR > ')
+        resolver = None
+        while resolver is None:
+            resolver = input('Enter DNS server [int], ext or both > ')
+            if resolver == '' or resolver == 'int':
+                resolver = INTERNAL_DNS
+            elif resolver == 'ext' or resolver == 'EXT':
+                resolver = EXTERNAL_DNS
+            elif resolver == 'both' or resolver == 'BOTH':
+                resolver = [INTERNAL_DNS, EXTERNAL_DNS]
+            else:
+                print('Enter internal [int] or ext.')
+                resolver = None
+        query_type = input('Enter query type [A-Record], CNAME, MX, PTR '
+                           '(comma separated for several) > ')
         if query_type == '':
             query_type = 'A'
+        elif ',' in query_type:
+            query_type = [kind.strip() for kind in query_type.split(',')]
         get_dns(hostname, resolver, query_type)
     elif selection == '2':
         hostname = input('Hostname > ')
@@ -77,7 +131,260 @@ def input_handler(selection):
         print('\nInvalid selection; try again or Ctrl-C to exit.')
 
 
-def main():
+FIELDS = ('check', 'target', 'status', 'latency', 'detail', 'params')
+
+
+def read_targets(paths, targets=()):
+    """Yields targets from the command line, then from each file, one per
+    line; '-' reads stdin. Blank lines and lines starting with '#' are
+    skipped.
+
+    :param paths: list of strings, files.
+    :param targets: list of strings, targets given as arguments.
+    :return: generator of strings.
+    """
+    for target in targets:
+        yield target
+    for path in paths:
+        _source = sys.stdin if path == '-' else open(path, 'r')
+        try:
+            for line in _source:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            if _source is not sys.stdin:
+                _source.close()
+
+
+def guarded_task(check, target, params, function):
+    """Wraps a check so that an exception, such as a malformed target or
+    resolver, becomes a Status.ERROR result instead of ending the run.
+
+    :param function: callable returning a result.CheckResult.
+    :return: callable.
+    """
+    def _run():
+        _start = time.perf_counter()
+        try:
+            return function()
+        except Exception as e:
+            return CheckResult(check, target, Status.ERROR,
+                               time.perf_counter() - _start,
+                               str(e) or repr(e), params)
+    return _run
+
+
+def dns_tasks(targets, args):
+    _resolvers = args.resolver or ['8.8.8.8']
+    for target in targets:
+        for qtype in args.qtype or ['A']:
+            yield guarded_task(
+                'dns', target, (qtype.upper(), tuple(_resolvers)),
+                lambda node=target, kind=qtype: Toolkit(node).probe_dns(
+                    _resolvers, kind.upper(), timeout=args.timeout))
+
+
+def ping_tasks(targets, args):
+    for target in targets:
+        yield guarded_task(
+            'host', target, (args.count,),
+            lambda node=target: Toolkit(node).probe_host(
+                args.count, args.timeout, args.interval))
+
+
+def split_port(target):
+    """Splits 'host:port' or '[IPv6]:port'.
+
+    :return: tuple, (host, port integer or None); bare IPv6 addresses such
+    as '::1' have no port.
+    """
+    if target.startswith('['):
+        _host, _, _rest = target[1:].partition(']')
+        _port = _rest[1:] if _rest.startswith(':') else ''
+        return _host, int(_port) if _port.isdigit() else None
+    if target.count(':') == 1:
+        _host, _, _port = target.partition(':')
+        if _host and _port.isdigit():
+            return _host, int(_port)
+    return target, None
+
+
+def socket_tasks(targets, args):
+    from scanner import parse_ports
+    _ports = parse_ports(args.port or [])
+    _kind = args.kind.upper()
+    for target in targets:
+        _node, _port = split_port(target)
+        if _port is None and not _ports:
+            yield guarded_task('socket', _node, (_kind, None),
+                               lambda target=target: _no_port(target))
+            continue
+        for port in [_port] if _port is not None else _ports:
+            yield guarded_task(
+                'socket', _node, (_kind, port),
+                lambda node=_node, port=port: Toolkit(node).probe_socket(
+                    port, _kind, args.timeout))
+
+
+def _no_port(target):
+    raise ValueError('{}: no port; use -p or host:port'.format(target))
+
+
+def url_tasks(targets, args):
+    from urlpool import HTTPPool
+    args.pool = HTTPPool(timeout=args.timeout)  # closed by cli()
+    for target in targets:
+        yield guarded_task('url', target, (),
+                           lambda url=target: Toolkit().probe_url(url,
+                                                                  args.pool))
+
+
+TASKS = {'dns': dns_tasks, 'ping': ping_tasks, 'socket': socket_tasks,
+         'url': url_tasks}
+
+
+class ResultWriter:
+    """Writes result.CheckResult records as JSON Lines or CSV, one line per
+    result, flushed as it is written so downstream tools see it right away.
+    """
+    def __init__(self, stream, fmt='jsonl'):
+        self.stream = stream
+        self.fmt = fmt
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.writer(stream)
+            self._csv.writerow(FIELDS)
+        self._lock = threading.Lock()
+
+    def write(self, result):
+        _row = list(result.as_tuple())
+        _row[5] = list(_row[5])
+        with self._lock:
+            if self._csv is not None:
+                _row[5] = ' '.join(map(str, _flatten(_row[5])))
+                self._csv.writerow(_row)
+            else:
+                self.stream.write(json.dumps(dict(zip(FIELDS, _row))) + '\n')
+            self.stream.flush()
+
+
+def _flatten(values):
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            yield from _flatten(value)
+        else:
+            yield value
+
+
+def run_tasks(tasks, writer, workers=64):
+    """Runs task callables on a thread pool, keeping at most workers * 2
+    queued so targets can be streamed from a large file, and writes each
+    result as it completes.
+
+    :return: tuple, (results, results not ok).
+    """
+    _count = _failed = 0
+    _pending = set()
+
+    def _drain(return_when):
+        nonlocal _count, _failed, _pending
+        _done, _pending = wait(_pending, return_when=return_when)
+        for future in _done:
+            _result = future.result()
+            writer.write(_result)
+            _count += 1
+            _failed += not _result.ok
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for task in tasks:
+            _pending.add(executor.submit(task))
+            if len(_pending) >= workers * 2:
+                _drain(FIRST_COMPLETED)
+        while _pending:
+            _drain(FIRST_COMPLETED)
+    return _count, _failed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='gohan', description='Check many targets concurrently. Run '
+        'without arguments for the interactive menu.')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('targets', nargs='*',
+                        help='targets; stdin is read when none are given '
+                             'and no --file is used')
+    common.add_argument('-f', '--file', action='append', default=[],
+                        help="file with one target per line; '-' is stdin")
+    common.add_argument('-o', '--format', choices=('jsonl', 'csv'),
+                        default='jsonl', help='output format (jsonl)')
+    common.add_argument('-w', '--workers', type=int, default=64,
+                        help='checks in flight (64)')
+    common.add_argument('-t', '--timeout', type=float, default=2.0,
+                        help='seconds per check (2)')
+    commands = parser.add_subparsers(dest='check', metavar='CHECK')
+    dns = commands.add_parser('dns', parents=[common],
+                              help='resolve names')
+    dns.add_argument('-r', '--resolver', action='append',
+                     help='DNS server; repeat for several (8.8.8.8)')
+    dns.add_argument('-q', '--qtype', action='append',
+                     help='A, CNAME, MX or PTR; repeat for several (A)')
+    ping = commands.add_parser('ping', parents=[common],
+                               help='send ICMP echo requests')
+    ping.add_argument('-c', '--count', type=int, default=9,
+                      help='echo requests per target (9)')
+    ping.add_argument('-i', '--interval', type=float, default=.2,
+                      help='seconds between echo requests (0.2)')
+    sockets = commands.add_parser('socket', parents=[common],
+                                  help='connect to ports; targets may be '
+                                       'host:port or [IPv6]:port')
+    sockets.add_argument('-p', '--port', action='append',
+                         help="port or range such as '8000-8010'; repeat "
+                              "for several")
+    sockets.add_argument('-k', '--kind', default='TCP',
+                         choices=('TCP', 'UDP', 'tcp', 'udp'))
+    commands.add_parser('url', parents=[common],
+                        help='fetch URLs and report the HTTP status')
+    return parser
+
+
+def cli(argv):
+    """Runs one non-interactive subcommand.
+
+    :param argv: list of strings, arguments after the program name.
+    :return: integer, exit status.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.check is None:
+        parser.print_help()
+        return 2
+    if args.check == 'socket' and not args.port and args.targets and \
+            not args.file and all(split_port(target)[1] is None
+                                  for target in args.targets):
+        parser.error('socket needs -p or host:port targets')
+    _files = args.file or ([] if args.targets else ['-'])
+    _tasks = TASKS[args.check](read_targets(_files, args.targets), args)
+    _writer = ResultWriter(sys.stdout, args.format)
+    try:
+        _count, _failed = run_tasks(_tasks, _writer, args.workers)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:  # e.g. piped into head
+        return 0
+    finally:
+        if getattr(args, 'pool', None) is not None:
+            args.pool.close()
+    return 1 if _failed else 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return cli(argv)
+
+    # Hosts that stopped answering fail fast until their breaker retries.
+    Toolkit.breakers = BreakerBoard(STATE_FILE)
 
     while True:
         print('''\033[1m\033[91m
@@ -101,10 +408,11 @@ def main():
                 input_handler(option)
             else:
                 print('\nInvalid selection; try again or Ctrl-C to exit.')
+            Toolkit.breakers.save()
 
         except KeyboardInterrupt:
             print('\nGoodbye')
             exit()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -1,32 +1,354 @@
 __author__ = 'rafael'
 
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from breaker import STATE_FILE, BreakerBoard
+from pool import ConnectionPool
+from sink import JobWriter
 from ssh import SSH
 
 
-def create_record(job_name, device_formatted, cmd_output):
-    with open(job_name, 'a') as output_file:
-        output_file.write(device_formatted)
-        output_file.write(cmd_output)
+def open_job(job_name, fmt='text'):
+    """Opens the output of a job.
+
+    :param job_name: string, job file, or store directory for 'store'.
+    :param fmt: string, 'text', 'jsonl' or 'store'; 'store' records only
+    changed outputs and their diffs in a configstore.ConfigStore.
+    :return: sink.JobWriter or configstore.StoreWriter object.
+    """
+    if fmt == 'store':
+        from configstore import StoreWriter
+        return StoreWriter(job_name)
+    return JobWriter(job_name, fmt=fmt)
 
 
-def dispatcher(device_file, commands, job_name):
+def dispatcher(device_file, commands, job_name, fmt='text', breakers=None):
     try:
-        with open(device_file, 'r') as devices:
+        with open(device_file, 'r') as devices, \
+                open_job(job_name, fmt) as job:
             for device in devices:
                 try:
                     device_formatted = '\nDevice [{}]:\n'.format(device.strip())
                     print(device_formatted, end='')
-                    for k, v in SSH().commander(device, commands).items():
+                    _output = SSH(breakers=breakers).commander(device,
+                                                              commands)
+                    if _output is None:
+                        _error = 'Unable to connect to {}.'.format(
+                            device.strip())
+                        print(_error)
+                        job.write_device(device, error=_error)
+                        continue
+                    for k, v in _output.items():
                         cmd_output = '{}\n{}'.format(k, v)
                         print(cmd_output.strip())
-                        create_record(job_name, device_formatted, cmd_output)
+                    job.write_device(device, _output)
                 except OSError as e:
                     print(e)
-                    cmd_output = str(e)
-                    create_record(job_name, device_formatted, cmd_output+'\n')
+                    job.write_device(device, error=str(e))
+
+    except FileNotFoundError as e:
+        print(e)
+    if breakers is not None:
+        breakers.save()
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers.
+
+    :param samples: list of floats.
+    :param pct: integer, percentile between 0 and 100.
+    :return: float, the percentile value or 0.0 for an empty list.
+    """
+    if not samples:
+        return 0.0
+    _ordered = sorted(samples)
+    _rank = max(1, -(-pct * len(_ordered) // 100))  # ceiling
+    return _ordered[_rank - 1]
+
+
+def run_device(device, commands, timeout=None, pool=None, breakers=None):
+    """Runs commands against a single device and times it. Used as the unit
+    of work for parallel_dispatcher().
+
+    :param device: string, IP address or hostname.
+    :param commands: list, list of commands executed against device.
+    :param timeout: float, seconds allowed for connect, auth and each command.
+    :param pool: pool.ConnectionPool, optional pool shared across devices.
+    :param breakers: breaker.BreakerBoard, devices whose breaker is open
+    fail right away.
+    :return: tuple, (output dict or error string, wall time in seconds,
+    True if the device failed).
+    """
+    _start = time.monotonic()
+    try:
+        _output = SSH(timeout=timeout, pool=pool, breakers=breakers)\
+            .commander(device, commands)
+        if _output is None:
+            _output, _failed = 'Unable to connect to {}.'.format(device), True
+        else:
+            _failed = False
+    except (Exception, SystemExit) as e:  # SSH.get_client() calls exit()
+        _output, _failed = str(e) or repr(e), True
+    return _output, time.monotonic() - _start, _failed
+
+
+def parallel_dispatcher(device_file, commands, job_name, max_workers=20,
+                        timeout=30, pool=None, fmt='text', breakers=None):
+    """Fans commands out across the devices in device_file using a bounded
+    thread pool. Results are written to job_name grouped per device and in the
+    same order as the device file, regardless of completion order.
+
+    Example:
+        stats = parallel_dispatcher('my_devices.txt', ['pwd'], 'job.txt')
+
+    :param device_file: string, file with one IP address or hostname per line.
+    :param commands: list, list of commands executed against each device.
+    :param job_name: string, output file name.
+    :param max_workers: integer, maximum number of devices in flight.
+    :param timeout: float, per-device connect, auth and command timeout.
+    :param pool: pool.ConnectionPool, optional pool so repeated jobs and
+    follow-up SCP pulls reuse open transports.
+    :param fmt: string, job file format: 'text' or 'jsonl'; a job_name
+    ending in '.gz' is gzip compressed. 'store' treats job_name as a
+    configstore directory and keeps only outputs that changed.
+    :param breakers: breaker.BreakerBoard, per-device circuit breakers;
+    devices that keep timing out are skipped on later runs until their retry
+    time. The board is saved when the job ends.
+    :return: dict, run statistics or None if device_file is missing.
+    """
+    _devices = read_devices(device_file)
+    if _devices is None:
+        return None
+
+    _durations = []
+    _failures = 0
+    _start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            open_job(job_name, fmt) as job:
+        _futures = [executor.submit(run_device, device, commands, timeout,
+                                    pool, breakers) for device in _devices]
+        # Collect in submission order so the job file stays grouped and
+        # ordered by device while workers keep running in the background.
+        for device, future in zip(_devices, _futures):
+            _output, _elapsed, _failed = future.result()
+            _durations.append(_elapsed)
+            _failures += write_result(job, device, _output, _failed)
+    _total = time.monotonic() - _start
+    if breakers is not None:
+        breakers.save()
+    return _report(len(_devices), _failures, _durations, _total, job)
 
+
+def read_devices(device_file):
+    """:return: list of device names in device_file, or None if it is
+    missing.
+    """
+    try:
+        with open(device_file, 'r') as devices:
+            return [device.strip() for device in devices if device.strip()]
     except FileNotFoundError as e:
         print(e)
+        return None
+
+
+def write_result(job, device, output, failed):
+    """Prints one device's outcome and writes it to job.
+
+    :return: integer, 1 if the device failed, otherwise 0.
+    """
+    device_formatted = '\nDevice [{}]:\n'.format(device)
+    print(device_formatted, end='')
+    if failed:
+        print(output)
+        job.write_device(device, error=output)
+        return 1
+    for k, v in output.items():
+        cmd_output = '{}\n{}'.format(k, v)
+        print(cmd_output.strip())
+    job.write_device(device, output)
+    return 0
+
+
+def _report(devices, failures, durations, total, job):
+    stats = {
+        'devices': devices,
+        'failures': failures,
+        'elapsed': round(total, 3),
+        'devices_per_sec': round(devices / total, 3) if total else 0.0,
+        'p50': round(percentile(durations, 50), 3),
+        'p95': round(percentile(durations, 95), 3),
+    }
+    print('\nDevices: {devices} Failures: {failures} Elapsed: {elapsed}s '
+          'Rate: {devices_per_sec}/s p50: {p50}s p95: {p95}s'.format(**stats))
+    if getattr(job, 'counts', None) is not None:  # configstore.StoreWriter
+        stats.update(job.counts)
+        print('Outputs new: {new} changed: {changed} unchanged: {unchanged}'
+              .format(**job.counts))
+    return stats
+
+
+def default_shards():
+    """:return: integer, cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        return os.cpu_count() or 1
+
+
+def sharded_dispatcher(device_file, commands, job_name, shards=None,
+                       max_workers=20, timeout=30, fmt='text',
+                       breaker_file=None, max_per_host=4):
+    """Same job as parallel_dispatcher(), split across shards worker
+    processes so SSH key exchange and encryption, which paramiko does in
+    Python, use every core instead of one. Devices are dealt round-robin to
+    the shards; each shard runs max_workers devices at once over its own
+    pool.ConnectionPool. Results flow over a queue to a single writer
+    process, so devices are written in completion order, each as one block.
+
+    Ctrl-C stops the shards from starting new devices; devices in flight
+    finish and are written before the job file is closed.
+
+    Example:
+        stats = sharded_dispatcher('my_devices.txt', ['pwd'], 'job.txt')
+
+    :param shards: integer, worker processes; None uses one per available
+    core, never more than there are devices.
+    :param max_workers: integer, devices in flight per shard.
+    :param breaker_file: string, breaker.BreakerBoard state file shared by
+    the shards; the writer saves the merged state when the job ends.
+    :param max_per_host: integer, pooled clients per device in each shard.
+    :return: dict, run statistics as parallel_dispatcher() plus 'shards',
+    or None if device_file is missing.
+    """
+    _devices = read_devices(device_file)
+    if _devices is None:
+        return None
+    import multiprocessing
+    shards = max(1, min(shards or default_shards(), len(_devices)))
+    _context = multiprocessing.get_context()
+    _results = _context.Queue(maxsize=max(1024, 4 * shards * max_workers))
+    _stop = _context.Event()
+    _receiver, _sender = _context.Pipe(duplex=False)
+    _writer = _context.Process(
+        target=_shard_writer, name='goten-writer',
+        args=(_results, _sender, job_name, fmt, breaker_file))
+    _workers = [_context.Process(
+        target=_shard_worker, name='goten-shard-{}'.format(index),
+        args=(_devices[index::shards], commands, timeout, max_workers,
+              max_per_host, breaker_file, _results, _stop))
+        for index in range(shards)]
+    # The parent handles Ctrl-C and tells the shards to stop through _stop;
+    # children inherit the ignored SIGINT, so there is no window in which a
+    # Ctrl-C kills one of them before it could ignore it itself.
+    _handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        _writer.start()
+        for worker in _workers:
+            worker.start()
+    finally:
+        signal.signal(signal.SIGINT, _handler)
+    # Only the writer holds the sending end now, so recv() raises EOFError
+    # instead of blocking forever if the writer dies.
+    _sender.close()
+    _stats = None
+    try:
+        try:
+            _alive = _join(_workers, _writer)
+        except KeyboardInterrupt:
+            print('\nStopping; waiting for devices in flight.')
+            _stop.set()
+            _alive = _join(_workers, _writer)
+        if _alive:
+            _results.put(None)  # every shard has exited; the writer may finish
+            try:
+                _stats = _receiver.recv()
+            except EOFError:
+                pass
+        _writer.join()
+    except KeyboardInterrupt:
+        print('\nGoodbye')
+        _abort(_workers + [_writer], _results)
+        return None
+    if _stats is None:
+        print('The writer process failed (exit code {}); job stopped.'
+              .format(_writer.exitcode))
+        _abort(_workers, _results)
+        return None
+    _stats['shards'] = shards
+    return _stats
+
+
+def _join(workers, writer):
+    """Waits for workers to exit.
+
+    :return: bool, False as soon as writer is found dead; workers may then
+    be blocked on the full results queue and never exit on their own.
+    """
+    for worker in workers:
+        while worker.is_alive():
+            if not writer.is_alive():
+                return False
+            worker.join(0.5)
+    return True
+
+
+def _abort(processes, results):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+    # Nobody will read what is left in the queue; do not wait to flush it.
+    results.cancel_join_thread()
+
+
+def _shard_worker(devices, commands, timeout, max_workers, max_per_host,
+                  breaker_file, results, stop):
+    _pool = ConnectionPool(max_per_host=max_per_host)
+    _breakers = BreakerBoard(breaker_file) if breaker_file else None
+
+    def _run(device):
+        if stop.is_set():
+            return None
+        return run_device(device, commands, timeout, _pool, _breakers)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            _futures = {executor.submit(_run, device): device
+                        for device in devices}
+            for future in as_completed(_futures):
+                _outcome = future.result()
+                if _outcome is not None:
+                    results.put(('device', _futures[future]) + _outcome)
+    finally:
+        _pool.close_all()
+        if _breakers is not None:
+            _states = _breakers.snapshot()
+            results.put(('breakers', {
+                device: _states.get(_breakers.key(device))
+                for device in devices}))
+
+
+def _shard_writer(results, sender, job_name, fmt, breaker_file):
+    _breakers = BreakerBoard(breaker_file) if breaker_file else None
+    _durations = []
+    _failures = 0
+    _start = time.monotonic()
+    with open_job(job_name, fmt) as job:
+        for message in iter(results.get, None):
+            if message[0] == 'breakers':
+                if _breakers is not None:
+                    _breakers.update(message[1])
+                continue
+            _, device, _output, _elapsed, _failed = message
+            _durations.append(_elapsed)
+            _failures += write_result(job, device, _output, _failed)
+    if _breakers is not None:
+        _breakers.save()
+    sender.send(_report(len(_durations), _failures, _durations,
+                        time.monotonic() - _start, job))
 
 
 def main():
@@ -36,6 +358,21 @@ def main():
         job_name = input('Enter a name for the output file > ')
     device_file = input('Enter the name of the device file > ')
     commands = input('Enter commands using comma separation > ').split(',')
+    workers = input('Enter number of devices to run in parallel [1] > ')
+    workers = int(workers) if workers.isdigit() and int(workers) > 0 else 1
+    shards = input('Enter number of processes [1], or auto for one per '
+                   'core > ')
+    if shards == 'auto':
+        shards = default_shards()
+    shards = int(shards) if str(shards).isdigit() and int(shards) > 0 else 1
+    fmt = input('Output format [text], jsonl, text.gz, jsonl.gz or store '
+                '(keep changes only) > ')
+    if fmt not in ('text', 'jsonl', 'text.gz', 'jsonl.gz', 'store'):
+        fmt = 'text'
+    extension = {'text': '.txt', 'jsonl': '.jsonl',
+                 'store': ''}[fmt.split('.')[0]]
+    if fmt.endswith('.gz'):
+        extension += '.gz'
 
     print('Review job settings; '
           'enter 1 to proceed or any key to edit the job.')
@@ -43,12 +380,26 @@ def main():
     print('\tJob name: {}'.format(job_name))
     print('\tDevice file name: {}'.format(device_file))
     print('\tCommands to execute: {}'.format(commands))
+    print('\tParallel devices: {}'.format(workers))
+    print('\tProcesses: {}'.format(shards))
+    print('\tOutput format: {}'.format(fmt))
     commit = input()
     if commit == '1':
-        dispatcher(device_file, commands, job_name+'.txt')
+        breakers = BreakerBoard(STATE_FILE)
+        if shards > 1:
+            sharded_dispatcher(device_file, commands, job_name+extension,
+                               shards=shards, max_workers=workers,
+                               fmt=fmt.split('.')[0], breaker_file=STATE_FILE)
+        elif workers > 1:
+            parallel_dispatcher(device_file, commands, job_name+extension,
+                                max_workers=workers, fmt=fmt.split('.')[0],
+                                breakers=breakers)
+        else:
+            dispatcher(device_file, commands, job_name+extension,
+                       fmt=fmt.split('.')[0], breakers=breakers)
     else:
         main()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
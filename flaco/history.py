@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Local check history. Every series (check, target, parameters) keeps its
+samples in memory-mapped columnar segment files, one per period (a day by
+default), so months of 1-minute checks on thousands of targets stay on disk
+without a database server.
+
+Segment layout (native byte order, fixed width):
+
+    header   magic, base timestamp (ms), count, capacity
+    offsets  uint32[capacity], ms since the segment base (delta encoding)
+    latency  float32[capacity], seconds; NaN when unknown
+    status   uint8[capacity], index into result.Status
+
+Offsets are kept sorted, so range queries are a binary search on the offset
+column. compact() trims sealed segments to size, rolls raw segments older
+than the raw retention up into fixed buckets (count, failures, count of
+known latencies, min, max, sum of latency) and drops rollups older than the
+rollup retention.
+
+>>> import time
+>>> from history import ResultStore
+>>> from toolkit import Toolkit
+>>> store = ResultStore('history')
+>>> store.record(Toolkit('yahoo.com').probe_socket(443, 'TCP', timeout=2))
+>>> key = store.series()[0]
+>>> key
+'["socket", "yahoo.com", ["TCP", 443]]'
+>>> store.range(key, time.time() - 3600)
+[(1792270631.204, 0.021, <Status.OK: 'ok'>)]
+>>> store.rollup(key, time.time() - 86400, step=3600)
+[(1792270800, 1, 0, 0.021, 0.021, 0.021)]
+>>> store.compact()
+>>> store.close()
+
+"""
+
+import bisect
+import collections
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from result import Status
+
+_MAGIC = b'FLTS' if sys.byteorder == 'little' else b'STLF'
+_HEADER = struct.Struct('=4sqII')   # magic, base ms, count, capacity
+_ROLLUP = struct.Struct('=qIIIfff')  # start, count, failures, known,
+                                     # min, max, sum
+_STATUS = list(Status)
+_CODE = {status: code for code, status in enumerate(_STATUS)}
+_DAY = 86400
+
+
+def series_key(result):
+    """Returns the series key of a result.CheckResult.
+
+    :return: string, JSON list of check, target and params.
+    """
+    return json.dumps([result.check, result.target, result.params])
+
+
+class Segment:
+    """One memory-mapped columnar segment of a series.
+
+    Attributes:
+        path: string, segment file.
+        base: integer, segment start in ms since the epoch.
+        count: integer, samples stored.
+        capacity: integer, samples that fit before the file grows.
+    """
+    def __init__(self, path, base=None, capacity=1024):
+        """Opens path, creating it with the given base if it does not exist.
+
+        :param path: string, segment file.
+        :param base: integer, segment start in ms; required for new files.
+        :param capacity: integer, initial capacity of a new file.
+        :raises ValueError: the file is not a segment of this byte order.
+        """
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, 'wb') as target:
+                target.write(_HEADER.pack(_MAGIC, base, 0, capacity))
+                target.truncate(self._size(capacity))
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        _magic, self.base, self.count, self.capacity = _HEADER.unpack_from(
+            self._map)
+        if _magic != _MAGIC:
+            self.close()
+            raise ValueError('{} is not a segment file.'.format(path))
+
+    @staticmethod
+    def _size(capacity):
+        return _HEADER.size + 9 * capacity
+
+    def _columns(self):
+        _offsets = _HEADER.size
+        _latency = _offsets + 4 * self.capacity
+        _status = _latency + 4 * self.capacity
+        _view = memoryview(self._map)
+        return (_view[_offsets:_latency].cast('I'),
+                _view[_latency:_status].cast('f'),
+                _view[_status:_status + self.capacity])
+
+    def append(self, offset, latency, code):
+        """Stores one sample, keeping the offset column sorted.
+
+        :param offset: integer, ms since self.base.
+        :param latency: float, seconds; NaN when unknown.
+        :param code: integer, index into result.Status.
+        """
+        if self.count == self.capacity:
+            self.resize(self.capacity * 2)
+        _offsets, _latency, _status = self._columns()
+        try:
+            _position = self.count
+            if _position and _offsets[_position - 1] > offset:
+                # Results finishing out of order land near the end.
+                _position = bisect.bisect_right(_offsets, offset, 0,
+                                                self.count)
+                for column in (_offsets, _latency, _status):
+                    column[_position + 1:self.count + 1] = \
+                        column[_position:self.count]
+            _offsets[_position] = offset
+            _latency[_position] = latency
+            _status[_position] = code
+        finally:
+            for column in (_offsets, _latency, _status):
+                column.release()
+        self.count += 1
+        _HEADER.pack_into(self._map, 0, _MAGIC, self.base, self.count,
+                          self.capacity)
+
+    def select(self, start=None, end=None):
+        """Returns the samples with start <= offset < end.
+
+        :return: tuple of lists, (offsets, latencies, status codes).
+        """
+        _offsets, _latency, _status = self._columns()
+        try:
+            _low = 0 if start is None else bisect.bisect_left(
+                _offsets, start, 0, self.count)
+            _high = self.count if end is None else bisect.bisect_left(
+                _offsets, end, _low, self.count)
+            return (_offsets[_low:_high].tolist(),
+                    _latency[_low:_high].tolist(),
+                    _status[_low:_high].tolist())
+        finally:
+            for column in (_offsets, _latency, _status):
+                column.release()
+
+    def resize(self, capacity):
+        """Moves the columns to a new capacity; used to grow a segment and
+        to trim a sealed one.
+        """
+        _offsets, _latency, _status = self.select()
+        self._map.resize(self._size(capacity))
+        self.capacity = capacity
+        _columns = self._columns()
+        try:
+            for column, values, kind in zip(
+                    _columns, (_offsets, _latency, _status), 'IfB'):
+                column[:len(values)] = memoryview(
+                    struct.pack('={}{}'.format(len(values), kind), *values)
+                ).cast(kind)
+        finally:
+            for column in _columns:
+                column.release()
+        _HEADER.pack_into(self._map, 0, _MAGIC, self.base, self.count,
+                          self.capacity)
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class ResultStore:
+    """Directory of per-series segment and rollup files.
+
+    Example:
+        store = ResultStore(path)
+        store.record(check_result)
+        store.range(key, start, end)
+        daemon.add('history', store, 'compact', interval=3600)
+    """
+    def __init__(self, path, period=_DAY, resolution=3600,
+                 raw_retention=30 * _DAY, rollup_retention=400 * _DAY,
+                 max_open=512):
+        """Opens or creates a store.
+
+        :param path: string, store directory.
+        :param period: integer, seconds covered by one segment; at most 49
+        days so ms offsets fit in 32 bits.
+        :param resolution: integer, rollup bucket in seconds; must divide
+        period.
+        :param raw_retention: integer, seconds raw samples are kept.
+        :param rollup_retention: integer, seconds rollups are kept.
+        :param max_open: integer, segments kept mapped at once.
+        """
+        if period * 1000 >= 1 << 32 or period % resolution:
+            raise ValueError('period must be under 49 days and a multiple '
+                             'of resolution.')
+        self.path = path
+        self.period = period
+        self.resolution = resolution
+        self.raw_retention = raw_retention
+        self.rollup_retention = rollup_retention
+        self.max_open = max_open
+        self._open = collections.OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def record(self, result, timestamp=None):
+        """Stores a result.CheckResult, or a list of them.
+
+        :param timestamp: float, time.time() of the check; defaults to now.
+        """
+        _results = result if isinstance(result, (list, tuple)) else [result]
+        _timestamp = time.time() if timestamp is None else timestamp
+        for item in _results:
+            self.append(series_key(item), _timestamp, item.latency,
+                        item.status)
+
+    def append(self, key, timestamp, latency, status):
+        """Stores one sample.
+
+        :param key: string, series key.
+        :param timestamp: float, seconds since the epoch.
+        :param latency: float, seconds; None when unknown.
+        :param status: result.Status member.
+        """
+        _ms = int(timestamp * 1000)
+        _base = _ms - _ms % (self.period * 1000)
+        with self._lock:
+            _segment = self._segment(key, _base, create=True)
+            _segment.append(_ms - _base,
+                            math.nan if latency is None else latency,
+                            _CODE[status])
+
+    def series(self):
+        """Returns every series key in the store, sorted."""
+        _keys = []
+        for name in os.listdir(self.path):
+            try:
+                with open(os.path.join(self.path, name, 'key'), 'r') as source:
+                    _keys.append(source.read())
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return sorted(_keys)
+
+    def range(self, key, start, end=None):
+        """Raw samples of a series with start <= timestamp < end.
+
+        :param start: float, seconds since the epoch.
+        :param end: float, defaults to now.
+        :return: list of (timestamp, latency, result.Status) tuples; latency
+        is None when unknown.
+        """
+        _samples = []
+        for base, offsets, latencies, codes in self._scan(key, start, end):
+            _samples.extend(
+                ((base + offset) / 1000,
+                 None if math.isnan(latency) else round(latency, 6),
+                 _STATUS[code])
+                for offset, latency, code in zip(offsets, latencies, codes))
+        return _samples
+
+    def rollup(self, key, start, end=None, step=3600):
+        """Downsamples a series into buckets of step seconds, combining raw
+        samples with rollups of compacted data.
+
+        :param step: integer, bucket size; for compacted data use a multiple
+        of self.resolution.
+        :return: list of (bucket start, count, failures, min, avg, max)
+        tuples; failures are samples whose status is not OK.
+        """
+        _end = time.time() if end is None else end
+        _buckets = {}
+        for row in self._rollups(key):
+            if start <= row[0] < _end:
+                _bucket, _count, _failures, _known, _low, _high, _total = row
+                if not _known:
+                    _low, _high = math.inf, -math.inf
+                self._merge(_buckets, _bucket - _bucket % step, _count,
+                            _failures, _known, _low, _high, _total)
+        for base, offsets, latencies, codes in self._scan(key, start, _end):
+            self._bucket(_buckets, base, offsets, latencies, codes, step)
+        return [(bucket, count, failures,
+                 round(low, 6) if known else None,
+                 round(total / known, 6) if known else None,
+                 round(high, 6) if known else None)
+                for bucket, (count, failures, known, low, high, total)
+                in sorted(_buckets.items())]
+
+    def flaps(self, key, start, end=None):
+        """Counts changes between OK and not OK in the raw samples, a
+        measure of flapping.
+
+        :return: integer.
+        """
+        _flaps = 0
+        _previous = None
+        for _, _, status in self.range(key, start, end):
+            _ok = status is Status.OK
+            if _previous is not None and _ok != _previous:
+                _flaps += 1
+            _previous = _ok
+        return _flaps
+
+    def compact(self, now=None):
+        """Applies retention: trims sealed segments to their sample count,
+        rolls up segments older than raw_retention and removes them, and
+        drops rollups older than rollup_retention.
+
+        :param now: float, seconds since the epoch; defaults to now.
+        """
+        _now = time.time() if now is None else now
+        _current = int(_now) - int(_now) % self.period
+        _raw_cutoff = (_now - self.raw_retention) * 1000
+        _rollup_cutoff = _now - self.rollup_retention
+        with self._lock:
+            for name in os.listdir(self.path):
+                _directory = os.path.join(self.path, name)
+                if not os.path.isfile(os.path.join(_directory, 'key')):
+                    continue
+                _expired = []
+                for base in self._bases(_directory):
+                    if base + self.period * 1000 <= _raw_cutoff:
+                        _expired.append(base)
+                    elif base < _current * 1000:
+                        self._trim(_directory, base)
+                self._roll_up(_directory, _expired, _rollup_cutoff)
+
+    def flush(self):
+        """Flushes mapped segments to disk."""
+        with self._lock:
+            for segment in self._open.values():
+                segment.flush()
+
+    def close(self):
+        """Unmaps every open segment."""
+        with self._lock:
+            for segment in self._open.values():
+                segment.close()
+            self._open.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _directory(self, key):
+        return os.path.join(self.path, hashlib.sha1(
+            key.encode('utf-8')).hexdigest()[:20])
+
+    @staticmethod
+    def _bases(directory):
+        return sorted(int(name[:-4]) for name in os.listdir(directory)
+                      if name.endswith('.seg'))
+
+    def _segment(self, key, base, create=False):
+        _directory = self._directory(key)
+        if create and not os.path.isdir(_directory):
+            os.makedirs(_directory, exist_ok=True)
+            with open(os.path.join(_directory, 'key'), 'w') as target:
+                target.write(key)
+        return self._segment_at(_directory, base)
+
+    def _segment_at(self, directory, base):
+        _path = os.path.join(directory, '{}.seg'.format(base))
+        _segment = self._open.get(_path)
+        if _segment is not None:
+            self._open.move_to_end(_path)
+            return _segment
+        _segment = Segment(_path, base)
+        self._open[_path] = _segment
+        if len(self._open) > self.max_open:
+            self._open.popitem(last=False)[1].close()
+        return _segment
+
+    def _scan(self, key, start, end):
+        _directory = self._directory(key)
+        if not os.path.isdir(_directory):
+            return
+        _start = int(start * 1000)
+        _end = int((time.time() if end is None else end) * 1000)
+        for base in self._bases(_directory):
+            if base + self.period * 1000 <= _start or base >= _end:
+                continue
+            with self._lock:
+                _columns = self._segment_at(_directory, base).select(
+                    _start - base if _start > base else None, _end - base)
+            yield (base,) + _columns
+
+    def _trim(self, directory, base):
+        _path = os.path.join(directory, '{}.seg'.format(base))
+        with open(_path, 'rb') as source:
+            _, _, _count, _capacity = _HEADER.unpack(
+                source.read(_HEADER.size))
+        if _capacity > max(_count, 1):
+            self._segment_at(directory, base).resize(max(_count, 1))
+
+    def _rollups(self, key):
+        try:
+            with open(os.path.join(self._directory(key), 'rollup'),
+                      'rb') as source:
+                return list(_ROLLUP.iter_unpack(source.read()))
+        except FileNotFoundError:
+            return []
+
+    def _roll_up(self, directory, bases, cutoff):
+        _path = os.path.join(directory, 'rollup')
+        try:
+            with open(_path, 'rb') as source:
+                _rows = [row for row in _ROLLUP.iter_unpack(source.read())
+                         if row[0] >= cutoff]
+        except FileNotFoundError:
+            _rows = []
+        _dropped = bool(_rows) or os.path.exists(_path)
+        for base in bases:
+            _buckets = {}
+            self._bucket(_buckets, base,
+                         *self._segment_at(directory, base).select(),
+                         step=self.resolution)
+            _rows.extend((bucket, count, failures, known,
+                          low if known else 0.0, high if known else 0.0,
+                          total)
+                         for bucket, (count, failures, known, low, high, total)
+                         in sorted(_buckets.items()) if bucket >= cutoff)
+        if bases or _dropped:
+            with open(_path + '.tmp', 'wb') as target:
+                for row in _rows:
+                    target.write(_ROLLUP.pack(*row))
+            os.replace(_path + '.tmp', _path)
+        for base in bases:
+            _segment_path = os.path.join(directory, '{}.seg'.format(base))
+            _segment = self._open.pop(_segment_path, None)
+            if _segment is not None:
+                _segment.close()
+            os.remove(_segment_path)
+
+    @classmethod
+    def _bucket(cls, buckets, base, offsets, latencies, codes, step):
+        _ok = _CODE[Status.OK]
+        for offset, latency, code in zip(offsets, latencies, codes):
+            _second = (base + offset) // 1000
+            if math.isnan(latency):
+                cls._merge(buckets, _second - _second % step, 1, code != _ok,
+                           0, math.inf, -math.inf, 0.0)
+            else:
+                cls._merge(buckets, _second - _second % step, 1, code != _ok,
+                           1, latency, latency, latency)
+
+    @staticmethod
+    def _merge(buckets, bucket, count, failures, known, low, high, total):
+        _entry = buckets.get(bucket)
+        if _entry is None:
+            buckets[bucket] = [count, int(failures), known, low, high, total]
+            return
+        _entry[0] += count
+        _entry[1] += failures
+        _entry[2] += known
+        _entry[3] = min(_entry[3], low)
+        _entry[4] = max(_entry[4], high)
+        _entry[5] += total
+
+
+def main():
+    store = ResultStore(sys.argv[1] if len(sys.argv) > 1 else 'history')
+    _since = time.time() - _DAY
+    for key in store.series():
+        _rows = store.rollup(key, _since, step=3600)
+        _count = sum(row[1] for row in _rows)
+        _failures = sum(row[2] for row in _rows)
+        print('{} samples={} failures={} flaps={}'.format(
+            key, _count, _failures, store.flaps(key, _since)))
+    store.close()
+
+if __name__ == "__main__":
+    main()
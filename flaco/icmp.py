@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+In-process ICMP echo engine. One socket pings many hosts at once and replies
+are matched back to their probe by identifier and sequence number, so there
+is no ping process to fork and no locale-dependent text to parse.
+
+Unprivileged datagram ICMP sockets (Linux ping_group_range, macOS) are used
+when the kernel allows them, raw sockets otherwise.
+
+>>> from icmp import Pinger
+>>> results = Pinger().ping(['127.0.0.1', 'yahoo.com'], count=3)
+>>> print(results['127.0.0.1'].loss)
+0.0
+>>> print(results['127.0.0.1'].summary())
+--- 127.0.0.1 ping statistics ---
+3 packets transmitted, 3 received, 0% packet loss, time 402ms
+rtt min/avg/max/mdev = 0.031/0.042/0.051/0.008 ms
+
+"""
+
+import itertools
+import math
+import os
+import select
+import socket
+import struct
+import time
+
+_ECHO_REQUEST = 8
+_ECHO_REPLY = 0
+_HEADER = struct.Struct('!BBHHH')
+_STAMP = struct.Struct('!d')
+_identifiers = itertools.count(os.getpid() & 0xFFFF)
+
+
+def checksum(data):
+    """RFC 1071 internet checksum.
+
+    :param data: bytes, ICMP header and payload.
+    :return: integer, 16-bit checksum.
+    """
+    if len(data) % 2:
+        data += b'\x00'
+    _sum = sum(struct.unpack('!{}H'.format(len(data) // 2), data))
+    _sum = (_sum >> 16) + (_sum & 0xFFFF)
+    _sum += _sum >> 16
+    return ~_sum & 0xFFFF
+
+
+class PingResult:
+    """Statistics for the echo requests sent to one host.
+
+    Attributes:
+        host: string, host as given to Pinger.ping().
+        address: string, IP address the probes were sent to.
+        samples: list, round trip time in ms per probe; None if lost.
+        elapsed: float, ms between first probe and last reply or timeout.
+        error: string, resolution or send error; None on success.
+    """
+    __slots__ = ('host', 'address', 'samples', 'elapsed', 'error')
+
+    def __init__(self, host, address=None, count=0, error=None):
+        self.host = host
+        self.address = address
+        self.samples = [None] * count
+        self.elapsed = 0.0
+        self.error = error
+
+    @property
+    def transmitted(self):
+        return len(self.samples)
+
+    @property
+    def received(self):
+        return sum(1 for rtt in self.samples if rtt is not None)
+
+    @property
+    def loss(self):
+        """Packet loss in percent."""
+        if not self.samples:
+            return 100.0
+        return 100.0 * (self.transmitted - self.received) / self.transmitted
+
+    def rtt(self):
+        """Round trip statistics in ms.
+
+        :return: tuple, (min, avg, max, mdev) or None if nothing came back.
+        """
+        _rtts = [rtt for rtt in self.samples if rtt is not None]
+        if not _rtts:
+            return None
+        _avg = sum(_rtts) / len(_rtts)
+        _mdev = math.sqrt(max(
+            0.0, sum(rtt * rtt for rtt in _rtts) / len(_rtts) - _avg * _avg))
+        return min(_rtts), _avg, max(_rtts), _mdev
+
+    def summary(self):
+        """Renders the statistics in the format printed by iputils ping, which
+        is what Toolkit.check_host() has always returned.
+
+        :return: string, ping statistics otherwise the error.
+        """
+        if self.error is not None:
+            return self.error
+        _lines = [
+            '--- {} ping statistics ---'.format(self.host),
+            '{} packets transmitted, {} received, {:g}% packet loss, '
+            'time {:.0f}ms'.format(self.transmitted, self.received,
+                                   round(self.loss), self.elapsed)]
+        _rtt = self.rtt()
+        if _rtt is not None:
+            _lines.append('rtt min/avg/max/mdev = {:.3f}/{:.3f}/{:.3f}/'
+                          '{:.3f} ms'.format(*_rtt))
+        return '\n'.join(_lines)
+
+
+class Pinger:
+    """ICMP echo engine for IPv4 hosts.
+
+    Example:
+        pinger = Pinger(timeout=1, interval=.2, size=1350)
+        for host, result in pinger.ping(hosts, count=9).items():
+            print(result.summary())
+    """
+    def __init__(self, timeout=1.0, interval=0.2, size=56):
+        """Initialize probe settings.
+
+        :param timeout: float, seconds to wait for replies after the last
+        probe is sent.
+        :param interval: float, seconds between rounds of probes.
+        :param size: integer, ICMP payload bytes (minimum 8, used for the
+        send timestamp).
+        """
+        self.timeout = timeout
+        self.interval = interval
+        self.size = max(size, _STAMP.size)
+        self.privileged = None
+
+    def open_socket(self):
+        """Opens an ICMP socket, preferring an unprivileged datagram socket
+        and falling back to a raw socket.
+
+        :return: socket.socket object.
+        :raises PermissionError: neither socket type is allowed.
+        """
+        try:
+            _sock = socket.socket(
+                socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.privileged = False
+        except OSError:
+            _sock = socket.socket(
+                socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self.privileged = True
+        _sock.setblocking(False)
+        return _sock
+
+    def packet(self, identifier, sequence):
+        """Builds an echo request carrying the send time in its payload."""
+        _payload = _STAMP.pack(time.perf_counter())
+        _payload += b'Q' * (self.size - len(_payload))
+        _header = _HEADER.pack(_ECHO_REQUEST, 0, 0, identifier, sequence)
+        _sum = checksum(_header + _payload)
+        return _HEADER.pack(
+            _ECHO_REQUEST, 0, _sum, identifier, sequence) + _payload
+
+    def parse(self, data):
+        """Parses a received packet.
+
+        :return: tuple, (identifier, sequence, send time) or None if the
+        packet is not an echo reply.
+        """
+        if self.privileged:
+            data = data[(data[0] & 0x0F) * 4:]  # strip the IPv4 header
+        if len(data) < _HEADER.size + _STAMP.size:
+            return None
+        _type, _code, _sum, _id, _seq = _HEADER.unpack_from(data)
+        if _type != _ECHO_REPLY:
+            return None
+        return _id, _seq, _STAMP.unpack_from(data, _HEADER.size)[0]
+
+    def ping(self, hosts, count=9):
+        """Sends count echo requests to every host, one round every interval,
+        over a single socket.
+
+        :param hosts: iterable of strings, names or IPv4 addresses.
+        :param count: integer, echo requests per host.
+        :return: dict, host -> PingResult.
+        """
+        count = int(count)
+        _results = {}
+        _by_address = {}
+        for host in hosts:
+            try:
+                _address = socket.gethostbyname(host)
+            except (socket.gaierror, UnicodeError) as e:
+                _results[host] = PingResult(host, error=str(e))
+                continue
+            _results[host] = PingResult(host, _address, count)
+            _by_address.setdefault(_address, []).append(_results[host])
+        if not _by_address:
+            return _results
+
+        _sock = self.open_socket()
+        # Datagram ICMP sockets have their identifier rewritten by the kernel
+        # and only ever see their own replies, so match on sequence alone.
+        _identifier = next(_identifiers) & 0xFFFF
+        _start = time.perf_counter()
+        _outstanding = count * sum(
+            len(results) for results in _by_address.values())
+        try:
+            for sequence in range(count):
+                _packet = self.packet(_identifier, sequence)
+                for address, results in _by_address.items():
+                    try:
+                        _sock.sendto(_packet, (address, 0))
+                    except OSError as e:
+                        for result in results:
+                            result.error = str(e)
+                        _outstanding -= len(results)  # no reply coming
+                if sequence < count - 1:
+                    _outstanding -= self._receive(
+                        _sock, _identifier, _by_address, _start,
+                        time.perf_counter() + self.interval)
+            # After the last round, return as soon as every reply is in.
+            _deadline = time.perf_counter() + self.timeout
+            if _outstanding > 0:
+                self._receive(_sock, _identifier, _by_address, _start,
+                              _deadline, _outstanding)
+        finally:
+            _sock.close()
+        for results in _by_address.values():
+            for result in results:
+                if not result.elapsed:
+                    result.elapsed = (time.perf_counter() - _start) * 1000
+        return _results
+
+    def _receive(self, sock, identifier, by_address, start, until,
+                 expected=None):
+        # Reads replies until the until deadline, or until expected replies
+        # have been matched.
+        _matched = 0
+        while expected is None or _matched < expected:
+            _wait = until - time.perf_counter()
+            if _wait <= 0:
+                return _matched
+            _readable, _, _ = select.select([sock], [], [], _wait)
+            if not _readable:
+                return _matched
+            try:
+                _data, (_address, _port) = sock.recvfrom(65535)
+            except BlockingIOError:
+                continue
+            _now = time.perf_counter()
+            _reply = self.parse(_data)
+            if _reply is None or _address not in by_address:
+                continue
+            _id, _seq, _sent = _reply
+            if self.privileged and _id != identifier:
+                continue  # another process' echo reply
+            for result in by_address[_address]:
+                if _seq < result.transmitted and result.samples[_seq] is None:
+                    result.samples[_seq] = (_now - _sent) * 1000
+                    result.elapsed = (_now - start) * 1000
+                    _matched += 1
+        return _matched
+
+
+def main():
+    # Loopback harness: needs no network, only permission to open an ICMP
+    # socket. Exits non-zero if any echo request goes unanswered.
+    _hosts = ['127.0.0.1', '127.0.0.2', 'localhost']
+    _results = Pinger(timeout=1, interval=.05).ping(_hosts, count=5)
+    _failed = False
+    for host in _hosts:
+        print(_results[host].summary())
+        print('samples: {}'.format(
+            ['{:.3f}'.format(rtt) if rtt is not None else None
+             for rtt in _results[host].samples]))
+        print()
+        _failed = _failed or _results[host].loss > 0
+    exit(1 if _failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Declarative inventory of applications, elements and their checks, and a bulk
+runner that expands it into a deduplicated set of probes. A host:port, URL,
+ping target or DNS query shared by many elements is probed once per cycle.
+
+Inventory files may be JSON, TOML or YAML (YAML needs PyYAML):
+
+    {"applications": [
+        {"name": "my.app.com",
+         "elements": [
+            {"node": "yahoo.com", "type": "Web Server",
+             "dns": {"resolvers": ["8.8.8.8"], "qtype": ["A", "MX"]},
+             "ping": 9,
+             "sockets": {"ports": [80, "443", "8000-8002"], "kind": "TCP"},
+             "urls": ["https://yahoo.com", "http://yahoo.com"]}]}]}
+
+>>> from inventory import Inventory, BulkRunner
+>>> inventory = Inventory.load('my_inventory.json')
+>>> runner = BulkRunner(workers=64, timeout=2)
+>>> results = runner.run(inventory)
+>>> print(runner.report(inventory, results))
+
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from element import Element
+from icmp import Pinger
+from policy import Deadline
+from scanner import parse_ports
+from toolkit import Toolkit
+from urlpool import HTTPPool
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+class Inventory:
+    """Normalized inventory.
+
+    Attributes:
+        applications: list of dicts with 'name' and 'elements'; each element
+        has 'node', 'type', 'dns', 'ping', 'sockets' and 'urls' keys, with
+        checks expanded into hashable task tuples.
+    """
+    def __init__(self, data):
+        """Validates and normalizes parsed inventory data.
+
+        :param data: dict, with an 'applications' list.
+        :raises ValueError: the inventory is malformed.
+        """
+        if not isinstance(data, dict) or 'applications' not in data:
+            raise ValueError("Inventory needs an 'applications' list.")
+        self.applications = []
+        for app in _as_list(data['applications']):
+            _elements = [self._element(app.get('name', '?'), spec)
+                         for spec in _as_list(app.get('elements'))]
+            self.applications.append(
+                {'name': app.get('name', ''), 'elements': _elements})
+
+    @classmethod
+    def load(cls, path):
+        """Reads an inventory file; the format follows the extension.
+
+        :param path: string, .json, .toml, .yaml or .yml file.
+        :return: Inventory object.
+        """
+        _extension = os.path.splitext(path)[1].lower()
+        if _extension == '.json':
+            with open(path, 'r') as source:
+                return cls(json.load(source))
+        if _extension == '.toml':
+            import tomllib
+            with open(path, 'rb') as source:
+                return cls(tomllib.load(source))
+        if _extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError('YAML inventories need PyYAML; '
+                                 'use JSON or TOML instead.')
+            with open(path, 'r') as source:
+                return cls(yaml.safe_load(source))
+        raise ValueError('Unknown inventory format {!r}.'.format(_extension))
+
+    @staticmethod
+    def _element(app, spec):
+        if not spec.get('node'):
+            raise ValueError('Element without a node in {}.'.format(app))
+        _node = str(spec['node'])
+        _element = {'node': _node, 'type': spec.get('type', ''), 'dns': [],
+                    'ping': [], 'sockets': [], 'urls': []}
+        for dns in _as_list(spec.get('dns')):
+            _resolvers = tuple(_as_list(dns.get('resolvers', ['8.8.8.8'])))
+            for qtype in _as_list(dns.get('qtype', 'A')):
+                _element['dns'].append(('dns', _node, qtype, _resolvers))
+        _ping = spec.get('ping', True)
+        if _ping:
+            _count = 9 if _ping is True else int(_ping)
+            _element['ping'].append(('ping', _node, _count))
+        for sockets in _as_list(spec.get('sockets')):
+            _kind = sockets.get('kind', 'TCP').upper()
+            for port in parse_ports(sockets.get('ports', [])):
+                _element['sockets'].append(('socket', _node, port, _kind))
+        for url in _as_list(spec.get('urls')):
+            _element['urls'].append(('url', url))
+        return _element
+
+    def tasks(self):
+        """Returns every unique probe and the elements that use it.
+
+        :return: dict, task tuple -> list of (application, node) tuples.
+        """
+        _tasks = {}
+        for app in self.applications:
+            for element in app['elements']:
+                for group in ('dns', 'ping', 'sockets', 'urls'):
+                    for task in element[group]:
+                        _tasks.setdefault(task, []).append(
+                            (app['name'], element['node']))
+        return _tasks
+
+
+class BulkRunner:
+    """Runs the unique probes of an Inventory concurrently.
+
+    Hosts whose breaker in toolkit.Toolkit.breakers is open are not probed;
+    the breaker state is saved after every run.
+
+    Example:
+        runner = BulkRunner()
+        results = runner.run(Inventory.load(path))
+    """
+    def __init__(self, workers=64, timeout=2, http_pool=None, store=None,
+                 policy=None, budget=None):
+        """Initialize the runner.
+
+        :param workers: integer, probes in flight.
+        :param timeout: float, socket connect timeout in seconds.
+        :param http_pool: urlpool.HTTPPool, defaults to a new pool.
+        :param store: history.ResultStore, every result of a run is recorded
+        in it when given.
+        :param policy: policy.PolicyEngine, runs DNS, socket and URL probes
+        with adaptive timeouts, retries and hedging instead of the fixed
+        timeout.
+        :param budget: float, seconds a cycle may take under policy; probes
+        still queued when it runs out get a shorter timeout or a TIMEOUT
+        result.
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.http_pool = http_pool or HTTPPool(timeout=max(timeout, 5))
+        self.store = store
+        self.policy = policy
+        self.budget = budget
+        self.probes = 0
+        self.references = 0
+
+    def run(self, inventory):
+        """Probes every unique task once.
+
+        :param inventory: Inventory object.
+        :return: dict, task tuple -> result.CheckResult object.
+        """
+        _started = time.time()
+        _deadline = Deadline(self.budget)
+        _tasks = inventory.tasks()
+        self.probes = len(_tasks)
+        self.references = sum(len(users) for users in _tasks.values())
+        _results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            _futures = {task: executor.submit(self._probe, task,
+                                              _deadline)
+                        for task in _tasks if task[0] != 'ping'}
+            # All ping targets with the same count share one ICMP socket.
+            _counts = {}
+            for task in _tasks:
+                if task[0] == 'ping':
+                    _counts.setdefault(task[2], []).append(task[1])
+            for count, nodes in _counts.items():
+                _results.update(self._ping(nodes, count, executor))
+            for task, future in _futures.items():
+                _results[task] = future.result()
+        if self.store is not None:
+            self.store.record(list(_results.values()), _started)
+        if Toolkit.breakers is not None:
+            Toolkit.breakers.save()
+        return _results
+
+    def report(self, inventory, results):
+        """Renders results per application and element with the same
+        formatting as app.main.
+
+        :return: string.
+        """
+        _lines = []
+        for app in inventory.applications:
+            _lines.append('Application {}'.format(app['name']))
+            for element in app['elements']:
+                _lines.append('\tElement: {}'.format(element['node']))
+                _lines.append('\t\tType: {}'.format(element['type']))
+                for group in ('dns', 'ping', 'sockets', 'urls'):
+                    for task in element[group]:
+                        _lines.append(Element.render(results[task]))
+        _lines.append('Probes: {} unique for {} checks'.format(
+            self.probes, self.references))
+        return '\n'.join(_lines)
+
+    def _probe(self, task, deadline):
+        if self.policy is not None:
+            if task[0] == 'dns':
+                return self.policy.dns(task[1], task[3], task[2], deadline)
+            if task[0] == 'socket':
+                return self.policy.socket(task[1], task[2], task[3], deadline)
+            return self.policy.url(task[1], self.http_pool, deadline)
+        if task[0] == 'dns':
+            return Toolkit(task[1]).probe_dns(list(task[3]), task[2])
+        if task[0] == 'socket':
+            return Toolkit(task[1]).probe_socket(task[2], task[3],
+                                                 timeout=self.timeout)
+        return Toolkit().probe_url(task[1], pool=self.http_pool)
+
+    def _ping(self, nodes, count, executor):
+        _results = {}
+        _breakers = Toolkit.breakers
+        if _breakers is not None:
+            for node in nodes:
+                _rejected = _breakers.rejected(node, 'host', node, (count,))
+                if _rejected is not None:
+                    _results[('ping', node, count)] = _rejected
+            nodes = [node for node in nodes
+                     if ('ping', node, count) not in _results]
+        _start = time.perf_counter()
+        try:
+            _pings = Pinger(timeout=1, interval=.2, size=1350).ping(
+                nodes, count)
+        except PermissionError:
+            # No ICMP sockets: one ping command per node, run side by side
+            # on the runner's workers.
+            _futures = {node: executor.submit(self._ping_command, node, count)
+                        for node in nodes}
+            _pings = None
+        _elapsed = time.perf_counter() - _start
+        for node in nodes:
+            if _pings is None:
+                _result = _futures[node].result()
+            else:
+                _result = Toolkit.host_result(node, _pings[node], count,
+                                              _elapsed)
+                metrics.observe(_result)
+            if _breakers is not None:
+                _breakers.record(node, _result)
+            _results[('ping', node, count)] = _result
+        return _results
+
+    @staticmethod
+    def _ping_command(node, count):
+        # Breakers were consulted in _ping(), so the fallback must not ask
+        # again and spend the half-open attempt twice.
+        _toolkit = Toolkit(node)
+        _toolkit.breakers = None
+        return _toolkit.probe_host(count)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'my_inventory.json'
+    inventory = Inventory.load(path)
+    runner = BulkRunner()
+    print(runner.report(inventory, runner.run(inventory)))
+    runner.http_pool.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Deferred imports. A module bound with lazy.load() is only imported the first
+time one of its attributes is used, so entry points that never open an SSH
+session do not pay for paramiko, and checks that never resolve a name do not
+pay for dnspython.
+
+>>> import lazy
+>>> paramiko = lazy.load('paramiko')     # nothing imported yet
+>>> lazy.loaded('paramiko')
+False
+>>> client = paramiko.SSHClient()         # imported here, once
+>>> lazy.loaded('paramiko')
+True
+
+Exception classes are attributes too, so 'except paramiko.SSHException:'
+only imports paramiko when an exception actually reaches that clause.
+
+"""
+
+import importlib
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that imports it on first attribute access.
+    Thread safe: concurrent first uses import the module once.
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_lock'] = threading.Lock()
+
+    def _lazy_load(self):
+        _module = self.__dict__['_lazy_module']
+        if _module is None:
+            with self.__dict__['_lazy_lock']:
+                _module = self.__dict__['_lazy_module']
+                if _module is None:
+                    _module = importlib.import_module(self.__name__)
+                    self.__dict__['_lazy_module'] = _module
+        return _module
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_load(), name)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        _state = 'loaded' if self.__dict__['_lazy_module'] is not None \
+            else 'not loaded'
+        return '<lazy module {!r} ({})>'.format(self.__name__, _state)
+
+
+def load(name):
+    """Returns module name, or a LazyModule for it if it has not been
+    imported yet.
+
+    :param name: string, absolute module name such as 'dns.resolver'.
+    :return: module or LazyModule object.
+    """
+    _module = sys.modules.get(name)
+    return _module if _module is not None else LazyModule(name)
+
+
+def loaded(name):
+    """:return: bool, True if module name has really been imported."""
+    return name in sys.modules
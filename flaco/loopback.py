@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Local stand-in servers on the loopback interface, so checks and SSH jobs can
+be exercised without network access: a DNS server, TCP and UDP listeners, a
+TCP port that drops connection attempts like a firewall (filtered), HTTP and
+HTTPS servers and a paramiko SSH server that answers exec and SCP requests.
+
+Every server binds an ephemeral port unless one is given, runs in daemon
+threads, and is a context manager.
+
+>>> from loopback import DNSServer, TCPListener
+>>> from toolkit import Toolkit
+>>> with DNSServer() as server:
+...     Toolkit.dns_cache.resolver(['127.0.0.1']).port = server.port
+...     print(Toolkit('bench.flaco.test').check_dns(['127.0.0.1'], 'A'))
+127.0.0.1
+>>> with TCPListener() as listener:
+...     print(Toolkit('127.0.0.1').check_socket(listener.port, 'TCP'))
+open
+
+"""
+
+import abc
+import http.server
+import os
+import shlex
+import socket
+import ssl
+import tempfile
+import threading
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import paramiko
+
+RECORDS = {
+    'bench.flaco.test.': {'A': ['127.0.0.1'], 'AAAA': ['::1'],
+                          'MX': ['10 mail.flaco.test.']},
+    'www.flaco.test.': {'CNAME': ['bench.flaco.test.']},
+    '1.0.0.127.in-addr.arpa.': {'PTR': ['localhost.']},
+}
+
+
+class _Server(abc.ABC):
+    """Shared start/stop handling; subclasses implement _serve()."""
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self._sock = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        self._sock = self._bind()
+        self.port = self._sock.getsockname()[1]
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._serve, name='flaco-{}'.format(
+                type(self).__name__.lower()), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._sock is not None:
+            self._sock.close()
+        if self._thread is not None:
+            self._thread.join(1)
+
+    def _bind(self):
+        _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        _sock.bind((self.host, self.port))
+        _sock.listen(1024)
+        return _sock
+
+    @abc.abstractmethod
+    def _serve(self):
+        """Serves self._sock until stop(); runs in the server thread."""
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class DNSServer(_Server):
+    """Authoritative UDP DNS server for a fixed record set.
+
+    Unknown names get NXDOMAIN and missing types an empty answer, so the
+    NXDOMAIN and NoAnswer paths of the checks can be exercised too.
+    """
+    def __init__(self, records=None, host='127.0.0.1', port=0, ttl=300):
+        """
+        :param records: dict, absolute name -> {qtype: [rdata strings]};
+        defaults to RECORDS.
+        :param ttl: integer, TTL of every answer.
+        """
+        super().__init__(host, port)
+        self.records = RECORDS if records is None else records
+        self.ttl = ttl
+        self.queries = 0
+
+    def _bind(self):
+        _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _sock.bind((self.host, self.port))
+        return _sock
+
+    def _serve(self):
+        while not self._stopping.is_set():
+            try:
+                _wire, _peer = self._sock.recvfrom(4096)
+            except OSError:
+                return
+            try:
+                _reply = self.answer(dns.message.from_wire(_wire))
+            except dns.exception.DNSException:
+                continue
+            self.queries += 1
+            try:
+                self._sock.sendto(_reply.to_wire(), _peer)
+            except OSError:
+                return
+
+    def answer(self, query):
+        """Builds the response to a parsed query.
+
+        :param query: dns.message.Message object.
+        :return: dns.message.Message object.
+        """
+        _response = dns.message.make_response(query)
+        _response.flags |= dns.flags.AA
+        for question in query.question:
+            _name = question.name.to_text().lower()
+            if _name not in self.records:
+                _response.set_rcode(dns.rcode.NXDOMAIN)
+                continue
+            _type = dns.rdatatype.to_text(question.rdtype)
+            _values = self.records[_name].get(_type)
+            if _values:
+                _response.answer.append(dns.rrset.from_text(
+                    question.name, self.ttl, 'IN', _type, *_values))
+        return _response
+
+
+class TCPListener(_Server):
+    """Accepts TCP connections and closes them at once: an open port."""
+    def _serve(self):
+        while not self._stopping.is_set():
+            try:
+                _connection, _ = self._sock.accept()
+            except OSError:
+                return
+            _connection.close()
+
+
+class FilteredPort(_Server):
+    """A TCP port whose connection attempts time out, like a port behind a
+    firewall that drops SYNs.
+
+    The listener never accepts and its accept queue is kept full, so the
+    kernel drops new SYNs and clients see a connect timeout. Needs Linux
+    behaviour (net.ipv4.tcp_abort_on_overflow = 0, the default).
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__(host, port)
+        self._fillers = []
+
+    def _bind(self):
+        _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _sock.bind((self.host, self.port))
+        _sock.listen(0)
+        for _ in range(4):
+            _filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            _filler.setblocking(False)
+            _filler.connect_ex(_sock.getsockname())
+            self._fillers.append(_filler)
+        return _sock
+
+    def _serve(self):
+        self._stopping.wait()
+
+    def stop(self):
+        super().stop()
+        for filler in self._fillers:
+            filler.close()
+        self._fillers = []
+
+
+class UDPListener(_Server):
+    """Echoes UDP datagrams back to the sender."""
+    def _bind(self):
+        _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _sock.bind((self.host, self.port))
+        return _sock
+
+    def _serve(self):
+        while not self._stopping.is_set():
+            try:
+                _data, _peer = self._sock.recvfrom(65535)
+                self._sock.sendto(_data, _peer)
+            except OSError:
+                return
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """200 for /, a 301 to / for /redirect and 404 for anything else, over
+    keep-alive HTTP/1.1.
+    """
+    protocol_version = 'HTTP/1.1'
+    body = b'flaco\n'
+
+    def do_HEAD(self):
+        self._reply(send_body=False)
+
+    def do_GET(self):
+        self._reply(send_body=True)
+
+    def _reply(self, send_body):
+        if self.path == '/':
+            self.send_response(200)
+        elif self.path == '/redirect':
+            self.send_response(301)
+            self.send_header('Location', '/')
+        else:
+            self.send_response(404)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPServer(_Server):
+    """Threaded keep-alive HTTP server; HTTPS when a certificate is given.
+
+    Attributes:
+        url: string, base URL of the server.
+    """
+    def __init__(self, host='127.0.0.1', port=0, certificate=None):
+        """
+        :param certificate: tuple, (certfile, keyfile) to serve HTTPS; see
+        self_signed().
+        """
+        super().__init__(host, port)
+        self.certificate = certificate
+        self._httpd = None
+
+    @property
+    def url(self):
+        return '{}://{}:{}/'.format('https' if self.certificate else 'http',
+                                    self.host, self.port)
+
+    def _bind(self):
+        self._httpd = http.server.ThreadingHTTPServer(
+            (self.host, self.port), _Handler)
+        self._httpd.daemon_threads = True
+        if self.certificate:
+            _context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            _context.load_cert_chain(*self.certificate)
+            self._httpd.socket = _context.wrap_socket(
+                self._httpd.socket, server_side=True)
+        return self._httpd.socket
+
+    def _serve(self):
+        self._httpd.serve_forever(poll_interval=0.1)
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+        super().stop()
+
+
+def self_signed(directory, name='localhost'):
+    """Writes a self-signed certificate for name and 127.0.0.1 into
+    directory. Needs the cryptography package, which paramiko depends on.
+
+    :return: tuple, (certfile, keyfile) paths.
+    """
+    import datetime
+    import ipaddress
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    _key = ec.generate_private_key(ec.SECP256R1())
+    _subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    _now = datetime.datetime.now(datetime.timezone.utc)
+    _certificate = x509.CertificateBuilder() \
+        .subject_name(_subject).issuer_name(_subject) \
+        .public_key(_key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(_now - datetime.timedelta(days=1)) \
+        .not_valid_after(_now + datetime.timedelta(days=30)) \
+        .add_extension(x509.SubjectAlternativeName(
+            [x509.DNSName(name),
+             x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]),
+            critical=False) \
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                       critical=True) \
+        .sign(_key, hashes.SHA256())
+    _certfile = os.path.join(directory, 'loopback.crt')
+    _keyfile = os.path.join(directory, 'loopback.key')
+    with open(_certfile, 'wb') as target:
+        target.write(_certificate.public_bytes(serialization.Encoding.PEM))
+    with open(_keyfile, 'wb') as target:
+        target.write(_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()))
+    return _certfile, _keyfile
+
+
+class _Interface(paramiko.ServerInterface):
+    """Authentication and channel policy of SSHServer."""
+    def __init__(self, server):
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.server.username,
+                                    self.server.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.server.run,
+                         args=(channel, command.decode('utf-8', 'replace')),
+                         daemon=True).start()
+        return True
+
+
+class SSHServer(_Server):
+    """paramiko SSH server with password authentication.
+
+    exec requests are answered with canned output and exit status 0;
+    'scp -f <path>' requests are served with the SCP source protocol from
+    self.files, so SSH.commander() and SSH.get_scp() work against it.
+
+    Attributes:
+        outputs: dict, command -> bytes output; other commands get
+        default_output.
+        files: dict, remote path -> bytes content for SCP.
+    """
+    def __init__(self, username='rafael', password='default_pw_ro',
+                 host='127.0.0.1', port=0, default_output=b'flaco\n' * 64,
+                 host_key=None):
+        """
+        :param host_key: paramiko.PKey, generated (RSA 2048) if None.
+        """
+        super().__init__(host, port)
+        self.username = username
+        self.password = password
+        self.default_output = default_output
+        self.outputs = {}
+        self.files = {}
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self._transports = []
+
+    def _serve(self):
+        while not self._stopping.is_set():
+            try:
+                _connection, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._session, args=(_connection,),
+                             daemon=True).start()
+
+    def stop(self):
+        super().stop()
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def _session(self, connection):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _transport = paramiko.Transport(connection)
+        _transport.add_server_key(self.host_key)
+        self._transports.append(_transport)
+        try:
+            _transport.start_server(server=_Interface(self))
+        except (paramiko.SSHException, EOFError, OSError):
+            return
+        # Channels are served by their exec request; accepted ones are only
+        # held here because a dropped paramiko.Channel closes itself.
+        _channels = []
+        while _transport.is_active() and not self._stopping.is_set():
+            _channel = _transport.accept(1)
+            _channels = [c for c in _channels if not c.closed]
+            if _channel is not None:
+                _channels.append(_channel)
+
+    def run(self, channel, command):
+        """Answers one exec request on channel."""
+        channel.settimeout(30)
+        try:
+            _argv = shlex.split(command)
+            if _argv[:1] == ['scp'] and '-f' in _argv:
+                self._scp_source(channel, _argv[-1])
+            else:
+                channel.sendall(self.outputs.get(command,
+                                                 self.default_output))
+                channel.send_exit_status(0)
+            # The exec reply may still be in flight, and a close that
+            # overtakes it fails the client's exec_command(); send EOF and
+            # let the client close first.
+            channel.shutdown_write()
+            while channel.recv(1024):
+                pass
+        except (OSError, EOFError, ValueError):
+            pass
+        finally:
+            channel.close()
+
+    def _scp_source(self, channel, path):
+        _content = self.files.get(path)
+        if _content is None:
+            channel.recv(1)
+            channel.sendall('\x01scp: {}: No such file or directory\n'
+                            .format(path).encode('utf-8'))
+            channel.send_exit_status(1)
+            return
+        channel.recv(1)  # client ready
+        channel.sendall('C0644 {} {}\n'.format(
+            len(_content), os.path.basename(path)).encode('utf-8'))
+        channel.recv(1)  # header accepted
+        channel.sendall(_content + b'\x00')
+        channel.recv(1)  # file stored
+        channel.send_exit_status(0)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory, \
+            DNSServer() as dns_server, TCPListener() as tcp, \
+            FilteredPort() as filtered, UDPListener() as udp, \
+            HTTPServer() as http_server, \
+            HTTPServer(certificate=self_signed(directory)) as https_server, \
+            SSHServer() as ssh_server:
+        print('DNS     udp/{}'.format(dns_server.port))
+        print('TCP     tcp/{} (open), tcp/{} (filtered)'.format(
+            tcp.port, filtered.port))
+        print('UDP     udp/{}'.format(udp.port))
+        print('HTTP    {}'.format(http_server.url))
+        print('HTTPS   {}'.format(https_server.url))
+        print('SSH     tcp/{} ({}/{})'.format(
+            ssh_server.port, ssh_server.username, ssh_server.password))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            print('\nGoodbye')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+In-process metrics for checks and SSH jobs: counters, gauges and latency
+histograms with labels, exported in the Prometheus text format over a local
+HTTP endpoint and as periodic JSON snapshots.
+
+Toolkit.probe_*() (and so Toolkit.check_*() and Element) and SSH record into
+REGISTRY as they run; nothing needs to be enabled.
+
+>>> import metrics
+>>> from toolkit import Toolkit
+>>> server = metrics.serve(port=9108)          # http://127.0.0.1:9108/metrics
+>>> Toolkit('yahoo.com').check_socket(443, 'TCP', timeout=2)
+'open'
+>>> print(metrics.REGISTRY.render())
+# HELP flaco_checks_total Checks run, by check and status.
+# TYPE flaco_checks_total counter
+flaco_checks_total{check="socket",status="ok"} 1
+...
+>>> writer = metrics.SnapshotWriter('metrics.jsonl', interval=60).start()
+
+"""
+
+import bisect
+import contextlib
+import functools
+import json
+import threading
+import time
+
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+           5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n')\
+        .replace('"', '\\"')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _label_text(self, values, extra=()):
+        _pairs = list(zip(self.labels, values)) + list(extra)
+        if not _pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                              for name, value in _pairs) + '}'
+
+    def samples(self):
+        """Returns (suffix, label text, value) tuples for rendering."""
+        with self._lock:
+            return [('', self._label_text(key), value)
+                    for key, value in sorted(self._values.items())]
+
+    def snapshot(self):
+        with self._lock:
+            return {','.join(map(str, key)): value
+                    for key, value in self._values.items()}
+
+
+class Counter(_Metric):
+    """Monotonic count per label set.
+
+    Example:
+        checks = Counter('checks_total', 'Checks run.', ('check',))
+        checks.inc('dns')
+    """
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down per label set, such as checks in flight.
+
+    Example:
+        in_flight = Gauge('in_flight', 'Checks running.', ('check',))
+        with in_flight.track('dns'):
+            ...
+    """
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def track(self, *labels):
+        """Context manager that counts the block as in flight."""
+        return _Tracker(self, labels)
+
+
+class _Tracker:
+    __slots__ = ('gauge', 'labels')
+
+    def __init__(self, gauge, labels):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        self.gauge.inc(*self.labels)
+
+    def __exit__(self, *exc):
+        self.gauge.dec(*self.labels)
+
+
+class Histogram(_Metric):
+    """Latency distribution per label set in fixed buckets (seconds).
+
+    Example:
+        seconds = Histogram('check_seconds', 'Check latency.', ('check',))
+        seconds.observe('dns', value=0.012)
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        _index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            _entry = self._values.get(labels)
+            if _entry is None:
+                _entry = self._values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            _entry[0][_index] += 1
+            _entry[1] += value
+            _entry[2] += 1
+
+    def samples(self):
+        _samples = []
+        with self._lock:
+            _items = sorted((key, ([*counts], total, count))
+                            for key, (counts, total, count)
+                            in self._values.items())
+        for key, (counts, total, count) in _items:
+            _cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                _cumulative += bucket
+                _samples.append(('_bucket', self._label_text(
+                    key, [('le', bound)]), _cumulative))
+            _samples.append(('_sum', self._label_text(key), total))
+            _samples.append(('_count', self._label_text(key), count))
+        return _samples
+
+    def snapshot(self):
+        with self._lock:
+            return {','.join(map(str, key)): {
+                'count': count, 'sum': round(total, 6),
+                'buckets': dict(zip(map(str, self.buckets + ('+Inf',)),
+                                    counts))}
+                for key, (counts, total, count) in self._values.items()}
+
+
+class Registry:
+    """Named collection of metrics.
+
+    Example:
+        registry = Registry()
+        checks = registry.add(Counter('checks_total', 'Checks run.'))
+        print(registry.render())
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric):
+        """Registers metric, or returns the one already registered under
+        its name.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format.
+
+        :return: string.
+        """
+        _lines = []
+        with self._lock:
+            _metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        for metric in _metrics:
+            _lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.documentation))
+            _lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                _lines.append('{}{}{} {}'.format(metric.name, suffix, labels,
+                                                 value))
+        return '\n'.join(_lines) + '\n'
+
+    def snapshot(self):
+        """Returns the current values as a JSON friendly dict.
+
+        :return: dict, {'time': timestamp, 'metrics': {name: {labels:
+        value}}}; label values are joined with commas.
+        """
+        with self._lock:
+            _metrics = list(self._metrics.values())
+        return {'time': time.time(),
+                'metrics': {metric.name: metric.snapshot()
+                            for metric in _metrics}}
+
+
+REGISTRY = Registry()
+
+CHECKS = REGISTRY.add(Counter(
+    'flaco_checks_total', 'Checks run, by check and status.',
+    ('check', 'status')))
+CHECK_SECONDS = REGISTRY.add(Histogram(
+    'flaco_check_seconds', 'Check latency in seconds.', ('check',)))
+CHECKS_IN_FLIGHT = REGISTRY.add(Gauge(
+    'flaco_checks_in_flight', 'Checks running now.', ('check',)))
+CHECK_RETRIES = REGISTRY.add(Counter(
+    'flaco_check_retries_total', 'Check attempts retried, by check.',
+    ('check',)))
+CHECK_HEDGES = REGISTRY.add(Counter(
+    'flaco_check_hedges_total', 'Hedged check requests sent, by check.',
+    ('check',)))
+BREAKER_TRIPS = REGISTRY.add(Counter(
+    'flaco_breaker_trips_total', 'Host circuit breakers opened.'))
+BREAKER_REJECTS = REGISTRY.add(Counter(
+    'flaco_breaker_rejects_total',
+    'Checks and SSH connects failed fast by an open breaker.'))
+SSH_CONNECTS = REGISTRY.add(Counter(
+    'flaco_ssh_connects_total', 'SSH connection attempts, by outcome.',
+    ('outcome',)))
+SSH_CONNECT_SECONDS = REGISTRY.add(Histogram(
+    'flaco_ssh_connect_seconds',
+    'SSH connect, key exchange and authentication time in seconds.'))
+SSH_COMMANDS = REGISTRY.add(Counter(
+    'flaco_ssh_commands_total', 'SSH commands run, by method and outcome.',
+    ('method', 'outcome')))
+SSH_COMMAND_SECONDS = REGISTRY.add(Histogram(
+    'flaco_ssh_command_seconds', 'SSH command time in seconds, by method.',
+    ('method',)))
+SSH_IN_FLIGHT = REGISTRY.add(Gauge(
+    'flaco_ssh_sessions_in_flight', 'SSH jobs running now, by method.',
+    ('method',)))
+
+
+def observe(result):
+    """Records a result.CheckResult in the check counters and histogram."""
+    CHECKS.inc(result.check, result.status.value)
+    if result.latency is not None:
+        CHECK_SECONDS.observe(result.check, value=result.latency)
+
+
+def instrumented(check):
+    """Decorator for Toolkit probe methods returning a result.CheckResult:
+    counts the call as in flight and records the result.
+
+    :param check: string, check label.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            CHECKS_IN_FLIGHT.inc(check)
+            try:
+                _result = method(*args, **kwargs)
+            finally:
+                CHECKS_IN_FLIGHT.dec(check)
+            observe(_result)
+            return _result
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def timed(counter, histogram, *labels):
+    """Context manager that times the block into histogram and counts it in
+    counter with an extra 'ok' or 'error' outcome label.
+
+    Example:
+        with timed(SSH_COMMANDS, SSH_COMMAND_SECONDS, 'commander'):
+            ...
+    """
+    _start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        counter.inc(*labels, 'error')
+        raise
+    histogram.observe(*labels, value=time.perf_counter() - _start)
+    counter.inc(*labels, 'ok')
+
+
+def in_flight(gauge, *labels):
+    """Decorator that counts calls of the wrapped function as in flight in
+    gauge.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with gauge.track(*labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def serve(port=9108, host='127.0.0.1', registry=REGISTRY):
+    """Serves registry at http://host:port/metrics from a daemon thread.
+
+    :return: http.server.ThreadingHTTPServer; call shutdown() to stop it.
+    """
+    import http.server  # only processes that export metrics need it
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            _body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(_body)))
+            self.end_headers()
+            self.wfile.write(_body)
+
+        def log_message(self, *args):
+            pass
+
+    _server = http.server.ThreadingHTTPServer((host, port), Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name='flaco-metrics',
+                     daemon=True).start()
+    return _server
+
+
+class SnapshotWriter:
+    """Appends registry.snapshot() to a JSON lines file every interval
+    seconds from a daemon thread.
+
+    Example:
+        writer = SnapshotWriter('metrics.jsonl', interval=60).start()
+        ...
+        writer.stop()
+    """
+    def __init__(self, path, interval=60, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='flaco-snapshots', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the thread after writing a final snapshot."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self):
+        with open(self.path, 'a') as target:
+            target.write(json.dumps(self.registry.snapshot()) + '\n')
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.write()
+        self.write()
+
+
+def main():
+    _server = serve()
+    print('Serving metrics on http://127.0.0.1:{}/metrics'.format(
+        _server.server_address[1]))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print('\nGoodbye')
+        _server.shutdown()
+
+if __name__ == "__main__":
+    main()
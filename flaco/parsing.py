@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Parallel parsing of collected command output into records. Templates are
+chosen by command and may be regular expressions with named groups or
+TextFSM templates (TextFSM needs the textfsm package). Outputs are parsed in
+batches on a process pool; each worker compiles a template once, the first
+time it needs it, and records are yielded as batches finish.
+
+Outputs can come from goten job files (text or jsonl, optionally gzip
+compressed), from SSH.commander() dicts or from a configstore.ConfigStore.
+
+>>> from parsing import ParsePipeline, Template, from_job
+>>> templates = [
+...     Template(r'show version', regex=r'Version (?P<version>\\S+),'),
+...     Template(r'show ip int(erface)? br(ief)?',
+...              textfsm='templates/show_ip_interface_brief.textfsm')]
+>>> pipeline = ParsePipeline(templates)
+>>> for record in pipeline.run(from_job('job.jsonl.gz')):
+...     print(record)
+{'device': '192.168.64.1', 'timestamp': '2024-05-01 02:00:01.194518',
+'command': 'show version', 'version': '15.2(4)M7'}
+
+    python parsing.py templates.json job.jsonl > records.jsonl
+
+"""
+
+import gzip
+import io
+import json
+import os
+import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from sink import split_key
+
+
+class Template:
+    """Parsing rule for the outputs of commands matching a pattern.
+    Holds only text, so it is cheap to send to worker processes; the
+    compiled form is built and cached in each worker.
+
+    Example:
+        Template(r'show clock', regex=r'(?P<time>\\d+:\\d+:\\d+)')
+    """
+    __slots__ = ('command', 'regex', 'textfsm', 'flags')
+
+    def __init__(self, command, regex=None, textfsm=None, flags=re.MULTILINE):
+        """
+        :param command: string, regular expression the whole command must
+        match.
+        :param regex: string, expression with named groups; every match is
+        one record.
+        :param textfsm: string, TextFSM template path or text; every row is
+        one record with the template's value names as keys.
+        :param flags: integer, re flags for regex.
+        """
+        if (regex is None) == (textfsm is None):
+            raise ValueError('A template needs either regex or textfsm.')
+        self.command = command
+        self.regex = regex
+        self.textfsm = textfsm
+        self.flags = flags
+
+    @classmethod
+    def load(cls, path):
+        """Reads templates from a JSON list of {"command": ..., "regex": ...}
+        or {"command": ..., "textfsm": ...} objects. Relative TextFSM paths
+        are resolved against the directory of path.
+
+        :return: list of Template objects.
+        """
+        with open(path, 'r') as source:
+            _specs = json.load(source)
+        _base = os.path.dirname(os.path.abspath(path))
+        _templates = []
+        for spec in _specs:
+            _textfsm = spec.get('textfsm')
+            if _textfsm is not None and '\n' not in _textfsm:
+                _textfsm = os.path.join(_base, _textfsm)
+            _templates.append(cls(spec['command'], spec.get('regex'),
+                                  _textfsm))
+        return _templates
+
+
+# Per process: templates installed by the pool initializer and compiled
+# parsers, keyed by template index.
+_TEMPLATES = []
+_COMMANDS = []
+_COMPILED = {}
+
+
+def _install(templates):
+    _TEMPLATES[:] = templates
+    _COMMANDS[:] = [re.compile(template.command) for template in templates]
+    _COMPILED.clear()
+
+
+def _select(command):
+    for index, pattern in enumerate(_COMMANDS):
+        if pattern.fullmatch(command.strip()):
+            return index
+    return None
+
+
+def _compile(index):
+    _parser = _COMPILED.get(index)
+    if _parser is not None:
+        return _parser
+    _template = _TEMPLATES[index]
+    if _template.regex is not None:
+        _pattern = re.compile(_template.regex, _template.flags)
+        _parser = lambda output: [match.groupdict() for match in
+                                  _pattern.finditer(output)]
+    else:
+        try:
+            import textfsm
+        except ImportError:
+            raise ValueError('TextFSM templates need the textfsm package; '
+                             'use regex templates instead.')
+        _text = _template.textfsm
+        if '\n' not in _text:
+            with open(_text, 'r') as source:
+                _text = source.read()
+        _fsm = textfsm.TextFSM(io.StringIO(_text))
+
+        def _parser(output):
+            _fsm.Reset()
+            return [dict(zip(_fsm.header, row))
+                    for row in _fsm.ParseText(output)]
+    _COMPILED[index] = _parser
+    return _parser
+
+
+def parse_output(device, timestamp, command, output):
+    """Parses one output with the installed templates.
+
+    :return: list of record dicts; each carries device, timestamp and
+    command, or an 'error' key when the template failed. Empty when no
+    template matches command.
+    """
+    _index = _select(command)
+    if _index is None:
+        return []
+    _base = {'device': device, 'timestamp': timestamp, 'command': command}
+    try:
+        _rows = _compile(_index)(output)
+    except Exception as e:
+        return [dict(_base, error=str(e) or repr(e))]
+    return [dict(_base, **row) for row in _rows]
+
+
+def _parse_batch(batch):
+    _records = []
+    for item in batch:
+        _records.extend(parse_output(*item))
+    return _records
+
+
+class ParsePipeline:
+    """Parses (device, timestamp, command, output) items on a process pool.
+
+    Example:
+        pipeline = ParsePipeline(Template.load('templates.json'))
+        records = list(pipeline.run(from_job('job.jsonl')))
+    """
+    def __init__(self, templates, workers=None, batch_size=64,
+                 in_flight=4):
+        """
+        :param templates: list of Template objects; the first one whose
+        command pattern matches is used.
+        :param workers: integer, worker processes; None uses every core and
+        1 parses in this process.
+        :param batch_size: integer, outputs sent to a worker at once.
+        :param in_flight: integer, batches queued per worker; bounds memory
+        when the source is larger than what fits in it.
+        """
+        self.templates = list(templates)
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.in_flight = in_flight
+
+    def run(self, items):
+        """Parses items and yields records as their batch finishes, so
+        records of different batches may arrive out of source order.
+
+        :param items: iterable of (device, timestamp, command, output)
+        tuples; see from_job(), from_outputs() and from_store().
+        :return: generator of record dicts.
+        """
+        if self.workers == 1:
+            _install(self.templates)
+            for item in items:
+                yield from parse_output(*item)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=_install,
+                                 initargs=(self.templates,)) as executor:
+            _limit = self.workers * self.in_flight
+            _pending = set()
+            for batch in _batches(items, self.batch_size):
+                _pending.add(executor.submit(_parse_batch, batch))
+                if len(_pending) >= _limit:
+                    _done, _pending = wait(_pending,
+                                           return_when=FIRST_COMPLETED)
+                    for future in _done:
+                        yield from future.result()
+            while _pending:
+                _done, _pending = wait(_pending, return_when=FIRST_COMPLETED)
+                for future in _done:
+                    yield from future.result()
+
+
+def _batches(items, size):
+    _batch = []
+    for item in items:
+        _batch.append(tuple(item))
+        if len(_batch) >= size:
+            yield _batch
+            _batch = []
+    if _batch:
+        yield _batch
+
+
+def from_outputs(device, outputs):
+    """Items from an SSH.commander() dict.
+
+    :return: generator of (device, timestamp, command, output) tuples.
+    """
+    for key, output in outputs.items():
+        _stamp, _command = split_key(key)
+        yield device.strip(), _stamp, _command, output
+
+
+def from_job(path):
+    """Items from a goten job file, read as a stream. Devices recorded with
+    an error are skipped.
+
+    :param path: string, text or jsonl job file; '.gz' is decompressed and
+    '.jsonl' (before '.gz') selects the JSON lines reader.
+    :return: generator of (device, timestamp, command, output) tuples.
+    """
+    _opener = gzip.open if path.endswith('.gz') else open
+    _jsonl = path[:-3].endswith('.jsonl') if path.endswith('.gz') \
+        else path.endswith('.jsonl')
+    with _opener(path, 'rt', encoding='utf-8') as source:
+        if _jsonl:
+            for line in source:
+                if not line.strip():
+                    continue
+                _entry = json.loads(line)
+                if 'output' in _entry:
+                    yield (_entry['device'], _entry.get('timestamp'),
+                           _entry['command'], _entry['output'])
+            return
+        yield from _text_items(source)
+
+
+_DEVICE = re.compile(r'^Device \[(.*)\]:$')
+
+
+def _text_items(lines):
+    _device = _stamp = _command = None
+    _output = []
+    for line in lines:
+        _header = _DEVICE.match(line.rstrip('\n'))
+        _stamp_next, _command_next = split_key(line.rstrip('\n'))
+        if _header is None and _stamp_next is None:
+            if _command is not None:
+                _output.append(line)
+            continue
+        if _command is not None:
+            # JobWriter inserts a blank line before every device header.
+            if _header is not None and _output and _output[-1] == '\n':
+                _output.pop()
+            yield _device, _stamp, _command, ''.join(_output)
+        _output = []
+        if _header is not None:
+            _device, _stamp, _command = _header.group(1), None, None
+        else:
+            _stamp, _command = _stamp_next, _command_next
+    if _command is not None:
+        yield _device, _stamp, _command, ''.join(_output)
+
+
+def from_store(store, device=None):
+    """Items for the latest output of every (device, command) in a
+    configstore.ConfigStore.
+
+    :return: generator of (device, timestamp, command, output) tuples.
+    """
+    for entry in store.latest(device):
+        yield (entry['device'], entry['changed'], entry['command'],
+               store.get(entry['digest']).decode('utf-8'))
+
+
+def main():
+    if len(sys.argv) < 3:
+        print('Usage: parsing.py TEMPLATES.json JOB_FILE [JOB_FILE ...]')
+        return
+
+    def _items():
+        for path in sys.argv[2:]:
+            yield from from_job(path)
+
+    _pipeline = ParsePipeline(Template.load(sys.argv[1]))
+    for record in _pipeline.run(_items()):
+        print(json.dumps(record))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Timeout, retry and hedging policies for checks. Timeouts adapt to the round
+trip times observed per target with the TCP retransmission timeout estimator
+(RFC 6298), attempts that time out are retried after a jittered exponential
+backoff, slow DNS and HTTP requests are hedged with a second request, and
+every check runs inside a deadline so one slow target cannot stall a cycle.
+
+>>> from policy import Deadline, PolicyEngine
+>>> engine = PolicyEngine()
+>>> cycle = Deadline(10)          # budget for a whole run
+>>> engine.dns('yahoo.com', ['8.8.8.8', '8.8.4.4'], 'A', cycle).detail
+'98.139.183.24, 206.190.36.45, 98.138.253.109'
+>>> engine.socket('yahoo.com', 443, 'TCP', cycle).status
+<Status.OK: 'ok'>
+>>> round(engine.estimator('socket', 'yahoo.com').timeout(), 3)
+0.2
+
+"""
+
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from result import CheckResult, Status
+from toolkit import Toolkit
+
+
+class Deadline:
+    """Point in time a check or a whole cycle must finish by.
+
+    Example:
+        cycle = Deadline(30)
+        timeout = cycle.cap(2.0)
+    """
+    def __init__(self, seconds=None):
+        """
+        :param seconds: float, budget from now; None never expires.
+        """
+        self.expires = None if seconds is None else \
+            time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left, never negative; None without a budget."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def cap(self, timeout):
+        """Returns timeout shortened to the time left."""
+        _remaining = self.remaining()
+        return timeout if _remaining is None else min(timeout, _remaining)
+
+    def within(self, seconds):
+        """Returns the earlier of this deadline and seconds from now."""
+        _deadline = Deadline(seconds)
+        if self.expires is not None and (_deadline.expires is None or
+                                         self.expires < _deadline.expires):
+            _deadline.expires = self.expires
+        return _deadline
+
+
+class RTOEstimator:
+    """Retransmission timeout estimator of RFC 6298 for one target.
+
+    Example:
+        estimator = RTOEstimator()
+        estimator.update(0.030)
+        timeout = estimator.timeout()
+    """
+    def __init__(self, initial=1.0, minimum=0.2, maximum=10.0, alpha=0.125,
+                 beta=0.25, k=4):
+        """
+        :param initial: float, timeout before any sample.
+        :param minimum: float, lower bound of the timeout.
+        :param maximum: float, upper bound of the timeout.
+        :param alpha: float, gain of the smoothed RTT.
+        :param beta: float, gain of the RTT variation.
+        :param k: float, variations added to the smoothed RTT.
+        """
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.alpha = alpha
+        self.beta = beta
+        self.k = k
+        self.srtt = None
+        self.rttvar = None
+        self._rto = initial
+        self._lock = threading.Lock()
+
+    def update(self, rtt):
+        """Adds a round trip time measured on an attempt that was not
+        retried (Karn's algorithm).
+        """
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (1 - self.beta) * self.rttvar + \
+                    self.beta * abs(self.srtt - rtt)
+                self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+            self._rto = min(self.maximum, max(
+                self.minimum, self.srtt + self.k * self.rttvar))
+
+    def backoff(self):
+        """Doubles the timeout after an attempt timed out."""
+        with self._lock:
+            self._rto = min(self.maximum, self._rto * 2)
+
+    def timeout(self):
+        return self._rto
+
+    def hedge_delay(self):
+        """Time after which a request is slower than usual and worth
+        hedging: the smoothed RTT plus two variations.
+        """
+        with self._lock:
+            if self.srtt is None:
+                return self.initial / 2
+            return min(self._rto, max(self.minimum / 2,
+                                      self.srtt + 2 * self.rttvar))
+
+
+class Policy:
+    """How one kind of check is run.
+
+    Attributes:
+        retries: integer, attempts after the first.
+        retry_on: tuple of result.Status members that are retried.
+        base_delay: float, first backoff delay in seconds.
+        max_delay: float, upper bound of a backoff delay.
+        budget: float, seconds a check may take including retries.
+        hedge: bool, send a second request when the first is slow.
+        estimator: dict, RTOEstimator arguments for new targets.
+    """
+    def __init__(self, retries=2, retry_on=(Status.TIMEOUT,), base_delay=0.05,
+                 max_delay=1.0, budget=5.0, hedge=False, **estimator):
+        self.retries = retries
+        self.retry_on = tuple(retry_on)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.hedge = hedge
+        self.estimator = estimator
+
+    def delay(self, attempt):
+        """Backoff before retry number attempt (0 based), with full jitter.
+        """
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+
+POLICIES = {
+    'dns': Policy(retries=2, budget=4.0, hedge=True, initial=1.0),
+    'socket': Policy(retries=1, budget=5.0, initial=2.0),
+    'url': Policy(retries=1, budget=10.0, hedge=True, initial=3.0,
+                  maximum=15.0),
+    # A ping that lost every reply is retried once before it is reported.
+    'host': Policy(retries=1, retry_on=(Status.TIMEOUT, Status.FAIL),
+                   budget=8.0, initial=1.0, maximum=5.0),
+}
+
+
+class PolicyEngine:
+    """Runs checks under per-check policies with per-target timeout
+    estimators.
+
+    Example:
+        engine = PolicyEngine()
+        result = engine.url('https://yahoo.com', deadline=Deadline(10))
+    """
+    def __init__(self, policies=None, hedge_workers=32):
+        """
+        :param policies: dict, check -> Policy; missing checks use POLICIES.
+        :param hedge_workers: integer, threads for hedged requests.
+        """
+        self.policies = dict(POLICIES, **(policies or {}))
+        self._estimators = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=hedge_workers,
+                                            thread_name_prefix='flaco-hedge')
+
+    def estimator(self, check, target):
+        """Returns the RTOEstimator of (check, target), creating it."""
+        with self._lock:
+            _estimator = self._estimators.get((check, target))
+            if _estimator is None:
+                _estimator = self._estimators[(check, target)] = \
+                    RTOEstimator(**self.policies[check].estimator)
+            return _estimator
+
+    def run(self, check, target, attempt, deadline=None, sample=None):
+        """Runs attempt under the policy of check.
+
+        :param check: string, 'dns', 'host', 'socket' or 'url'.
+        :param target: hashable, key of the timeout estimator.
+        :param attempt: callable, attempt(timeout, number) returning a
+        result.CheckResult; number is 0 for the first request and counts
+        up for retries and hedges.
+        :param deadline: Deadline, e.g. of the whole cycle; the policy budget
+        applies within it.
+        :param sample: callable, sample(result) returning the round trip
+        time in seconds fed to the estimator, or None to skip; defaults to
+        the result latency.
+        :return: result.CheckResult of the last attempt, or a TIMEOUT
+        result if the deadline left no time to try.
+        """
+        _policy = self.policies[check]
+        _deadline = (deadline or Deadline()).within(_policy.budget)
+        _estimator = self.estimator(check, target)
+        _sample = sample or _latency
+        _result = None
+        _number = 0
+        for retry in range(_policy.retries + 1):
+            _timeout = _deadline.cap(_estimator.timeout())
+            if _timeout <= 0:
+                break
+            if retry:
+                metrics.CHECK_RETRIES.inc(check)
+            if _policy.hedge:
+                _result, _number = self._hedged(
+                    check, attempt, _timeout, _estimator, _number, _deadline,
+                    _policy)
+            else:
+                _result = attempt(_timeout, _number)
+                _number += 1
+            if _result.status is Status.TIMEOUT:
+                _estimator.backoff()
+            elif retry == 0 and not _result.cached:
+                # Cache hits take no time and would drag the RTO to its
+                # floor, timing out the next real lookup.
+                _rtt = _sample(_result)
+                if _rtt is not None:
+                    _estimator.update(_rtt)
+            if _result.status not in _policy.retry_on:
+                return _result
+            _pause = _deadline.cap(_policy.delay(retry))
+            if retry < _policy.retries and _pause:
+                time.sleep(_pause)
+        if _result is None:
+            _result = CheckResult(check, str(target), Status.TIMEOUT, 0.0,
+                                  'Deadline exceeded before the check ran.')
+        return _result
+
+    def _hedged(self, check, attempt, timeout, estimator, number, deadline,
+                policy):
+        # The first request runs on the caller's thread; the executor only
+        # carries the hedge, sent if the first is still running after the
+        # hedge delay.
+        _delay = estimator.hedge_delay()
+        _finished = threading.Event()
+
+        def hedge():
+            if _finished.wait(_delay) or not _deadline_left(deadline, _delay):
+                return None
+            metrics.CHECK_HEDGES.inc(check)
+            return attempt(max(timeout - _delay, 0.001), number + 1)
+
+        _hedge = self._executor.submit(hedge)
+        try:
+            _result = attempt(timeout, number)
+        finally:
+            _finished.set()
+        if _result.status not in policy.retry_on:
+            return _result, number + 1  # not retried; number is unused
+        _other = _hedge.result()
+        if _other is None:
+            return _result, number + 1
+        return _other, number + 2
+
+    def dns(self, node, nservers, qtype, deadline=None, fresh=False):
+        """Toolkit.probe_dns() under the 'dns' policy. Hedged and retried
+        requests ask the nameservers in rotated order.
+        """
+        _nservers = list(nservers)
+        _toolkit = Toolkit(node)
+
+        def attempt(timeout, number):
+            _shift = number % len(_nservers)
+            _result = _toolkit.probe_dns(
+                _nservers[_shift:] + _nservers[:_shift], qtype,
+                fresh or number > 0, timeout)
+            _result.params = (qtype, tuple(_nservers))
+            return _result
+        return self.run('dns', tuple(_nservers), attempt, deadline)
+
+    def host(self, node, count=9, deadline=None, interval=.2):
+        """Toolkit.probe_host() under the 'host' policy; the timeout bounds
+        the wait for replies after the last echo request, so the estimator
+        learns the average echo RTT rather than the length of the ping.
+        """
+        _toolkit = Toolkit(node)
+        return self.run('host', node, lambda timeout, number:
+                        _toolkit.probe_host(count, timeout, interval),
+                        deadline, _echo_rtt)
+
+    def socket(self, node, port, kind='TCP', deadline=None):
+        """Toolkit.probe_socket() under the 'socket' policy; the estimator
+        is shared by every port of node.
+        """
+        _toolkit = Toolkit(node)
+        return self.run('socket', node, lambda timeout, number:
+                        _toolkit.probe_socket(port, kind, timeout), deadline)
+
+    def url(self, url, pool=None, deadline=None):
+        """Toolkit.probe_url() under the 'url' policy; the estimator is
+        shared by every URL of the same scheme, host and port.
+        """
+        _toolkit = Toolkit()
+        _parts = urllib.parse.urlsplit(url)
+        return self.run('url', (_parts.scheme, _parts.netloc),
+                        lambda timeout, number:
+                        _toolkit.probe_url(url, pool, timeout), deadline)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def _latency(result):
+    return result.latency
+
+
+def _echo_rtt(result):
+    # result.data is the icmp.PingResult, None on the ping command fallback.
+    _rtt = result.data.rtt() if result.data is not None else None
+    return None if _rtt is None else _rtt[1] / 1000
+
+
+def _deadline_left(deadline, seconds):
+    _remaining = deadline.remaining()
+    return _remaining is None or _remaining > seconds
+
+
+def main():
+    engine = PolicyEngine()
+    cycle = Deadline(15)
+    print(engine.dns('yahoo.com', ['8.8.8.8', '8.8.4.4'], 'A', cycle))
+    for port in (80, 443):
+        print(engine.socket('yahoo.com', port, 'TCP', cycle))
+    print(engine.url('https://yahoo.com', deadline=cycle))
+    print('Timeout for yahoo.com sockets: {:.3f}s'.format(
+        engine.estimator('socket', 'yahoo.com').timeout()))
+    engine.close()
+
+if __name__ == "__main__":
+    main()
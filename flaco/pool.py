@@ -0,0 +1,180 @@
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Keyed pool of open SSH clients so repeated jobs and follow-up SCP pulls to the
+same device reuse an authenticated transport instead of paying the TCP, key
+exchange and authentication handshake again.
+
+>>> from pool import ConnectionPool
+>>> from ssh import SSH
+>>> pool = ConnectionPool(idle_timeout=300, keepalive=30, max_per_host=2)
+>>> test = SSH(username, password, pool=pool)
+>>> test.commander(device, ['pwd'])
+>>> test.get_scp(device, file, destination)   # same transport as above
+>>> pool.close_all()
+
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+
+class ConnectionPool:
+    """Thread-safe pool of paramiko.SSHClient objects keyed by
+    (host, port, username).
+
+    Clients are handed out with acquire() and returned with release(). Idle
+    clients older than idle_timeout are closed, and clients whose transport
+    is no longer active are dropped before they are handed out again.
+
+    Example:
+        pool = ConnectionPool()
+        client = pool.acquire(key, factory)
+        ...
+        pool.release(key, client)
+    """
+    def __init__(self, idle_timeout=300, keepalive=30, max_per_host=4):
+        """Initialize the pool.
+
+        :param idle_timeout: float, seconds an unused client stays open.
+        :param keepalive: integer, seconds between SSH keepalive packets on
+        pooled transports; 0 disables keepalives.
+        :param max_per_host: integer, maximum open clients per key, idle and
+        in use combined. acquire() blocks when the limit is reached.
+        """
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.max_per_host = max_per_host
+        self._idle = defaultdict(list)   # key -> [(client, released_at)]
+        self._open = defaultdict(int)    # key -> idle + in use
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(host, port, username):
+        """Builds the pool key for a target.
+
+        :return: tuple, (host, port, username).
+        """
+        return host.strip(), int(port), username
+
+    def acquire(self, key, factory, timeout=None):
+        """Returns a healthy idle client for key, or calls factory() to open a
+        new one when none is idle and the per-host limit allows it.
+
+        :param key: tuple, as returned by ConnectionPool.key().
+        :param factory: callable, returns a connected paramiko.SSHClient.
+        Exceptions raised by factory propagate to the caller.
+        :param timeout: float, seconds to wait for a free slot; None waits
+        indefinitely.
+        :return: paramiko.SSHClient object.
+        """
+        _deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._reap(key)
+                while self._idle[key]:
+                    _client, _stamp = self._idle[key].pop()
+                    if self.healthy(_client):
+                        self.hits += 1
+                        return _client
+                    self._drop(key, _client)
+                if self._open[key] < self.max_per_host:
+                    self._open[key] += 1
+                    self.misses += 1
+                    break
+                _remaining = None if _deadline is None \
+                    else _deadline - time.monotonic()
+                if _remaining is not None and _remaining <= 0:
+                    raise TimeoutError(
+                        'No free connection to {} within {}s.'.format(
+                            key[0], timeout))
+                self._cond.wait(_remaining)
+        try:
+            _client = factory()
+        except BaseException:
+            with self._cond:
+                self._open[key] -= 1
+                self._cond.notify()
+            raise
+        _transport = _client.get_transport()
+        if self.keepalive and _transport is not None:
+            _transport.set_keepalive(self.keepalive)
+        return _client
+
+    def release(self, key, client):
+        """Returns a client to the pool for reuse. Unhealthy clients are
+        closed instead.
+
+        :param key: tuple, as returned by ConnectionPool.key().
+        :param client: paramiko.SSHClient returned by acquire().
+        """
+        with self._cond:
+            if self.healthy(client):
+                self._idle[key].append((client, time.monotonic()))
+            else:
+                self._drop(key, client)
+            self._cond.notify()
+
+    def discard(self, key, client):
+        """Closes a client instead of returning it to the pool. Use after an
+        error that may have left the session in an unknown state.
+        """
+        with self._cond:
+            self._drop(key, client)
+            self._cond.notify()
+
+    @staticmethod
+    def healthy(client):
+        """Health check: the transport must still be active. Sends nothing,
+        so acquire() and release() add no round trip; idle clients older
+        than idle_timeout are closed before this check.
+
+        :return: bool, True if the client can be reused.
+        """
+        _transport = client.get_transport()
+        return _transport is not None and _transport.is_active()
+
+    def reap(self):
+        """Closes idle clients older than idle_timeout across all keys."""
+        with self._cond:
+            for key in list(self._idle):
+                self._reap(key)
+            self._cond.notify_all()
+
+    def close_all(self):
+        """Closes every idle client. Clients currently in use are not
+        touched; call reap() or close_all() again after they are released.
+        """
+        with self._cond:
+            for key, entries in self._idle.items():
+                for _client, _stamp in entries:
+                    _client.close()
+                    self._open[key] -= 1
+                entries.clear()
+            self._cond.notify_all()
+
+    def _reap(self, key):
+        _now = time.monotonic()
+        _keep = []
+        for _client, _stamp in self._idle[key]:
+            if _now - _stamp > self.idle_timeout:
+                self._drop(key, _client)
+            else:
+                _keep.append((_client, _stamp))
+        self._idle[key] = _keep
+
+    def _drop(self, key, client):
+        try:
+            client.close()
+        finally:
+            self._open[key] -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close_all()
@@ -0,0 +1,87 @@
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Structured check results. Toolkit.probe_*() methods return CheckResult
+records; the strings Toolkit.check_*() and Element have always returned are
+rendered from them, so downstream code can aggregate on status and latency
+without parsing text.
+
+>>> from toolkit import Toolkit
+>>> result = Toolkit('yahoo.com').probe_socket(443, 'TCP', timeout=2)
+>>> result.status
+<Status.OK: 'ok'>
+>>> result.ok, round(result.latency, 3), result.detail
+(True, 0.021, 'open')
+>>> result.as_tuple()
+('socket', 'yahoo.com', 'ok', 0.0213, 'open', ('TCP', 443))
+
+"""
+
+import enum
+
+
+class Status(enum.Enum):
+    """Outcome of a check.
+
+    OK        the check passed.
+    DEGRADED  partially passed, e.g. some ping loss.
+    FAIL      the target answered negatively: NXDOMAIN, RST, HTTP 4xx/5xx,
+              100% loss.
+    TIMEOUT   no answer within the allowed time.
+    ERROR     the check could not be run: bad input, resolution error, no
+              route.
+    """
+    OK = 'ok'
+    DEGRADED = 'degraded'
+    FAIL = 'fail'
+    TIMEOUT = 'timeout'
+    ERROR = 'error'
+
+
+class CheckResult:
+    """Compact record of one check.
+
+    Attributes:
+        check: string, 'dns', 'host', 'socket' or 'url'.
+        target: string, node or URL checked.
+        status: Status member.
+        latency: float, seconds the check took.
+        detail: string, the text Toolkit.check_*() returns for this check.
+        params: tuple, check parameters: (qtype, nameservers) for dns,
+        (count,) for host, (kind, port) for socket, () for url.
+        data: raw structured data: list of records (dns), icmp.PingResult
+        (host), HTTP status code (url) or None.
+        cached: bool, True when served from a cache (dns) rather than
+        measured; latency then says nothing about the target.
+    """
+    __slots__ = ('check', 'target', 'status', 'latency', 'detail', 'params',
+                 'data', 'cached')
+
+    def __init__(self, check, target, status, latency, detail, params=(),
+                 data=None, cached=False):
+        self.check = check
+        self.target = target
+        self.status = status
+        self.latency = latency
+        self.detail = detail
+        self.params = params
+        self.data = data
+        self.cached = cached
+
+    @property
+    def ok(self):
+        return self.status is Status.OK
+
+    def as_tuple(self):
+        """Flat, picklable and JSON friendly form without the raw data.
+
+        :return: tuple, (check, target, status value, latency, detail,
+        params).
+        """
+        return (self.check, self.target, self.status.value,
+                round(self.latency, 6), self.detail, self.params)
+
+    def __repr__(self):
+        return 'CheckResult({!r}, {!r}, {}, {:.6f})'.format(
+            self.check, self.target, self.status, self.latency)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Parallel port sweeps. Non-blocking connects for many hosts and port ranges
+are multiplexed on one selector, each with its own timeout, under a global
+cap on sockets in flight. Results are yielded as they arrive.
+
+States: open, closed (TCP RST), filtered (no answer before the timeout) and
+unreachable (ICMP unreachable, e.g. a closed UDP port). Hosts that cannot be
+resolved are reported as error.
+
+>>> from scanner import PortScanner
+>>> scanner = PortScanner(timeout=1, concurrency=500)
+>>> for result in scanner.scan(['yahoo.com'], '80,443,8000-8002'):
+...     print(result.host, result.port, result.state)
+yahoo.com 443 open
+yahoo.com 80 open
+yahoo.com 8000 filtered
+yahoo.com 8001 filtered
+yahoo.com 8002 filtered
+
+"""
+
+import errno
+import heapq
+import itertools
+import os
+import selectors
+import socket
+import time
+
+OPEN = 'open'
+CLOSED = 'closed'
+FILTERED = 'filtered'
+UNREACHABLE = 'unreachable'
+ERROR = 'error'
+
+_UNREACHABLE = (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ECONNREFUSED)
+
+
+def parse_ports(ports):
+    """Expands a port specification into a list of port numbers.
+
+    :param ports: integer, string such as '22,80,8000-8010', or an iterable
+    of integers and such strings.
+    :return: list of integers, duplicates removed, order kept.
+    """
+    if isinstance(ports, int):
+        ports = [ports]
+    elif isinstance(ports, str):
+        ports = ports.split(',')
+    _expanded = []
+    for item in ports:
+        if isinstance(item, int):
+            _expanded.append(item)
+            continue
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            _low, _high = item.split('-', 1)
+            _expanded.extend(range(int(_low), int(_high) + 1))
+        else:
+            _expanded.append(int(item))
+    return list(dict.fromkeys(_expanded))
+
+
+class ScanResult:
+    """State of one (host, port) probe.
+
+    Attributes:
+        host: string, host as given to PortScanner.scan().
+        port: integer, port number.
+        kind: string, TCP or UDP.
+        state: string, one of open, closed, filtered, unreachable, error.
+        latency: float, seconds from connect to answer; None if filtered.
+        detail: string, 'open' or the socket error text Toolkit.check_socket()
+        would have returned.
+    """
+    __slots__ = ('host', 'port', 'kind', 'state', 'latency', 'detail')
+
+    def __init__(self, host, port, kind, state, latency=None, detail=None):
+        self.host = host
+        self.port = port
+        self.kind = kind
+        self.state = state
+        self.latency = latency
+        self.detail = detail if detail is not None else state
+
+    def __repr__(self):
+        return 'ScanResult({!r}, {}, {!r}, {!r})'.format(
+            self.host, self.port, self.kind, self.state)
+
+
+class PortScanner:
+    """Selector based TCP/UDP port scanner.
+
+    Example:
+        scanner = PortScanner(timeout=1, concurrency=1000)
+        for result in scanner.scan(hosts, '1-1024'):
+            print(result.host, result.port, result.state)
+    """
+    def __init__(self, timeout=1.0, concurrency=1000, udp_payload=b''):
+        """Initialize scan settings.
+
+        :param timeout: float, seconds each connect or UDP probe may take.
+        :param concurrency: integer, maximum sockets in flight.
+        :param udp_payload: bytes, datagram sent to UDP ports.
+        """
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.udp_payload = udp_payload
+
+    def scan(self, hosts, ports, kind='TCP'):
+        """Probes every port on every host and yields ScanResult objects in
+        completion order.
+
+        :param hosts: iterable of strings, names or IPv4 addresses.
+        :param ports: port specification accepted by parse_ports().
+        :param kind: string, port type TCP or UDP.
+        :return: generator of ScanResult objects.
+        """
+        _udp = kind == 'udp' or kind == 'UDP'
+        _kind = 'UDP' if _udp else 'TCP'
+        _ports = parse_ports(ports)
+        _targets = ((host, port) for host in hosts for port in _ports)
+        _addresses = {}
+        _selector = selectors.DefaultSelector()
+        _inflight = {}   # socket -> (host, port, started)
+        _deadlines = []  # heap of (deadline, sequence, socket)
+        _sequence = itertools.count()
+        try:
+            while True:
+                while len(_inflight) < self.concurrency:
+                    _target = next(_targets, None)
+                    if _target is None:
+                        break
+                    _host, _port = _target
+                    if _host not in _addresses:
+                        try:
+                            _addresses[_host] = socket.gethostbyname(_host)
+                        except (socket.gaierror, UnicodeError) as e:
+                            _addresses[_host] = e
+                    _address = _addresses[_host]
+                    if isinstance(_address, Exception):
+                        yield ScanResult(_host, _port, _kind, ERROR,
+                                         detail=str(_address))
+                        continue
+                    try:
+                        _sock = self._start(_address, _port, _udp)
+                    except (OSError, OverflowError) as e:
+                        yield self._failed(_host, _port, _kind, e, None)
+                        continue
+                    _selector.register(
+                        _sock, selectors.EVENT_READ if _udp
+                        else selectors.EVENT_WRITE)
+                    _started = time.monotonic()
+                    _inflight[_sock] = (_host, _port, _started)
+                    heapq.heappush(_deadlines, (
+                        _started + self.timeout, next(_sequence), _sock))
+                if not _inflight:
+                    break
+
+                _wait = max(0.0, _deadlines[0][0] - time.monotonic())
+                for key, _ in _selector.select(_wait):
+                    _sock = key.fileobj
+                    _host, _port, _started = _inflight.pop(_sock)
+                    _selector.unregister(_sock)
+                    yield self._finish(_sock, _host, _port, _kind, _udp,
+                                       time.monotonic() - _started)
+                    _sock.close()
+
+                _now = time.monotonic()
+                while _deadlines and _deadlines[0][0] <= _now:
+                    _, _, _sock = heapq.heappop(_deadlines)
+                    if _sock not in _inflight:
+                        continue  # already answered
+                    _host, _port, _ = _inflight.pop(_sock)
+                    _selector.unregister(_sock)
+                    _sock.close()
+                    yield ScanResult(_host, _port, _kind, FILTERED,
+                                     detail='timed out')
+        finally:
+            for _sock in _inflight:
+                _sock.close()
+            _selector.close()
+
+    def _start(self, address, port, udp):
+        if not 0 <= port <= 65535:
+            raise OverflowError('connect(): port must be 0-65535.')
+        _sock = socket.socket(
+            socket.AF_INET, socket.SOCK_DGRAM if udp else socket.SOCK_STREAM)
+        _sock.setblocking(False)
+        try:
+            if udp:
+                _sock.connect((address, port))
+                _sock.send(self.udp_payload)
+            else:
+                _err = _sock.connect_ex((address, port))
+                if _err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    raise OSError(_err, os.strerror(_err))
+        except BaseException:
+            _sock.close()
+            raise
+        return _sock
+
+    def _finish(self, sock, host, port, kind, udp, latency):
+        if udp:
+            try:
+                sock.recv(65535)
+            except OSError as e:
+                return self._failed(host, port, kind, e, latency)
+            return ScanResult(host, port, kind, OPEN, latency)
+        _err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if _err:
+            return self._failed(host, port, kind,
+                                OSError(_err, os.strerror(_err)), latency)
+        return ScanResult(host, port, kind, OPEN, latency)
+
+    @staticmethod
+    def _failed(host, port, kind, error, latency):
+        _errno = getattr(error, 'errno', None)
+        if kind == 'TCP' and _errno == errno.ECONNREFUSED:
+            _state = CLOSED
+        elif _errno in _UNREACHABLE:
+            _state = UNREACHABLE
+        else:
+            _state = ERROR
+        return ScanResult(host, port, kind, _state, latency, str(error))
+
+
+def main():
+    scanner = PortScanner(timeout=1, concurrency=500)
+    for result in scanner.scan(['yahoo.com', 'localhost'], '22,80,443'):
+        print('{} {}/{}: {} ({})'.format(
+            result.host, result.kind, result.port, result.state,
+            result.detail))
+
+if __name__ == "__main__":
+    main()
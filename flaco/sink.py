@@ -0,0 +1,152 @@
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Long-lived, buffered output sink for goten jobs. One file is opened per job
+and every device's results are written as a single block, so output from
+parallel workers never interleaves.
+
+Formats:
+    text   Device header followed by each 'DATE/TIME: ... CLI: ...' record,
+           as goten has always written.
+    jsonl  One JSON object per command, or per device on error.
+Either format is gzip compressed when the path ends in '.gz'.
+
+>>> from sink import JobWriter
+>>> with JobWriter('job.jsonl.gz', fmt='jsonl', fsync='close') as job:
+...     job.write_device('192.168.64.1', {'DATE/TIME: ... CLI: pwd': '/\\n'})
+...     job.write_device('192.168.64.2', error='Connection refused')
+
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+
+FORMATS = ('text', 'jsonl')
+FSYNC_POLICIES = ('never', 'flush', 'close')
+
+
+def split_key(key):
+    """Splits an SSH.commander() key into its timestamp and command.
+
+    :param key: string, 'DATE/TIME: <timestamp> CLI: <command>'.
+    :return: tuple, (timestamp, command); (None, key) if it does not match.
+    """
+    if key.startswith('DATE/TIME: ') and ' CLI: ' in key:
+        _stamp, _command = key[len('DATE/TIME: '):].split(' CLI: ', 1)
+        return _stamp, _command
+    return None, key
+
+
+class JobWriter:
+    """Thread-safe buffered writer for one job file.
+
+    Example:
+        job = JobWriter(job_name, fmt='text')
+        job.write_device(device, ssh.commander(device, commands))
+        job.close()
+    """
+    def __init__(self, path, fmt='text', flush_interval=1.0, fsync='never',
+                 buffer_size=1 << 20):
+        """Opens path for appending.
+
+        :param path: string, output file; a '.gz' suffix enables gzip.
+        :param fmt: string, 'text' or 'jsonl'.
+        :param flush_interval: float, seconds between flushes to the OS;
+        0 flushes after every device.
+        :param fsync: string, 'never', 'flush' (fsync on every flush) or
+        'close' (fsync once when the job ends).
+        :param buffer_size: integer, bytes buffered before a forced write.
+        """
+        if fmt not in FORMATS:
+            raise ValueError('Unknown format {!r}; use one of {}.'.format(
+                fmt, ', '.join(FORMATS)))
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('Unknown fsync policy {!r}; use one of {}.'
+                             .format(fsync, ', '.join(FSYNC_POLICIES)))
+        self.path = path
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.devices = 0
+        self._raw = open(path, 'ab', buffering=buffer_size)
+        if path.endswith('.gz'):
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='ab')
+        else:
+            self._stream = self._raw
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+
+    def write_device(self, device, outputs=None, error=None):
+        """Writes every result of one device as a single block.
+
+        :param device: string, IP address or hostname.
+        :param outputs: dict, SSH.commander() output; key -> command output.
+        :param error: string, error to record instead of outputs.
+        """
+        device = device.strip()
+        if self.fmt == 'jsonl':
+            _block = self._jsonl(device, outputs, error)
+        else:
+            _block = self._text(device, outputs, error)
+        with self._lock:
+            self._stream.write(_block.encode('utf-8'))
+            self.devices += 1
+            if time.monotonic() - self._flushed >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        """Flushes buffered output to the OS and applies the fsync policy."""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Flushes and closes the job file."""
+        with self._lock:
+            if self._raw.closed:
+                return
+            if self._stream is not self._raw:
+                self._stream.close()  # writes the gzip trailer
+            self._raw.flush()
+            if self.fsync != 'never':
+                os.fsync(self._raw.fileno())
+            self._raw.close()
+
+    def _flush(self):
+        if self._stream is not self._raw:
+            self._stream.flush()
+        self._raw.flush()
+        if self.fsync == 'flush':
+            os.fsync(self._raw.fileno())
+        self._flushed = time.monotonic()
+
+    @staticmethod
+    def _text(device, outputs, error):
+        _parts = ['\nDevice [{}]:\n'.format(device)]
+        if error is not None:
+            _parts.append('{}\n'.format(error))
+        else:
+            for key, value in (outputs or {}).items():
+                _parts.append('{}\n{}'.format(key, value))
+        return ''.join(_parts)
+
+    @staticmethod
+    def _jsonl(device, outputs, error):
+        if error is not None:
+            return json.dumps({'device': device, 'error': error}) + '\n'
+        _lines = []
+        for key, value in (outputs or {}).items():
+            _stamp, _command = split_key(key)
+            _lines.append(json.dumps({
+                'device': device, 'timestamp': _stamp, 'command': _command,
+                'output': value}))
+        return ''.join(line + '\n' for line in _lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
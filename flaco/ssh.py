@@ -21,26 +21,115 @@ SCP operations.
 
 """
 
-import paramiko
+import os
+import re
+import select
+import socket
+import threading
 import time
+from collections import deque
 from datetime import datetime
-from scp import SCPClient
+
+import lazy
+import metrics
+from result import Status
+
+# paramiko and scp take longer to import than most jobs take to start, so
+# they are loaded on first use.
+paramiko = lazy.load('paramiko')
+scp = lazy.load('scp')
+
+_logging_lock = threading.Lock()
+_logging_pid = None
+
+
+def setup_logging(path='paramiko.log', level='DEBUG'):
+    """Sends paramiko's log to path. Runs once per process; later calls,
+    including the one made by every connect, return right away.
+
+    :param path: string, log file, opened for appending.
+    :param level: string or integer, logging level of the 'paramiko'
+    logger.
+    :return: bool, True if this call set up the log.
+    """
+    global _logging_pid
+    if _logging_pid == os.getpid():
+        return False
+    with _logging_lock:
+        if _logging_pid == os.getpid():
+            return False
+        import logging
+        if isinstance(level, str):
+            level = logging.getLevelName(level)
+        paramiko.util.log_to_file(path, level)
+        _logging_pid = os.getpid()
+        return True
+
+
+class RateLimiter:
+    """Token bucket used to throttle commands sent to targets that cannot
+    keep up with back-to-back execution. Thread safe, so one limiter can be
+    shared by every SSH object talking to the same device.
+
+    Example:
+        limiter = RateLimiter(rate=2, burst=1)
+        test = SSH(username, password, rate_limit=limiter)
+    """
+    def __init__(self, rate, burst=1):
+        """Initialize the bucket.
+
+        :param rate: float, commands allowed per second.
+        :param burst: integer, commands allowed back-to-back before waiting.
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        with self._lock:
+            _now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (_now - self._stamp) * self.rate)
+            self._stamp = _now
+            self._tokens -= 1
+            _wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if _wait:
+            time.sleep(_wait)
 
 
 class SSH:
-    def __init__(self, username='rafael', password='default_pw_ro', port=22):
+    def __init__(self, username='rafael', password='default_pw_ro', port=22,
+                 timeout=None, rate_limit=None, pool=None, breakers=None):
         """Initialize username, password, and port.
 
         :param username: string, username
         :param password: string, password
         :param port: integer, TCP port, default value = 22
+        :param timeout: float, seconds allowed for connect, auth and each
+        command; None waits indefinitely.
+        :param rate_limit: RateLimiter, optional throttle applied before each
+        command; None sends commands as fast as the device answers.
+        :param pool: pool.ConnectionPool, optional pool that open clients are
+        borrowed from and returned to instead of being closed.
+        :param breakers: breaker.BreakerBoard, optional per-host breakers,
+        usually shared with toolkit.Toolkit.breakers; connects to a host
+        whose breaker is open raise breaker.CircuitOpen right away.
 
         Instance attribute self.client is an SSH client object.
         """
         self.username = username
         self.password = password
         self.port = port
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.pool = pool
+        self.breakers = breakers
         self.client = None
+        self.exit_status = None
+        self._key = None
         #self.output_list = []
         self.output_dict = dict()
 
@@ -51,17 +140,28 @@ class SSH:
 
         This method also creates an SSH log file.
 
+        When self.pool is set, an open client for (node, port, username) is
+        borrowed from the pool and a new one is only created on a miss.
+
+        When self.breakers is set, connect timeouts and unreachable hosts
+        count towards the host's breaker, and an open breaker raises
+        breaker.CircuitOpen without connecting.
+
         :param node: string, IP address or hostname
 
         Example:
             self.get_client(node)
         """
-        paramiko.util.log_to_file('paramiko.log')
-        _client = paramiko.SSHClient()
-        _client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client = None
+        if self.breakers is not None:
+            self.breakers.allow(node)
         try:
-            _client.connect(
-                node, self.port, self.username, self.password)
+            if self.pool is not None:
+                self._key = self.pool.key(node, self.port, self.username)
+                _client = self.pool.acquire(
+                    self._key, lambda: self._connect(node), self.timeout)
+            else:
+                _client = self._connect(node)
         except ConnectionRefusedError:
             print('Connection refused on {}.'.format(node.strip()))
         except paramiko.AuthenticationException:
@@ -73,6 +173,73 @@ class SSH:
         else:
             self.client = _client
 
+    def _connect(self, node):
+        setup_logging()
+        _client = paramiko.SSHClient()
+        _client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            with metrics.timed(metrics.SSH_CONNECTS,
+                               metrics.SSH_CONNECT_SECONDS):
+                _client.connect(
+                    node.strip(), self.port, self.username, self.password,
+                    timeout=self.timeout, banner_timeout=self.timeout,
+                    auth_timeout=self.timeout)
+        except (ConnectionRefusedError, paramiko.AuthenticationException):
+            self._settle(node)  # the device answered
+            raise
+        except socket.timeout as e:
+            self._settle(node, Status.TIMEOUT, e)
+            raise
+        except paramiko.ssh_exception.NoValidConnectionsError as e:
+            if all(isinstance(error, ConnectionRefusedError)
+                   for error in e.errors.values()):
+                self._settle(node)
+            else:
+                self._settle(node, Status.ERROR, e)
+            raise
+        except (OSError, paramiko.SSHException) as e:
+            self._settle(node, Status.ERROR, e)
+            raise
+        self._settle(node)
+        # Pooled transports carry small packets (exec requests, keepalives)
+        # that would otherwise wait on Nagle and delayed ACKs.
+        try:
+            _client.get_transport().sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError):  # not a TCP socket
+            pass
+        return _client
+
+    def _settle(self, node, status=None, error=None):
+        if self.breakers is None:
+            return
+        if status is None:
+            self.breakers.success(node)
+        else:
+            self.breakers.failure(node, status, str(error) or repr(error))
+
+    def release_client(self, discard=False):
+        """Returns self.client to self.pool, or closes it when no pool is
+        in use.
+
+        :param discard: bool, close a pooled client instead of returning it;
+        use after an error that may have left the session in an unknown
+        state.
+
+        Example:
+            self.release_client()
+        """
+        if self.client is None:
+            return
+        if self.pool is not None and discard:
+            self.pool.discard(self._key, self.client)
+        elif self.pool is not None:
+            self.pool.release(self._key, self.client)
+        else:
+            self.client.close()
+        self.client = None
+
+    @metrics.in_flight(metrics.SSH_IN_FLIGHT, 'get_scp')
     def get_scp(self, node, source, destination_path):
         """Calls get_client with a given device (IP or hostname) to form an SSH
         self.client object.
@@ -97,18 +264,25 @@ class SSH:
             scp_test.get_scp(device, source)
         """
         self.get_client(node)
-        with SCPClient(self.client.get_transport()) as scp:
-            scp.get(source, destination_path)
-        self.client.close()
+        try:
+            with self._measure('get_scp'), \
+                    scp.SCPClient(self.client.get_transport()) as _scp:
+                _scp.get(source, destination_path)
+        except BaseException:
+            self.release_client(discard=True)
+            raise
+        self.release_client()
 
+    @metrics.in_flight(metrics.SSH_IN_FLIGHT, 'commander')
     def commander(self, device, commands):
         """Calls get_client with a given device (IP or hostname) to form an SSH
         self.client object attribute. It then uses this object to issue an
         self.client.exec_command(command) method using a given command.
 
-        Updates self.output_dict object attribute with a key/value pair where
-        date/time and command are combined as a string for the key, and the
-        output of self.client.exec_command(command) is used as value.
+        Replaces self.output_dict object attribute with a dict of key/value
+        pairs where date/time and command are combined as a string for the
+        key, and the output of self.client.exec_command(command) is used as
+        value. Use streamer() for outputs too large to hold in memory.
 
         :param device: str, IP address or hostname for the target node.
         :param commands: list, list of commands executed against node.
@@ -123,16 +297,284 @@ class SSH:
             test = SSH(username, password)
             print(test.commander(device, commands))
         """
+        self.output_dict = dict()
+        self.get_client(device)
+        if self.client is not None:
+            try:
+                for command in commands:
+                    self._throttle()
+                    with self._measure('commander'):
+                        stdin, stdout, stderr = self.client.exec_command(
+                            command, timeout=self.timeout)
+                        command_output = stdout.read().decode("utf-8")
+                    key = 'DATE/TIME: {} CLI: {}'.format(datetime.now(),
+                                                         command)
+                    self.output_dict[key] = command_output
+            except BaseException:
+                self.release_client(discard=True)
+                raise
+            self.release_client()  # Moved to the right
+            return self.output_dict  # Moved to the right
+
+    @metrics.in_flight(metrics.SSH_IN_FLIGHT, 'pipeliner')
+    def pipeliner(self, device, commands, window=4):
+        """Same contract as commander(), but keeps up to window exec
+        channels open at once on a single transport so the device works on the
+        next command while the previous output is still being read. Outputs
+        are collected in command order.
+
+        :param device: str, IP address or hostname for the target node.
+        :param commands: list, list of commands executed against node.
+        :param window: integer, maximum number of channels open at once.
+        :return: self.output_dict keyed as in commander().
+
+        Example:
+            test = SSH(username, password)
+            print(test.pipeliner(device, commands, window=8))
+        """
+        self.output_dict = dict()
         self.get_client(device)
         if self.client is not None:
+            _transport = self.client.get_transport()
+            _pending = deque()
+            _commands = iter(commands)
+            try:
+                while True:
+                    while len(_pending) < window:
+                        command = next(_commands, None)
+                        if command is None:
+                            break
+                        self._throttle()
+                        _started = time.perf_counter()
+                        _channel = _transport.open_session(
+                            timeout=self.timeout)
+                        _channel.settimeout(self.timeout)
+                        _channel.exec_command(command)
+                        _pending.append((command, _channel, _started))
+                    if not _pending:
+                        break
+                    command, _channel, _started = _pending.popleft()
+                    try:
+                        command_output = _channel.makefile('rb').read()\
+                            .decode('utf-8')
+                    except BaseException:
+                        metrics.SSH_COMMANDS.inc('pipeliner', 'error')
+                        raise
+                    metrics.SSH_COMMANDS.inc('pipeliner', 'ok')
+                    metrics.SSH_COMMAND_SECONDS.observe(
+                        'pipeliner', value=time.perf_counter() - _started)
+                    _channel.close()
+                    key = 'DATE/TIME: {} CLI: {}'.format(
+                        datetime.now(), command)
+                    self.output_dict[key] = command_output
+            except BaseException:
+                self.release_client(discard=True)
+                raise
+            self.release_client()
+            return self.output_dict
+
+    @metrics.in_flight(metrics.SSH_IN_FLIGHT, 'shell_commander')
+    def shell_commander(self, device, commands, prompt=None, quiet=0.5):
+        """Same contract as commander(), but sends every command through one
+        interactive shell session. Useful on network gear that only allows a
+        single session or drops exec channels. Output for each command is
+        everything the device prints until the prompt comes back.
+
+        :param device: str, IP address or hostname for the target node.
+        :param commands: list, list of commands executed against node.
+        :param prompt: string, regular expression matching the device prompt.
+        When None, the prompt is learned from the last line of the login
+        banner.
+        :param quiet: float, seconds without new data that mark the end of
+        the login banner while learning the prompt.
+        :return: self.output_dict keyed as in commander().
+
+        Example:
+            test = SSH(username, password)
+            print(test.shell_commander(device, ['terminal length 0', 'show
+            version'], prompt=r'\S+[>#]\s*$'))
+        """
+        self.output_dict = dict()
+        self.get_client(device)
+        if self.client is not None:
+            try:
+                _shell = self.client.invoke_shell(width=512)
+                if prompt is None:
+                    _banner = self._read_until_quiet(_shell, quiet)
+                    _last = _banner.rstrip('\r\n').splitlines()[-1:] or ['']
+                    prompt = re.escape(_last[0].strip()) + r'\s*$'
+                else:
+                    self._read_until_prompt(_shell, re.compile(prompt))
+                _prompt = re.compile(prompt)
+                for command in commands:
+                    self._throttle()
+                    with self._measure('shell_commander'):
+                        _shell.send(command + '\n')
+                        _raw = self._read_until_prompt(_shell, _prompt)
+                    # Drop the echoed command and the trailing prompt.
+                    _lines = _raw.splitlines(True)[1:]
+                    if _lines and _prompt.search(_lines[-1]):
+                        _lines = _lines[:-1]
+                    key = 'DATE/TIME: {} CLI: {}'.format(
+                        datetime.now(), command)
+                    self.output_dict[key] = ''.join(_lines)
+            except BaseException:
+                self.release_client(discard=True)
+                raise
+            self.release_client()
+            return self.output_dict
+
+    @metrics.in_flight(metrics.SSH_IN_FLIGHT, 'streamer')
+    def streamer(self, device, commands, sink, chunk_size=32768):
+        """Runs each command and hands its output to sink chunk by chunk as
+        it arrives on the channel, so memory is bounded by chunk_size rather
+        than by the size of the output. stderr is delivered the same way and
+        the exit status of every command is returned.
+
+        :param device: str, IP address or hostname for the target node.
+        :param commands: list, list of commands executed against node.
+        :param sink: callable, sink(key, stream, chunk) where key is the
+        commander() style key, stream is 'stdout' or 'stderr' and chunk is
+        bytes. See sink_to() for file/hash adapters.
+        :param chunk_size: integer, maximum bytes per chunk.
+        :return: dict, key -> exit status (-1 if the device sent none), or
+        None if the connection failed.
+
+        Example:
+            with open('show_tech.txt', 'wb') as output:
+                test.streamer(device, ['show tech'], sink_to(output))
+        """
+        self.get_client(device)
+        if self.client is None:
+            return None
+        _status = dict()
+        try:
             for command in commands:
-                stdin, stdout, stderr = self.client.exec_command(command)
-                command_output = stdout.read().decode("utf-8")
+                self._throttle()
                 key = 'DATE/TIME: {} CLI: {}'.format(datetime.now(), command)
-                self.output_dict[key] = command_output
-                time.sleep(2)
-            self.client.close()  # Moved to the right
-            return self.output_dict  # Moved to the right
+                with self._measure('streamer'):
+                    for stream, chunk in self.exec_stream(command,
+                                                          chunk_size):
+                        sink(key, stream, chunk)
+                _status[key] = self.exit_status
+        except BaseException:
+            self.release_client(discard=True)
+            raise
+        self.release_client()
+        return _status
+
+    def exec_stream(self, command, chunk_size=32768):
+        """Runs command on the open self.client and yields (stream, chunk)
+        tuples as data arrives; stream is 'stdout' or 'stderr'. When the
+        generator is exhausted self.exit_status holds the command's exit
+        status.
+
+        :param command: string, command to execute.
+        :param chunk_size: integer, maximum bytes per chunk.
+        :return: generator of (string, bytes) tuples.
+
+        Example:
+            self.get_client(device)
+            for stream, chunk in self.exec_stream('show tech'):
+                parser.feed(chunk)
+        """
+        self.exit_status = None
+        _channel = self.client.get_transport().open_session(
+            timeout=self.timeout)
+        try:
+            _channel.exec_command(command)
+            _idle_since = time.monotonic()
+            while True:
+                _got = False
+                if _channel.recv_ready():
+                    yield 'stdout', _channel.recv(chunk_size)
+                    _got = True
+                if _channel.recv_stderr_ready():
+                    yield 'stderr', _channel.recv_stderr(chunk_size)
+                    _got = True
+                if _got:
+                    _idle_since = time.monotonic()
+                    continue
+                if _channel.exit_status_ready() or _channel.closed:
+                    if not (_channel.recv_ready() or
+                            _channel.recv_stderr_ready()):
+                        break
+                    continue
+                if self.timeout is not None and \
+                        time.monotonic() - _idle_since > self.timeout:
+                    raise TimeoutError('No output from {!r} within {}s.'
+                                       .format(command, self.timeout))
+                # The channel's fileno only signals stdout data, so poll in
+                # short steps to notice stderr and the exit status too.
+                select.select([_channel], [], [], 0.05)
+            self.exit_status = _channel.recv_exit_status() \
+                if _channel.exit_status_ready() else -1
+        finally:
+            _channel.close()
+
+    @staticmethod
+    def _measure(method):
+        return metrics.timed(metrics.SSH_COMMANDS,
+                             metrics.SSH_COMMAND_SECONDS, method)
+
+    def _throttle(self):
+        if self.rate_limit is not None:
+            self.rate_limit.acquire()
+
+    def _read_until_prompt(self, shell, prompt):
+        _buffer = ''
+        _deadline = None if self.timeout is None \
+            else time.monotonic() + self.timeout
+        shell.settimeout(self.timeout)
+        while not prompt.search(_buffer):
+            if _deadline is not None and time.monotonic() > _deadline:
+                raise TimeoutError('Prompt not seen within {}s.'.format(
+                    self.timeout))
+            _chunk = shell.recv(65535)
+            if not _chunk:
+                break
+            _buffer += _chunk.decode('utf-8', 'replace')
+        return _buffer
+
+    @staticmethod
+    def _read_until_quiet(shell, quiet):
+        _buffer = ''
+        shell.settimeout(quiet)
+        while True:
+            try:
+                _chunk = shell.recv(65535)
+            except OSError:  # socket.timeout: device went quiet
+                break
+            if not _chunk:
+                break
+            _buffer += _chunk.decode('utf-8', 'replace')
+        return _buffer
+
+
+def sink_to(stdout, stderr=None):
+    """Adapts objects with a write() or update() method, such as files,
+    hashlib objects or incremental parsers, into a streamer() sink.
+
+    :param stdout: object receiving stdout chunks.
+    :param stderr: object receiving stderr chunks; dropped when None.
+    :return: callable, sink(key, stream, chunk).
+
+    Example:
+        digest = hashlib.sha256()
+        test.streamer(device, ['show running-config'], sink_to(digest))
+    """
+    def _write(target, chunk):
+        if hasattr(target, 'write'):
+            target.write(chunk)
+        else:
+            target.update(chunk)
+
+    def sink(key, stream, chunk):
+        if stream == 'stdout':
+            _write(stdout, chunk)
+        elif stderr is not None:
+            _write(stderr, chunk)
+    return sink
 
 
 def main():
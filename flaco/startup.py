@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Startup profiling and cold-start guard for the flaco entry points. Each
+module is imported in fresh interpreters: once under -X importtime, to list
+what it loads and which imports cost the most, and several more times to
+time the cold start against a bare interpreter. Entry points must not load the
+heavy modules listed in ENTRY_POINTS at import time, and import time is
+compared with a stored baseline.
+
+    python startup.py                              # profile every entry point
+    python startup.py gohan toolkit --top 15
+    python startup.py --baseline startup.json --save-baseline
+    python startup.py --baseline startup.json      # exits 1 on regression
+
+>>> from startup import profile
+>>> imports = profile('toolkit')
+>>> 'dns.resolver' in imports
+False
+>>> sorted(imports.values(), key=lambda i: -i['cumulative'])[0]['name']
+'toolkit'
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+# Entry point -> modules it must not import at load time; each is deferred
+# to the code paths that use it.
+ENTRY_POINTS = {
+    'toolkit': ('dns', 'paramiko', 'urllib.request', 'http.server',
+                'subprocess'),
+    'element': ('dns', 'paramiko', 'urllib.request', 'http.server'),
+    'gohan': ('dns', 'paramiko', 'urllib.request', 'http.server',
+              'http.client'),
+    'ssh': ('paramiko', 'scp', 'http.server'),
+    'goten': ('paramiko', 'scp', 'dns', 'multiprocessing', 'sqlite3',
+              'http.server'),
+    'aiotoolkit': ('dns', 'paramiko', 'http.server'),
+    'app': ('paramiko', 'http.server'),
+    'inventory': ('paramiko', 'http.server'),
+    'daemon': ('paramiko', 'http.server'),
+}
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+
+def _python(code, *options):
+    return subprocess.run([sys.executable] + list(options) + ['-c', code],
+                          cwd=_DIRECTORY, capture_output=True, text=True,
+                          check=True)
+
+
+def profile(module):
+    """Imports module in a fresh interpreter under -X importtime.
+
+    :param module: string, module name.
+    :return: dict, imported module name -> {'name', 'self', 'cumulative'
+    (microseconds), 'depth'}; modules already loaded by the interpreter
+    itself are not listed.
+    """
+    _imports = {}
+    for line in _python('import {}'.format(module), '-X',
+                        'importtime').stderr.splitlines():
+        _match = _LINE.match(line)
+        if _match:
+            _self, _cumulative, _indent, _name = _match.groups()
+            _imports[_name] = {'name': _name, 'self': int(_self),
+                               'cumulative': int(_cumulative),
+                               'depth': len(_indent) // 2}
+    return _imports
+
+
+def heaviest(imports, top=10):
+    """:return: list of the top imports by cumulative time, excluding the
+    profiled module itself (depth 0).
+    """
+    _nested = [entry for entry in imports.values() if entry['depth'] > 0]
+    return sorted(_nested, key=lambda entry: -entry['cumulative'])[:top]
+
+
+def violations(module, imports):
+    """:return: list of the modules in ENTRY_POINTS[module] that imports
+    contains, including their submodules.
+    """
+    return sorted(name for name in ENTRY_POINTS.get(module, ())
+                  if any(loaded == name or loaded.startswith(name + '.')
+                         for loaded in imports))
+
+
+def cold_start(module, runs=10):
+    """Times 'python -c "import module"' against 'python -c pass', from
+    process start to exit.
+
+    :return: dict, 'bare' and 'total' median wall times and 'import' (their
+    difference), in milliseconds.
+    """
+    _bare = []
+    _total = []
+    for _ in range(runs):
+        for samples, code in ((_bare, 'pass'),
+                              (_total, 'import {}'.format(module))):
+            _start = time.perf_counter()
+            _python(code)
+            samples.append(time.perf_counter() - _start)
+    _bare_ms = _median(_bare) * 1000
+    _total_ms = _median(_total) * 1000
+    return {'bare': round(_bare_ms, 3), 'total': round(_total_ms, 3),
+            'import': round(max(0.0, _total_ms - _bare_ms), 3)}
+
+
+def _median(samples):
+    _ordered = sorted(samples)
+    _middle = len(_ordered) // 2
+    if len(_ordered) % 2:
+        return _ordered[_middle]
+    return (_ordered[_middle - 1] + _ordered[_middle]) / 2
+
+
+def run(modules=None, runs=10, top=10, report=None):
+    """Profiles and times every entry point.
+
+    :param report: callable, called with (module, entry) after each one.
+    :return: dict, the JSON document: {'meta': {...}, 'results': {module:
+    {'import': ms, 'modules': count, 'violations': [...], 'heaviest':
+    [...]}}}.
+    """
+    _document = {'meta': {'python': platform.python_version(),
+                          'implementation': platform.python_implementation(),
+                          'platform': platform.platform(), 'runs': runs},
+                 'results': {}}
+    for module in modules or ENTRY_POINTS:
+        _imports = profile(module)
+        _entry = dict(cold_start(module, runs),
+                      modules=len(_imports),
+                      violations=violations(module, _imports),
+                      heaviest=[[entry['name'],
+                                 round(entry['cumulative'] / 1000, 3)]
+                                for entry in heaviest(_imports, top)])
+        _document['results'][module] = _entry
+        if report is not None:
+            report(module, _entry)
+    return _document
+
+
+def compare(document, baseline, tolerance=0.25, slack=5.0):
+    """Finds import time regressions and forbidden imports.
+
+    :param tolerance: float, allowed relative growth of the import time.
+    :param slack: float, milliseconds allowed on top of the tolerance.
+    :return: list of strings, one per problem.
+    """
+    _problems = []
+    for module, entry in document['results'].items():
+        if entry['violations']:
+            _problems.append('{}: imports {} at load time'.format(
+                module, ', '.join(entry['violations'])))
+        _base = baseline.get('results', {}).get(module)
+        if _base is not None and \
+                entry['import'] > _base['import'] * (1 + tolerance) + slack:
+            _problems.append('{}: import {}ms -> {}ms'.format(
+                module, _base['import'], entry['import']))
+    return _problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Profile and guard the import time of flaco entry '
+                    'points.')
+    parser.add_argument('modules', nargs='*',
+                        help='modules to check (default: every entry point)')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='fresh interpreters timed per module')
+    parser.add_argument('--top', type=int, default=5,
+                        help='heaviest imports listed per module')
+    parser.add_argument('--output', help='JSON results file')
+    parser.add_argument('--baseline', help='baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the results to --baseline as well')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative regression (default 0.25)')
+    parser.add_argument('--slack', type=float, default=5.0,
+                        help='import time slack in ms on top of the '
+                             'tolerance')
+    args = parser.parse_args(argv)
+
+    def report(module, entry):
+        print('{:<10} import {:>8.1f}ms  (interpreter {:.1f}ms)  {} modules'
+              '{}'.format(module, entry['import'], entry['bare'],
+                          entry['modules'],
+                          '  LOADS ' + ', '.join(entry['violations'])
+                          if entry['violations'] else ''))
+        for name, milliseconds in entry['heaviest']:
+            print('    {:<36} {:>8.1f}ms'.format(name, milliseconds))
+
+    _document = run(args.modules, args.runs, args.top, report)
+    if args.output:
+        with open(args.output, 'w') as target:
+            json.dump(_document, target, indent=2)
+    _baseline = {}
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as target:
+            json.dump(_document, target, indent=2)
+        print('Baseline saved to {}'.format(args.baseline))
+    elif args.baseline:
+        with open(args.baseline, 'r') as source:
+            _baseline = json.load(source)
+    _problems = compare(_document, _baseline, args.tolerance, args.slack)
+    for problem in _problems:
+        print('REGRESSION {}'.format(problem))
+    return 1 if _problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
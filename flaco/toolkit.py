@@ -20,19 +20,32 @@ open
 
 """
 
-import dns.resolver
 import socket
-import subprocess
-import urllib.request
+import time
+import urllib.parse
+
+from breaker import guarded
+from dnscache import DNSCache
+from icmp import Pinger
+from metrics import instrumented
+from result import CheckResult, Status
 
 
 class Toolkit:
     """Container class for the following network related methods: check_dns(),
     check_host(), check_socket(), and check_url().
 
+    DNS answers are cached in the class attribute dns_cache, which is shared
+    by every instance. Setting the class attribute breakers to a
+    breaker.BreakerBoard makes host, socket and URL checks fail fast on
+    hosts that keep failing.
+
     Example:
         element = Toolkit(node)
     """
+    dns_cache = DNSCache()
+    breakers = None
+
     def __init__(self, node=None):
         """Initializes instance variable node.
 
@@ -42,61 +55,116 @@ class Toolkit:
         """
         self.node = node
 
-    def check_dns(self, nservers, qtype):
+    def check_dns(self, nservers, qtype, fresh=False):
         """Process name resolution (DNS) queries on instance variable node
         using a name server from a given list of name servers (nservers), and a
         query type (qtype). Returns DNS data otherwise an exception.
 
+        Answers are served from Toolkit.dns_cache until their TTL expires;
+        NXDOMAIN and NoAnswer results are cached for dns_cache.negative_ttl.
+
         Example:
             element = Toolkit(node)
             print(element.check_dns([nservers], qtype))
 
         :param nservers: list of strings, DNS servers.
         :param qtype: string, one of the these query types: A, CNAME, MX, PTR.
+        :param fresh: bool, bypass the cache and force a new lookup. The
+        result still refreshes the cache.
         :return: string, name resolution data otherwise an exception.
         """
+        return self.probe_dns(nservers, qtype, fresh).detail
+
+    @instrumented('dns')
+    def probe_dns(self, nservers, qtype, fresh=False, timeout=None):
+        """Same check as check_dns() returning a result.CheckResult whose
+        data is the list of formatted records; cached is True when the
+        answer came from dns_cache.
+
+        :param timeout: float, seconds allowed for the lookup over all
+        nameservers; None uses the resolver lifetime.
+        :return: result.CheckResult object.
+        """
+        _start = time.perf_counter()
+        _params = (qtype, tuple(nservers))
+        _key = self.dns_cache.key(self.node, qtype, nservers)
+        _cached = None if fresh else self.dns_cache.get(_key)
+        _hit = _cached is not None
+        if not _hit:
+            _cached = self.resolve(nservers, qtype, _key, timeout)
+        _status, _detail, _data = _cached
+        return CheckResult('dns', self.node, _status,
+                           time.perf_counter() - _start, _detail, _params,
+                           _data, _hit)
+
+    def resolve(self, nservers, qtype, key, timeout=None):
+        """Queries the shared resolver and stores the outcome in dns_cache.
+
+        :return: tuple, (result.Status, check_dns() text, list of records).
+        """
+        import dns.resolver  # dnspython is only loaded for DNS checks
         try:
-            _data = []
-            _resolver = dns.resolver.Resolver()
-            _resolver.nameservers = nservers
-
-            if qtype == 'MX' or qtype == 'mx':
-                _answer = _resolver.query(self.node, qtype)
-                #for rdata in _answer:
-                    #_data.append('Host{} preferance {}'.format(
-                        #rdata.exchange, rdata.preference))
-                _data = ['Host {} preferance {}'.format(
-                    rdata.exchange, rdata.preference) for rdata in _answer]
-            elif qtype == 'PTR' or qtype == 'ptr':
-                _answer = _resolver.query(dns.reversename.from_address(
-                    self.node), qtype)
-                #for record in _answer:
-                    #_data.append(str(record))
-                _data = [str(record) for record in _answer]
-            else:
-                # Handles both A and CNAME records
-                _answer = _resolver.query(self.node, qtype)
-                #for address in _answer:
-                    #_data.append(str(address))
-                _data = [str(address) for address in _answer] # NEW
+            _resolver = self.dns_cache.resolver(nservers)
+            _answer = _resolver.query(self.query_name(self.node, qtype), qtype,
+                                      lifetime=timeout)
+            _data = self.format_answer(_answer, qtype)
         except dns.exception.SyntaxError:
-            return 'Error; check IP address.'
+            return Status.ERROR, 'Error; check IP address.', []
         except dns.rdatatype.UnknownRdatatype:
-            return 'Error; check query type.'
+            return Status.ERROR, 'Error; check query type.', []
         except dns.resolver.NoAnswer:
-            return 'Error; check query type.'
+            _outcome = Status.FAIL, 'Error; check query type.', []
+            self.dns_cache.put_negative(key, _outcome)
+            return _outcome
         except dns.resolver.NXDOMAIN:
-            return 'Error; check hostname.'
+            _outcome = Status.FAIL, 'Error; check hostname.', []
+            self.dns_cache.put_negative(key, _outcome)
+            return _outcome
         except dns.exception.Timeout:
-            return 'Timeout; check connection and DNS server.'
+            return Status.TIMEOUT, 'Timeout; check connection and DNS ' \
+                                   'server.', []
         else:
-            return ', '.join(_data)
+            _outcome = Status.OK, ', '.join(_data), _data
+            self.dns_cache.put(key, _outcome, _answer.rrset.ttl)
+            return _outcome
+
+    @staticmethod
+    def query_name(node, qtype):
+        """Returns the name to query for node; PTR queries use the reverse
+        name of the address.
+
+        :param node: string, name or IP address.
+        :param qtype: string, query type.
+        :return: dns.name.Name or string.
+        """
+        if qtype == 'PTR' or qtype == 'ptr':
+            import dns.reversename
+            return dns.reversename.from_address(node)
+        return node
+
+    @staticmethod
+    def format_answer(answer, qtype):
+        """Formats the records of a DNS answer the way check_dns() reports
+        them.
+
+        :param answer: dns.resolver.Answer, iterable of rdata.
+        :param qtype: string, query type.
+        :return: list of strings, one per record.
+        """
+        if qtype == 'MX' or qtype == 'mx':
+            return ['Host {} preferance {}'.format(
+                rdata.exchange, rdata.preference) for rdata in answer]
+        # Handles A, CNAME and PTR records
+        return [str(rdata) for rdata in answer]
 
     def check_host(self, count='9'):
         """Pings the instance variable node with a load of 1378 bytes a given
         number of times (9 by default) at a 200ms interval. Returns a ping
         statistics as a string otherwise an exception.
 
+        Echo requests are sent in-process by icmp.Pinger; the ping command is
+        only used when this process may not open an ICMP socket.
+
         Example:
             element = Toolkit(node)
             print(element.check_host(count))
@@ -104,19 +172,87 @@ class Toolkit:
         :param count: string, number of echo requests.
         :return: string, containing ping related information or an exception.
         """
-        _interval = '.2'  # 200ms
+        self.output = self.probe_host(count).detail
+        return self.output
+
+    @guarded('host', lambda self, count='9', *args, **kwargs:
+             (self.node, self.node, (count,)))
+    @instrumented('host')
+    def probe_host(self, count='9', timeout=1.0, interval=.2):
+        """Same check as check_host() returning a result.CheckResult whose
+        data is the icmp.PingResult (None on the ping command fallback).
+
+        :param timeout: float, seconds to wait for replies after the last
+        echo request.
+        :param interval: float, seconds between echo requests.
+        :return: result.CheckResult object.
+        """
+        _start = time.perf_counter()
+        _result = self.ping(count, timeout, interval)
+        if _result is not None:
+            return self.host_result(self.node, _result, count,
+                                    time.perf_counter() - _start)
+        import subprocess
+        _interval = str(interval)
         _size = '1350'    # bytes
         _command = 'ping -c {} -i {} -s {} {} | grep -1 loss'.format(
             count, _interval, _size, self.node)
         try:
-            self.output = subprocess.check_output(_command, shell=True)\
+            _output = subprocess.check_output(_command, shell=True)\
                 .decode('utf-8').strip()
         except subprocess.CalledProcessError as e:
-            return str(e)
+            _status, _output = Status.ERROR, str(e)
+        else:
+            if ' 0% packet loss' in _output:
+                _status = Status.OK
+            elif ' 100% packet loss' in _output:
+                _status = Status.FAIL
+            else:
+                _status = Status.DEGRADED
+        return CheckResult('host', self.node, _status,
+                           time.perf_counter() - _start, _output, (count,))
+
+    @staticmethod
+    def host_result(node, ping_result, count, latency):
+        """Builds the CheckResult for an icmp.PingResult.
+
+        :return: result.CheckResult object.
+        """
+        if ping_result.error is not None:
+            _status = Status.ERROR
+        elif ping_result.received == ping_result.transmitted:
+            _status = Status.OK
+        elif ping_result.received:
+            _status = Status.DEGRADED
         else:
-            return self.output
+            _status = Status.FAIL
+        return CheckResult('host', node, _status, latency,
+                           ping_result.summary(), (count,), ping_result)
+
+    def ping(self, count='9', timeout=1.0, interval=.2):
+        """Pings the instance variable node in-process with the same load and
+        interval as check_host(). Returns structured statistics: loss,
+        min/avg/max/mdev RTT and per-probe samples.
+
+        Example:
+            element = Toolkit(node)
+            result = element.ping(count)
+            print(result.loss, result.rtt(), result.samples)
+
+        :param count: string or integer, number of echo requests.
+        :param timeout: float, seconds to wait for replies after the last
+        request.
+        :param interval: float, seconds between requests.
+        :return: icmp.PingResult, otherwise None if ICMP sockets are not
+        permitted.
+        """
+        try:
+            return Pinger(timeout=timeout, interval=interval, size=1350).ping(
+                [self.node], count)[self.node]
+        except PermissionError:
+            return None
 
-    def check_socket(self, port, kind='TCP'):
+    def check_socket(self, port, kind='TCP', timeout=None):
         """Check the status of a given socket (self.node, port, kind) as arguments.
         Returns 'open' is the socket is open otherwise an exception.
 
@@ -126,23 +262,47 @@ class Toolkit:
 
         :param port: integer, TCP/UDP port number.
         :param kind: string, port type TCP or UDP.
+        :param timeout: float, seconds to wait for the connect; None waits for
+        the OS connect timeout.
         :return: string, open otherwise and exception.
         """
+        return self.probe_socket(port, kind, timeout).detail
+
+    @guarded('socket', lambda self, port, kind='TCP', *args, **kwargs:
+             (self.node, self.node, (kind, port)))
+    @instrumented('socket')
+    def probe_socket(self, port, kind='TCP', timeout=None):
+        """Same check as check_socket() returning a result.CheckResult.
+        A refused connection is FAIL, a connect timeout TIMEOUT.
+
+        :return: result.CheckResult object.
+        """
+        _family = socket.AF_INET6 if ':' in self.node else socket.AF_INET
         if kind == 'udp' or kind == 'UDP':
-            _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _sock = socket.socket(_family, socket.SOCK_DGRAM)
         else:
-            _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            _sock = socket.socket(_family, socket.SOCK_STREAM)
+        _sock.settimeout(timeout)
+        _start = time.perf_counter()
         try:
             _sock.connect((self.node, port))
-            _sock.close()
+        except socket.timeout as e:
+            _status, _detail = Status.TIMEOUT, str(e)
+        except ConnectionRefusedError as e:
+            _status, _detail = Status.FAIL, str(e)
         except socket.error as e:
-            return str(e)
+            _status, _detail = Status.ERROR, str(e)
         except OverflowError as e:
-            return str(e)
+            _status, _detail = Status.ERROR, str(e)
         else:
-            return 'open'
+            _status, _detail = Status.OK, 'open'
+        finally:
+            _sock.close()
+        return CheckResult('socket', self.node, _status,
+                           time.perf_counter() - _start, _detail,
+                           (kind, port))
 
-    def check_url(self, url):
+    def check_url(self, url, pool=None, timeout=None):
         """Check the status of a given URL and returns the HTTP code as a
         string. Returns the HTTP status code otherwise an exception.
 
@@ -151,16 +311,61 @@ class Toolkit:
             print(element.check_url(url))
 
         :param url: string, URL/URI to check.
+        :param pool: urlpool.HTTPPool, optional pool of persistent
+        connections.
+        :param timeout: float, seconds allowed for connect and read; None
+        uses the pool's timeout, or the socket default without a pool.
         :return: string, HTTP code otherwise and exception.
         """
+        return self.probe_url(url, pool, timeout).detail
+
+    @guarded('url', lambda self, url, *args, **kwargs:
+             (urllib.parse.urlsplit(url).hostname, url, ()))
+    @instrumented('url')
+    def probe_url(self, url, pool=None, timeout=None):
+        """Same check as check_url() returning a result.CheckResult whose
+        data is the final HTTP status code. HTTP 4xx/5xx is FAIL.
+
+        :return: result.CheckResult object.
+        """
+        if pool is not None:
+            return self.url_result(pool.check(url, timeout))
+        import urllib.request  # the pooled path above does without it
+        _start = time.perf_counter()
+        _code = None
         try:
-            _connection = urllib.request.urlopen(url)
+            _args = {} if timeout is None else {'timeout': timeout}
+            with urllib.request.urlopen(url, **_args) as _connection:
+                _code = _connection.getcode()
+                _status, _detail = Status.OK, str(_code)
+        except urllib.error.HTTPError as e:
+            _code, _status, _detail = e.code, Status.FAIL, str(e)
         except urllib.error.URLError as e:
-            return str(e)
+            _status = Status.TIMEOUT if isinstance(e.reason, socket.timeout) \
+                else Status.ERROR
+            _detail = str(e)
+        except socket.timeout as e:  # read timeout after connecting
+            _status, _detail = Status.TIMEOUT, str(e)
         except ValueError as e:
-            return str(e)
+            _status, _detail = Status.ERROR, str(e)
+        return CheckResult('url', url, _status, time.perf_counter() - _start,
+                           _detail, (), _code)
+
+    @staticmethod
+    def url_result(pooled):
+        """Builds the CheckResult for a urlpool.URLResult.
+
+        :return: result.CheckResult object.
+        """
+        if pooled.timed_out:
+            _status = Status.TIMEOUT
+        elif pooled.status is None:
+            _status = Status.ERROR
         else:
-            return str(_connection.getcode())
+            _status = Status.OK if pooled.status < 400 else Status.FAIL
+        return CheckResult('url', pooled.url, _status,
+                           pooled.timing['total'], pooled.text, (),
+                           pooled.status)
 
 
 def main():
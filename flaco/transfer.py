@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Bulk file collection from many devices. Transfers run on a worker pool over
+pooled SSH transports and use SFTP chunked reads into a '.part' file, so an
+interrupted transfer resumes where it stopped, provided the remote file has
+not changed since. Files whose size and mtime (or SHA-256) match the local
+copy are skipped.
+
+>>> from transfer import BulkTransfer
+>>> bulk = BulkTransfer('rafael', 'a_password', max_workers=32)
+>>> jobs = bulk.jobs_for(['192.168.64.1', '192.168.64.2'],
+...                      '/config/startup-config', '/backups')
+>>> for result in bulk.fetch(jobs):
+...     print(result.device, result.status, result.throughput)
+192.168.64.1 copied 4821733.2
+192.168.64.2 skipped 0.0
+
+"""
+
+import hashlib
+import json
+import os
+import shlex
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pool import ConnectionPool
+from ssh import SSH
+
+COPIED = 'copied'
+RESUMED = 'resumed'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+class TransferResult:
+    """Outcome of one file transfer.
+
+    Attributes:
+        device: string, IP address or hostname.
+        remote: string, remote path.
+        local: string, local path.
+        status: string, copied, resumed, skipped or failed.
+        transferred: integer, bytes read over the network.
+        seconds: float, wall time of the transfer.
+        error: string, reason for a failure; None otherwise.
+    """
+    __slots__ = ('device', 'remote', 'local', 'status', 'transferred',
+                 'seconds', 'error')
+
+    def __init__(self, device, remote, local):
+        self.device = device
+        self.remote = remote
+        self.local = local
+        self.status = None
+        self.transferred = 0
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def throughput(self):
+        """Bytes per second over the network."""
+        return round(self.transferred / self.seconds, 1) if self.seconds \
+            else 0.0
+
+
+class BulkTransfer:
+    """Concurrent SFTP collector.
+
+    Example:
+        bulk = BulkTransfer(username, password)
+        results = bulk.fetch([(device, remote_path, local_path), ...])
+    """
+    def __init__(self, username, password, port=22, max_workers=16,
+                 chunk_size=1 << 20, timeout=30, verify='mtime', pool=None):
+        """Initialize transfer settings.
+
+        :param username: string, username.
+        :param password: string, password.
+        :param port: integer, SSH port.
+        :param max_workers: integer, maximum transfers in flight.
+        :param chunk_size: integer, bytes per SFTP read.
+        :param timeout: float, connect, auth and read timeout.
+        :param verify: string, how unchanged files are recognized: 'size',
+        'mtime' (size and mtime) or 'hash' (size and SHA-256, computed by
+        running sha256sum on the device).
+        :param pool: pool.ConnectionPool, defaults to a private pool so files
+        from the same device share a transport.
+        """
+        self.username = username
+        self.password = password
+        self.port = port
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.verify = verify
+        self.pool = pool if pool is not None else ConnectionPool(
+            max_per_host=2)
+
+    @staticmethod
+    def jobs_for(devices, remote_path, destination_dir):
+        """Builds one job per device, storing each file as
+        destination_dir/<device>/<basename of remote_path>.
+
+        :return: list of (device, remote_path, local_path) tuples.
+        """
+        return [(device.strip(), remote_path, os.path.join(
+            destination_dir, device.strip(), os.path.basename(remote_path)))
+            for device in devices if device.strip()]
+
+    def fetch(self, jobs):
+        """Runs every job on the worker pool.
+
+        :param jobs: iterable of (device, remote_path, local_path) tuples.
+        :return: list of TransferResult objects in job order.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda job: self.fetch_one(*job), jobs))
+
+    def fetch_one(self, device, remote, local):
+        """Transfers one file, resuming a partial download if one exists.
+
+        :return: TransferResult object.
+        """
+        _result = TransferResult(device, remote, local)
+        _start = time.monotonic()
+        _ssh = SSH(self.username, self.password, self.port,
+                   timeout=self.timeout, pool=self.pool)
+        try:
+            _ssh.get_client(device)
+            if _ssh.client is None:
+                raise OSError('Unable to connect to {}.'.format(device))
+            with _ssh.client.open_sftp() as sftp:
+                sftp.get_channel().settimeout(self.timeout)
+                _remote = sftp.stat(remote)
+                if stat.S_ISDIR(_remote.st_mode):
+                    raise IsADirectoryError(remote)
+                if self._unchanged(_ssh, remote, _remote, local):
+                    _result.status = SKIPPED
+                else:
+                    self._download(sftp, remote, _remote, local, _result)
+        except (Exception, SystemExit) as e:  # SSH.get_client() calls exit()
+            _result.status = FAILED
+            _result.error = str(e) or repr(e)
+        finally:
+            _ssh.release_client()
+        _result.seconds = time.monotonic() - _start
+        return _result
+
+    def _unchanged(self, ssh, remote, remote_stat, local):
+        try:
+            _local = os.stat(local)
+        except FileNotFoundError:
+            return False
+        if _local.st_size != remote_stat.st_size:
+            return False
+        if self.verify == 'size':
+            return True
+        if self.verify == 'hash':
+            return self._remote_hash(ssh, remote) == self._local_hash(local)
+        return int(_local.st_mtime) == int(remote_stat.st_mtime)
+
+    def _download(self, sftp, remote, remote_stat, local, result):
+        _part = local + '.part'
+        _meta = _part + '.meta'
+        # A .part is only resumed if it was started from the same remote
+        # version; otherwise the result would splice two versions together.
+        _version = {'size': remote_stat.st_size,
+                    'mtime': int(remote_stat.st_mtime)}
+        os.makedirs(os.path.dirname(local) or '.', exist_ok=True)
+        try:
+            _offset = os.path.getsize(_part)
+            with open(_meta, 'r') as source:
+                if json.load(source) != _version:
+                    _offset = 0  # remote file changed; start over
+        except (OSError, ValueError):
+            _offset = 0
+        if _offset > remote_stat.st_size:
+            _offset = 0  # remote file shrank; start over
+        if not _offset:
+            with open(_meta, 'w') as target:
+                json.dump(_version, target)
+        with sftp.open(remote, 'rb') as source, \
+                open(_part, 'ab' if _offset else 'wb') as target:
+            if _offset:
+                source.seek(_offset)
+            # Queues reads from the current position up to the given size,
+            # so a resumed download only prefetches what is left.
+            source.prefetch(remote_stat.st_size)
+            while True:
+                _chunk = source.read(self.chunk_size)
+                if not _chunk:
+                    break
+                target.write(_chunk)
+                result.transferred += len(_chunk)
+        os.replace(_part, local)
+        os.remove(_meta)
+        os.utime(local, (remote_stat.st_atime, remote_stat.st_mtime))
+        result.status = RESUMED if _offset else COPIED
+
+    def _remote_hash(self, ssh, remote):
+        _stdin, _stdout, _stderr = ssh.client.exec_command(
+            'sha256sum {}'.format(shlex.quote(remote)), timeout=self.timeout)
+        return _stdout.read().decode('utf-8').split(' ', 1)[0].strip()
+
+    def _local_hash(self, local):
+        _digest = hashlib.sha256()
+        with open(local, 'rb') as source:
+            for _chunk in iter(lambda: source.read(self.chunk_size), b''):
+                _digest.update(_chunk)
+        return _digest.hexdigest()
+
+
+def main():
+    device_file = input('Enter the name of the device file > ')
+    remote_path = input('Enter the remote file path > ')
+    destination = input('Enter the local destination directory > ')
+    with open(device_file, 'r') as devices:
+        jobs = BulkTransfer.jobs_for(devices, remote_path, destination)
+    bulk = BulkTransfer('rafael', 'default_pw_ro')
+    _start = time.monotonic()
+    results = bulk.fetch(jobs)
+    for result in results:
+        print('{} {} {} {}B {:.0f}B/s {}'.format(
+            result.device, result.remote, result.status, result.transferred,
+            result.throughput, result.error or ''))
+    print('Files: {} Failed: {} Elapsed: {:.1f}s'.format(
+        len(results), sum(1 for r in results if r.status == FAILED),
+        time.monotonic() - _start))
+    bulk.pool.close_all()
+
+if __name__ == "__main__":
+    main()
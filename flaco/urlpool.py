@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+__author__ = 'rafael'
+__version__ = '1.0.0'
+
+"""
+Pooled HTTP client for URL checks. Connections are kept alive per
+(scheme, host, port), TLS sessions are resumed on new connections to the same
+host, and every request is timed by phase: DNS, connect, TLS, time to first
+byte and total.
+
+>>> from urlpool import HTTPPool
+>>> pool = HTTPPool(timeout=5, method='HEAD')
+>>> result = pool.check('https://yahoo.com')
+>>> result.text
+'200'
+>>> sorted(result.timing)
+['connect', 'dns', 'tls', 'total', 'ttfb']
+>>> [r.text for r in pool.check_many(['https://yahoo.com', 'http://yahoo.com'])]
+['200', '200']
+
+"""
+
+import http.client
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+_REDIRECTS = (301, 302, 303, 307, 308)
+_STALE = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+          BrokenPipeError, ConnectionResetError)
+# Largest body read to keep a connection when the server ignored Range;
+# beyond it reconnecting is cheaper than downloading the body.
+_DRAIN_LIMIT = 64 * 1024
+
+
+class URLResult:
+    """Outcome of one URL check.
+
+    Attributes:
+        url: string, URL as requested.
+        status: integer, final HTTP status code; None on connection errors.
+        text: string, same value Toolkit.check_url() returns.
+        timing: dict, seconds spent in dns, connect, tls, ttfb and total,
+        summed over redirects. Reused connections report 0 for dns, connect
+        and tls.
+        reused: bool, True if the final request ran on a pooled connection.
+        timed_out: bool, True if the request failed on a timeout.
+    """
+    __slots__ = ('url', 'status', 'text', 'timing', 'reused', 'timed_out')
+
+    def __init__(self, url):
+        self.url = url
+        self.status = None
+        self.text = None
+        self.timing = dict.fromkeys(('dns', 'connect', 'tls', 'ttfb'), 0.0)
+        self.timing['total'] = 0.0
+        self.reused = False
+        self.timed_out = False
+
+
+class HTTPPool:
+    """Thread-safe pool of persistent http.client connections.
+
+    Example:
+        pool = HTTPPool(timeout=5)
+        print(pool.check(url).text)
+    """
+    def __init__(self, timeout=10, method='HEAD', max_per_host=4,
+                 max_redirects=5, context=None):
+        """Initialize the pool.
+
+        :param timeout: float, seconds allowed for each of connect, TLS
+        handshake and read.
+        :param method: string, 'HEAD' or 'GET'. GET asks for the first byte
+        only (Range: bytes=0-0) so large bodies are not downloaded; when the
+        server ignores the range and the body is large or of unknown length,
+        the connection is closed instead of drained.
+        :param max_per_host: integer, idle connections kept per host.
+        :param max_redirects: integer, redirects followed, as urlopen does.
+        :param context: ssl.SSLContext, defaults to
+        ssl.create_default_context().
+        """
+        self.timeout = timeout
+        self.method = method.upper()
+        self.max_per_host = max_per_host
+        self.max_redirects = max_redirects
+        self.context = context or ssl.create_default_context()
+        self._idle = defaultdict(list)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def check(self, url, timeout=None):
+        """Requests url, following redirects, and times each phase.
+
+        :param url: string, URL/URI to check.
+        :param timeout: float, overrides self.timeout for this request.
+        :return: URLResult object.
+        """
+        _result = URLResult(url)
+        _timeout = self.timeout if timeout is None else timeout
+        _start = time.perf_counter()
+        try:
+            for _ in range(self.max_redirects + 1):
+                _response = self._request(url, _result, _timeout)
+                if _response.status not in _REDIRECTS:
+                    break
+                _location = _response.getheader('Location')
+                if not _location:
+                    break
+                url = urllib.parse.urljoin(url, _location)
+            _result.status = _response.status
+            if _response.status < 400:
+                _result.text = str(_response.status)
+            else:
+                _result.text = 'HTTP Error {}: {}'.format(
+                    _response.status, _response.reason)
+        except ValueError as e:
+            _result.text = str(e)
+        except (OSError, http.client.HTTPException) as e:
+            _result.text = '<urlopen error {}>'.format(e)
+            _result.timed_out = isinstance(e, socket.timeout)
+        _result.timing['total'] = time.perf_counter() - _start
+        return _result
+
+    def check_many(self, urls, max_workers=32):
+        """Checks many URLs concurrently over the pool.
+
+        :param urls: iterable of strings.
+        :param max_workers: integer, maximum requests in flight.
+        :return: list of URLResult objects in url order.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.check, urls))
+
+    def close(self):
+        """Closes every idle connection."""
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+    def _request(self, url, result, timeout):
+        _parts = urllib.parse.urlsplit(url)
+        if _parts.scheme not in ('http', 'https') or not _parts.hostname:
+            raise ValueError('unknown url type: {!r}'.format(url))
+        _https = _parts.scheme == 'https'
+        _key = (_parts.scheme, _parts.hostname,
+                _parts.port or (443 if _https else 80))
+        _path = urllib.parse.urlunsplit(('', '', _parts.path or '/',
+                                         _parts.query, ''))
+        _headers = {'Host': _parts.netloc, 'User-Agent': 'flaco',
+                    'Accept-Encoding': 'identity'}
+        if self.method == 'GET':
+            _headers['Range'] = 'bytes=0-0'
+
+        _connection = self._checkout(_key)
+        result.reused = _connection is not None
+        if _connection is not None:
+            _connection.sock.settimeout(timeout)
+            try:
+                return self._exchange(_key, _connection, _path, _headers,
+                                      result)
+            except _STALE:
+                _connection.close()  # server closed the idle connection
+                result.reused = False
+        _connection = self._connect(_key, result, timeout)
+        return self._exchange(_key, _connection, _path, _headers, result)
+
+    def _exchange(self, key, connection, path, headers, result):
+        _start = time.perf_counter()
+        try:
+            connection.request(self.method, path, headers=headers)
+            _response = connection.getresponse()
+            result.timing['ttfb'] += time.perf_counter() - _start
+            if self.method == 'GET' and _response.status != 206 and (
+                    _response.length is None or
+                    _response.length > _DRAIN_LIMIT):
+                connection.close()  # Range ignored; don't fetch the body
+                return _response
+            _response.read()  # drain so the connection can be reused
+        except BaseException:
+            connection.close()
+            raise
+        if _response.will_close:
+            connection.close()
+        else:
+            self._checkin(key, connection)
+        return _response
+
+    def _connect(self, key, result, timeout):
+        _scheme, _host, _port = key
+        _start = time.perf_counter()
+        _family, _type, _proto, _, _address = socket.getaddrinfo(
+            _host, _port, type=socket.SOCK_STREAM)[0]
+        _dns = time.perf_counter()
+        _sock = socket.socket(_family, _type, _proto)
+        try:
+            _sock.settimeout(timeout)
+            _sock.connect(_address)
+            _connected = time.perf_counter()
+            if _scheme == 'https':
+                _sock = self.context.wrap_socket(
+                    _sock, server_hostname=_host,
+                    session=self._sessions.get(key))
+            _secured = time.perf_counter()
+        except BaseException:
+            _sock.close()
+            raise
+        result.timing['dns'] += _dns - _start
+        result.timing['connect'] += _connected - _dns
+        result.timing['tls'] += _secured - _connected
+        if _scheme == 'https':
+            _connection = http.client.HTTPSConnection(
+                _host, _port, timeout=timeout, context=self.context)
+        else:
+            _connection = http.client.HTTPConnection(
+                _host, _port, timeout=timeout)
+        _connection.sock = _sock
+        return _connection
+
+    def _checkout(self, key):
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop()
+        return None
+
+    def _checkin(self, key, connection):
+        if isinstance(connection.sock, ssl.SSLSocket):
+            # TLS 1.3 tickets arrive after the handshake, so save the session
+            # once a response has been read.
+            self._sessions[key] = connection.sock.session
+        with self._lock:
+            if len(self._idle[key]) < self.max_per_host:
+                self._idle[key].append(connection)
+                return
+        connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    with HTTPPool(timeout=5) as pool:
+        for result in pool.check_many(
+                ['https://yahoo.com', 'http://yahoo.com', 'https://yahoo.com']):
+            print('{} {} reused={} {}'.format(
+                result.url, result.text, result.reused,
+                ' '.join('{}={:.1f}ms'.format(k, v * 1000)
+                         for k, v in result.timing.items())))
+
+if __name__ == "__main__":
+    main()
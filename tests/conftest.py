@@ -0,0 +1,9 @@
+__author__ = 'rafael'
+
+# flaco modules import each other by module name (from toolkit import
+# Toolkit), so the tests run with the flaco directory on the path.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'flaco'))
@@ -0,0 +1,145 @@
+__author__ = 'rafael'
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from breaker import (CLOSED, HALF_OPEN, OPEN, BreakerBoard, CircuitOpen,
+                     guarded)
+from loopback import FilteredPort, TCPListener
+from result import CheckResult, Status
+from toolkit import Toolkit
+
+
+class BreakerBoardTest(unittest.TestCase):
+    def setUp(self):
+        self.board = BreakerBoard(threshold=2, base=30, maximum=100)
+        self.clock = mock.patch('time.time', return_value=1000.0)
+        self.now = self.clock.start()
+        self.addCleanup(self.clock.stop)
+
+    def fail(self, host='R1.example.', status=Status.TIMEOUT):
+        self.board.failure(host, status, 'timed out')
+
+    def test_opens_at_threshold(self):
+        self.fail()
+        self.assertEqual(self.board.state('r1.example'), CLOSED)
+        self.board.allow('r1.example')
+        self.fail()
+        self.assertEqual(self.board.state('r1.example'), OPEN)
+        with self.assertRaises(CircuitOpen) as raised:
+            self.board.allow('r1.example')
+        self.assertEqual(raised.exception.status, Status.TIMEOUT)
+        self.assertEqual(str(raised.exception),
+                         'Circuit open for r1.example (retry in 30s): '
+                         'timed out')
+
+    def test_single_half_open_attempt(self):
+        self.fail()
+        self.fail()
+        self.now.return_value = 1030.0
+        self.assertEqual(self.board.state('r1.example'), HALF_OPEN)
+        self.board.allow('r1.example')
+        with self.assertRaises(CircuitOpen):
+            self.board.allow('r1.example')
+
+    def test_backoff_doubles_up_to_maximum(self):
+        self.assertEqual([self.board.interval(trips)
+                          for trips in range(1, 6)], [30, 60, 100, 100, 100])
+        self.fail()
+        self.fail()
+        self.now.return_value = 1030.0
+        self.board.allow('r1.example')
+        self.fail()
+        self.assertEqual(self.board.snapshot()['r1.example']['retry_at'],
+                         1090.0)
+
+    def test_success_closes(self):
+        self.fail()
+        self.fail()
+        self.board.success('r1.example')
+        self.assertEqual(self.board.state('r1.example'), CLOSED)
+        self.assertEqual(self.board.snapshot(), {})
+
+    def test_record_uses_down_statuses(self):
+        for _ in range(2):
+            self.board.record('r1', CheckResult('socket', 'r1', Status.FAIL,
+                                                0.0, 'refused'))
+        self.assertEqual(self.board.state('r1'), CLOSED)
+        for _ in range(2):
+            self.board.record('r1', CheckResult('host', 'r1', Status.FAIL,
+                                                0.0, '100% packet loss'))
+        self.assertEqual(self.board.state('r1'), OPEN)
+
+    def test_record_many(self):
+        _down = CheckResult('socket', 'r1', Status.TIMEOUT, 1.0, 'timed out')
+        _up = CheckResult('socket', 'r1', Status.OK, 0.0, 'open')
+        self.board.record_many('r1', [_down, _down])
+        self.assertEqual(self.board.snapshot()['r1']['failures'], 1)
+        self.board.record_many('r1', [_down, _up])
+        self.assertEqual(self.board.snapshot(), {})
+
+    def test_rejected(self):
+        self.assertIsNone(self.board.rejected('r1', 'socket', 'r1'))
+        self.fail('r1')
+        self.fail('r1')
+        _result = self.board.rejected('r1', 'socket', 'r1', ('TCP', 22))
+        self.assertEqual((_result.status, _result.params),
+                         (Status.TIMEOUT, ('TCP', 22)))
+
+    def test_update(self):
+        self.fail('r1')
+        self.board.update({'R2': {'failures': 5, 'trips': 1,
+                                  'retry_at': 2000.0, 'status': 'error',
+                                  'reason': 'x'},
+                           'r1': None})
+        self.assertEqual(list(self.board.snapshot()), ['r2'])
+        self.assertEqual(self.board.state('r2'), OPEN)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            _path = os.path.join(directory, 'breakers.json')
+            self.board.path = _path
+            self.fail('r1')
+            self.board.save()
+            with open(_path) as source:
+                self.assertEqual(json.load(source)['r1']['failures'], 1)
+            self.assertEqual(BreakerBoard(_path).snapshot(),
+                             self.board.snapshot())
+
+
+class GuardedTest(unittest.TestCase):
+    def test_probe_socket(self):
+        _board = BreakerBoard(threshold=2)
+        with FilteredPort() as filtered, TCPListener() as listener:
+            _toolkit = Toolkit('127.0.0.1')
+            _toolkit.breakers = _board
+            for _ in range(2):
+                self.assertEqual(_toolkit.probe_socket(
+                    filtered.port, 'TCP', timeout=0.05).status,
+                    Status.TIMEOUT)
+            _result = _toolkit.probe_socket(listener.port, 'TCP', timeout=1)
+            self.assertEqual(_result.latency, 0.0)
+            self.assertTrue(_result.detail.startswith('Circuit open'))
+            _board.update({'127.0.0.1': None})
+            self.assertEqual(_toolkit.probe_socket(
+                listener.port, 'TCP', timeout=1).status, Status.OK)
+
+    def test_unguarded_subject(self):
+        class Probe:
+            breakers = BreakerBoard(threshold=1)
+
+            @guarded('socket', lambda self, host: (host, host, ()))
+            def probe(self, host):
+                return CheckResult('socket', host, Status.TIMEOUT, 1.0, 't')
+
+        Probe().probe(None)
+        self.assertEqual(Probe.breakers.snapshot(), {})
+        Probe().probe('r1')
+        self.assertEqual(Probe.breakers.state('r1'), OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+__author__ = 'rafael'
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from configstore import (CHANGED, NEW, UNCHANGED, ConfigStore, StoreWriter,
+                         parse_time)
+
+_CONFIG = 'hostname r1\n! Last configuration change at 10:00\n' \
+          'interface ge-0/0/0\n description uplink\n'
+
+
+class ConfigStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.path = os.path.join(self._directory.name, 'configs')
+        self.store = ConfigStore(self.path,
+                                 ignore=[r'^! Last configuration'])
+        self.addCleanup(self.store.close)
+
+    def test_new_unchanged_changed(self):
+        _first = self.store.record('r1\n', 'show run', _CONFIG, 100)
+        self.assertEqual((_first.device, _first.kind), ('r1', NEW))
+        _same = self.store.record('r1', 'show run', _CONFIG, 200)
+        self.assertEqual(_same.kind, UNCHANGED)
+        self.assertEqual(_same.digest, _first.digest)
+        _changed = self.store.record(
+            'r1', 'show run', _CONFIG.replace('uplink', 'core'), 300)
+        self.assertEqual(_changed.kind, CHANGED)
+        self.assertEqual(_changed.previous, _first.digest)
+        self.assertEqual((_changed.added, _changed.removed), (1, 1))
+        self.assertIn('+ description core', self.store.diff(_changed))
+        self.assertIn('- description uplink', self.store.diff(_changed))
+        self.assertEqual(self.store.diff(_first), '')
+
+    def test_ignored_lines_are_kept_but_not_compared(self):
+        _first = self.store.record('r1', 'show run', _CONFIG, 100)
+        _later = _CONFIG.replace('10:00', '11:00')
+        _change = self.store.record('r1', 'show run', _later, 200)
+        self.assertEqual(_change.kind, UNCHANGED)
+        self.assertEqual(_change.fingerprint, _first.fingerprint)
+        self.assertEqual(self.store.output(_first), _CONFIG)
+
+    def test_changes_filters(self):
+        self.store.record('r1', 'show run', _CONFIG, 100)
+        self.store.record('r2', 'show run', _CONFIG, 150)
+        self.store.record('r1', 'show run', _CONFIG + 'end\n', 200)
+        self.store.record('r1', 'show ver', 'v1\n', 250)
+        self.assertEqual([(c.device, c.collected, c.kind)
+                          for c in self.store.changes(120)],
+                         [('r2', 150, NEW), ('r1', 200, CHANGED),
+                          ('r1', 250, NEW)])
+        self.assertEqual(len(self.store.changes(0, until=150)), 1)
+        self.assertEqual(len(self.store.changes(0, device='r1',
+                                                command='show run')), 2)
+        self.assertEqual(len(self.store.history('r1', 'show run')), 2)
+
+    def test_latest_tracks_seen(self):
+        self.store.record('r1', 'show run', _CONFIG, 100)
+        self.store.record('r1', 'show run', _CONFIG, 200)
+        self.assertEqual(self.store.latest('r1'), [
+            {'device': 'r1', 'command': 'show run',
+             'digest': self.store.history('r1', 'show run')[0].digest,
+             'changed': 100, 'seen': 200}])
+
+    def test_blobs_are_shared(self):
+        self.store.record('r1', 'show run', _CONFIG, 100)
+        self.store.record('r2', 'show run', _CONFIG, 100)
+        _blobs = [name for _, _, names in os.walk(
+            os.path.join(self.path, 'objects')) for name in names]
+        self.assertEqual(len(_blobs), 1)
+
+    def test_reopen(self):
+        self.store.record('r1', 'show run', _CONFIG, 100)
+        self.store.close()
+        with ConfigStore(self.path, ignore=[r'^! Last']) as store:
+            self.assertEqual(store.record('r1', 'show run', _CONFIG).kind,
+                             UNCHANGED)
+
+    def test_migrates_stores_without_fingerprints(self):
+        _path = os.path.join(self._directory.name, 'old')
+        os.makedirs(_path)
+        with sqlite3.connect(os.path.join(_path, 'index.db')) as db:
+            db.executescript(
+                'CREATE TABLE versions (id INTEGER PRIMARY KEY, device TEXT, '
+                'command TEXT, collected REAL, digest TEXT, previous TEXT, '
+                'diff TEXT, added INTEGER, removed INTEGER, size INTEGER);'
+                'CREATE TABLE latest (device TEXT, command TEXT, digest TEXT,'
+                ' changed REAL, seen REAL, PRIMARY KEY (device, command));'
+                "INSERT INTO latest VALUES ('r1', 'show run', 'abc', 1, 1);")
+        with ConfigStore(_path) as store:
+            _fingerprint = store._db.execute(
+                'SELECT fingerprint FROM latest').fetchone()[0]
+        self.assertEqual(_fingerprint, 'abc')
+
+
+class StoreWriterTest(unittest.TestCase):
+    def test_write_device(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with StoreWriter(directory) as job:
+                _changes = job.write_device('r1', {
+                    'DATE/TIME: 2024-05-01 10:00:00 CLI: show run': _CONFIG,
+                    'DATE/TIME: not a date CLI: show ver': 'v1\n'})
+                job.write_device('r2', error='Connection refused')
+            self.assertEqual([change.command for change in _changes],
+                             ['show run', 'show ver'])
+            self.assertEqual(_changes[0].collected,
+                             datetime(2024, 5, 1, 10).timestamp())
+            self.assertEqual(job.counts, {NEW: 2, CHANGED: 0, UNCHANGED: 0})
+            self.assertEqual(job.errors, {'r2': 'Connection refused'})
+            self.assertEqual(job.devices, 2)
+
+
+class ParseTimeTest(unittest.TestCase):
+    def test_epoch_and_iso(self):
+        self.assertEqual(parse_time('1700000000.5'), 1700000000.5)
+        self.assertEqual(parse_time('2024-05-01'),
+                         datetime(2024, 5, 1).timestamp())
+        with self.assertRaises(ValueError):
+            parse_time('yesterday')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+__author__ = 'rafael'
+
+import asyncio
+import unittest
+from unittest import mock
+
+from aiotoolkit import AsyncToolkit
+from dnscache import DNSCache
+from loopback import DNSServer
+from result import Status
+from toolkit import Toolkit
+
+_KEY = ('bench.flaco.test', 'A', ('127.0.0.1',))
+
+
+class DNSCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = mock.patch('time.monotonic', return_value=100.0)
+        self.now = self.clock.start()
+        self.addCleanup(self.clock.stop)
+
+    def test_key(self):
+        self.assertEqual(DNSCache.key('Bench.Flaco.Test.', 'a',
+                                      ['127.0.0.1']), _KEY)
+
+    def test_ttl_expiry(self):
+        _cache = DNSCache()
+        _cache.put(_KEY, 'value', ttl=30)
+        self.now.return_value = 129.9
+        self.assertEqual(_cache.get(_KEY), 'value')
+        self.now.return_value = 130.0
+        self.assertIsNone(_cache.get(_KEY))
+        self.assertEqual(_cache.stats(),
+                         {'entries': 0, 'hits': 1, 'misses': 1})
+
+    def test_ttl_clamped(self):
+        _cache = DNSCache(min_ttl=10, max_ttl=60)
+        _cache.put('short', 1, ttl=1)
+        _cache.put('long', 2, ttl=3600)
+        self.now.return_value = 105.0
+        self.assertEqual(_cache.get('short'), 1)
+        self.now.return_value = 161.0
+        self.assertIsNone(_cache.get('long'))
+
+    def test_zero_ttl_not_stored(self):
+        _cache = DNSCache(negative_ttl=0)
+        _cache.put('zero', 1, ttl=0)
+        _cache.put_negative('negative', 2)
+        self.assertEqual(_cache.stats()['entries'], 0)
+
+    def test_lru_eviction(self):
+        _cache = DNSCache(max_entries=2)
+        _cache.put('a', 1, 60)
+        _cache.put('b', 2, 60)
+        _cache.get('a')
+        _cache.put('c', 3, 60)
+        self.assertIsNone(_cache.get('b'))
+        self.assertEqual((_cache.get('a'), _cache.get('c')), (1, 3))
+
+    def test_invalidate(self):
+        _cache = DNSCache()
+        for key in ('a', 'b', 'c'):
+            _cache.put(key, key, 60)
+        _cache.invalidate('a')
+        self.assertIsNone(_cache.get('a'))
+        _cache.invalidate()
+        self.assertEqual(_cache.stats()['entries'], 0)
+
+    def test_shared_resolvers(self):
+        _cache = DNSCache()
+        _resolver = _cache.resolver(['127.0.0.1', '127.0.0.2'])
+        self.assertIs(_cache.resolver(('127.0.0.1', '127.0.0.2')), _resolver)
+        self.assertEqual(_resolver.nameservers, ['127.0.0.1', '127.0.0.2'])
+        self.assertIsNot(_cache.resolver(['127.0.0.2']), _resolver)
+        self.assertIs(_cache.async_resolver(['127.0.0.1']),
+                      _cache.async_resolver(['127.0.0.1']))
+
+
+class CachedLookupTest(unittest.TestCase):
+    def setUp(self):
+        self.server = DNSServer(ttl=60).start()
+        self.addCleanup(self.server.stop)
+        _cache = DNSCache(negative_ttl=60)
+        _cache.resolver(['127.0.0.1']).port = self.server.port
+        _cache.async_resolver(['127.0.0.1']).port = self.server.port
+        _patch = mock.patch.object(Toolkit, 'dns_cache', _cache)
+        _patch.start()
+        self.addCleanup(_patch.stop)
+
+    def test_answers_are_cached(self):
+        _toolkit = Toolkit('bench.flaco.test')
+        _first = _toolkit.probe_dns(['127.0.0.1'], 'A')
+        _second = _toolkit.probe_dns(['127.0.0.1'], 'A')
+        self.assertEqual((_first.status, _first.detail, _first.cached),
+                         (Status.OK, '127.0.0.1', False))
+        self.assertEqual((_second.detail, _second.cached), ('127.0.0.1', True))
+        self.assertEqual(self.server.queries, 1)
+        self.assertFalse(_toolkit.probe_dns(['127.0.0.1'], 'A',
+                                            fresh=True).cached)
+        self.assertEqual(self.server.queries, 2)
+
+    def test_negative_answers_are_cached(self):
+        _toolkit = Toolkit('missing.flaco.test')
+        for _ in range(2):
+            self.assertEqual(_toolkit.check_dns(['127.0.0.1'], 'A'),
+                             'Error; check hostname.')
+        self.assertEqual(self.server.queries, 1)
+
+    def test_async_shares_the_cache(self):
+        Toolkit('bench.flaco.test').probe_dns(['127.0.0.1'], 'MX')
+        _element = AsyncToolkit('bench.flaco.test')
+        self.assertEqual(asyncio.run(_element.check_dns(['127.0.0.1'], 'MX')),
+                         Toolkit('bench.flaco.test').check_dns(
+                             ['127.0.0.1'], 'MX'))
+        self.assertEqual(asyncio.run(_element.check_dns(['127.0.0.1'],
+                                                        'AAAA')), '::1')
+        self.assertEqual(self.server.queries, 2)
+        self.assertTrue(Toolkit('bench.flaco.test').probe_dns(
+            ['127.0.0.1'], 'AAAA').cached)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+__author__ = 'rafael'
+
+import math
+import os
+import tempfile
+import unittest
+
+from history import ResultStore, Segment, series_key
+from result import CheckResult, Status
+
+_DAY = 86400
+_T0 = 1700006400  # 2023-11-15 00:00:00 UTC, a day boundary
+
+
+def _result(status=Status.OK, latency=0.25, port=443):
+    return CheckResult('socket', 'r1', status, latency, 'open', ('TCP', port))
+
+
+class SegmentTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.path = os.path.join(self._directory.name, '0.seg')
+
+    def test_append_sorted_and_grow(self):
+        _segment = Segment(self.path, base=0, capacity=2)
+        for offset in (10, 30, 20, 5, 40):
+            _segment.append(offset, offset / 100, offset % 3)
+        self.assertEqual(_segment.capacity, 8)
+        _offsets, _latencies, _codes = _segment.select()
+        self.assertEqual(_offsets, [5, 10, 20, 30, 40])
+        self.assertEqual(_codes, [2, 1, 2, 0, 1])
+        self.assertAlmostEqual(_latencies[2], 0.2, places=6)
+        self.assertEqual(_segment.select(10, 30)[0], [10, 20])
+        _segment.close()
+        _reopened = Segment(self.path)
+        self.assertEqual((_reopened.count, _reopened.select()[0]),
+                         (5, [5, 10, 20, 30, 40]))
+        _reopened.close()
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as target:
+            target.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            Segment(self.path)
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.path = self._directory.name
+        self.store = ResultStore(self.path, raw_retention=2 * _DAY,
+                                 rollup_retention=10 * _DAY)
+        self.addCleanup(self.store.close)
+        self.key = series_key(_result())
+
+    def test_series_key(self):
+        self.assertEqual(self.key, '["socket", "r1", ["TCP", 443]]')
+
+    def test_record_and_range(self):
+        self.store.record(_result(), _T0 + 60)
+        self.store.record([_result(Status.TIMEOUT, None),
+                           _result(port=80)], _T0 + 120)
+        self.store.record(_result(latency=0.5), _T0 + _DAY + 1)
+        self.assertEqual(self.store.series(), sorted(
+            [self.key, series_key(_result(port=80))]))
+        self.assertEqual(self.store.range(self.key, _T0, _T0 + 2 * _DAY), [
+            (_T0 + 60, 0.25, Status.OK),
+            (_T0 + 120, None, Status.TIMEOUT),
+            (_T0 + _DAY + 1, 0.5, Status.OK)])
+        self.assertEqual(len(self.store.range(self.key, _T0 + 61,
+                                              _T0 + _DAY + 1)), 1)
+        self.assertEqual(self.store.range('["missing"]', 0), [])
+
+    def test_rollup_and_flaps(self):
+        for second, status, latency in ((0, Status.OK, 0.25),
+                                        (60, Status.FAIL, None),
+                                        (120, Status.OK, 0.75),
+                                        (3600, Status.OK, 0.5)):
+            self.store.record(_result(status, latency), _T0 + second)
+        self.assertEqual(self.store.rollup(self.key, _T0, _T0 + 7200), [
+            (_T0, 3, 1, 0.25, 0.5, 0.75),
+            (_T0 + 3600, 1, 0, 0.5, 0.5, 0.5)])
+        self.assertEqual(self.store.flaps(self.key, _T0, _T0 + 7200), 2)
+
+    def test_compact_rolls_up_and_expires(self):
+        self.store.record(_result(latency=0.25), _T0 + 10)
+        self.store.record(_result(Status.TIMEOUT, None), _T0 + 20)
+        self.store.record(_result(latency=0.5), _T0 + 3 * _DAY)
+        _before = self.store.rollup(self.key, _T0, _T0 + 4 * _DAY)
+        self.store.compact(now=_T0 + 3 * _DAY + 60)
+        _directory = self.store._directory(self.key)
+        self.assertEqual(sorted(os.listdir(_directory)), [
+            '{}.seg'.format((_T0 + 3 * _DAY) * 1000), 'key', 'rollup'])
+        self.assertEqual(self.store.range(self.key, _T0, _T0 + 4 * _DAY),
+                         [(_T0 + 3 * _DAY, 0.5, Status.OK)])
+        self.assertEqual(self.store.rollup(self.key, _T0, _T0 + 4 * _DAY),
+                         _before)
+        # Day 0 rollups expire; the day 3 samples are rolled up in turn.
+        self.store.compact(now=_T0 + 11 * _DAY)
+        self.assertEqual(self.store.rollup(self.key, _T0, _T0 + 4 * _DAY),
+                         [(_T0 + 3 * _DAY, 1, 0, 0.5, 0.5, 0.5)])
+        self.assertEqual(self.store.range(self.key, _T0, _T0 + 4 * _DAY),
+                         [])
+
+    def test_compact_trims_sealed_segments(self):
+        self.store.record(_result(), _T0)
+        self.store.compact(now=_T0 + _DAY)
+        _segment = self.store._segment(self.key, _T0 * 1000)
+        self.assertEqual((_segment.count, _segment.capacity), (1, 1))
+        self.store.record(_result(), _T0 + 5)
+        self.assertEqual(len(self.store.range(self.key, _T0, _T0 + 10)), 2)
+
+    def test_reopen_and_bounded_open_segments(self):
+        _store = ResultStore(self.path, max_open=2)
+        for day in range(4):
+            _store.record(_result(), _T0 + day * _DAY)
+        self.assertEqual(len(_store._open), 2)
+        _store.close()
+        with ResultStore(self.path) as store:
+            self.assertEqual(len(store.range(self.key, _T0,
+                                             _T0 + 4 * _DAY)), 4)
+
+    def test_nan_latency_rollup(self):
+        self.store.record(_result(Status.ERROR, math.nan), _T0)
+        self.assertEqual(self.store.rollup(self.key, _T0, _T0 + 60),
+                         [(_T0, 1, 1, None, None, None)])
+
+    def test_period_validation(self):
+        with self.assertRaises(ValueError):
+            ResultStore(self.path, period=50 * _DAY)
+        with self.assertRaises(ValueError):
+            ResultStore(self.path, period=_DAY, resolution=7 * 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
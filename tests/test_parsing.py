@@ -0,0 +1,147 @@
+__author__ = 'rafael'
+
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+
+from configstore import ConfigStore
+from parsing import (ParsePipeline, Template, _install, from_job,
+                     from_outputs, from_store, parse_output)
+from sink import JobWriter
+
+_TEXTFSM = importlib.util.find_spec('textfsm') is not None
+_INTERFACES = 'Value NAME (\\S+)\nValue STATUS (up|down)\n\nStart\n' \
+              '  ^${NAME}\\s+${STATUS} -> Record\n'
+_TEMPLATES = [
+    Template(r'show version', regex=r'Version (?P<version>\S+),'),
+    Template(r'show int(erfaces)? br(ief)?',
+             regex=r'^(?P<name>\S+)\s+(?P<status>up|down)$'),
+    Template(r'show broken', regex=r'(?P<a>x)(?P<a>y)'),
+]
+_OUTPUTS = {
+    'DATE/TIME: 2024-05-01 02:00:01 CLI: show version':
+        'Cisco IOS Software, Version 15.2(4)M7, RELEASE\n',
+    'DATE/TIME: 2024-05-01 02:00:02 CLI: show int brief':
+        'Gi0/0   up\nGi0/1   down\n',
+    'DATE/TIME: 2024-05-01 02:00:03 CLI: show clock': '10:00:00\n',
+}
+_RECORDS = [
+    {'device': 'r1', 'timestamp': '2024-05-01 02:00:01',
+     'command': 'show version', 'version': '15.2(4)M7'},
+    {'device': 'r1', 'timestamp': '2024-05-01 02:00:02',
+     'command': 'show int brief', 'name': 'Gi0/0', 'status': 'up'},
+    {'device': 'r1', 'timestamp': '2024-05-01 02:00:02',
+     'command': 'show int brief', 'name': 'Gi0/1', 'status': 'down'},
+]
+
+
+class TemplateTest(unittest.TestCase):
+    def test_needs_one_kind(self):
+        with self.assertRaises(ValueError):
+            Template('show version')
+        with self.assertRaises(ValueError):
+            Template('show version', regex='x', textfsm='y')
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            _path = os.path.join(directory, 'templates.json')
+            with open(_path, 'w') as target:
+                json.dump([{'command': 'show version', 'regex': 'V (?P<v>.)'},
+                           {'command': 'show ip', 'textfsm': 'ip.textfsm'},
+                           {'command': 'show arp', 'textfsm': _INTERFACES}],
+                          target)
+            _templates = Template.load(_path)
+        self.assertEqual(_templates[0].regex, 'V (?P<v>.)')
+        self.assertEqual(_templates[1].textfsm,
+                         os.path.join(directory, 'ip.textfsm'))
+        self.assertEqual(_templates[2].textfsm, _INTERFACES)
+
+
+class ParseOutputTest(unittest.TestCase):
+    def setUp(self):
+        _install(_TEMPLATES)
+        self.addCleanup(_install, [])
+
+    def test_records(self):
+        _records = []
+        for item in from_outputs('r1\n', _OUTPUTS):
+            _records.extend(parse_output(*item))
+        self.assertEqual(_records, _RECORDS)
+
+    def test_command_must_match_fully(self):
+        self.assertEqual(parse_output('r1', None, 'show version detail',
+                                      'Version 1,'), [])
+        self.assertEqual(len(parse_output('r1', None, ' show version ',
+                                          'Version 1,')), 1)
+
+    def test_template_error_becomes_record(self):
+        _records = parse_output('r1', None, 'show broken', 'xy')
+        self.assertEqual(len(_records), 1)
+        self.assertIn('redefinition of group name', _records[0]['error'])
+
+    @unittest.skipIf(_TEXTFSM, 'textfsm is installed')
+    def test_textfsm_missing(self):
+        _install([Template('show ip', textfsm=_INTERFACES)])
+        self.assertIn('textfsm package',
+                      parse_output('r1', None, 'show ip', '')[0]['error'])
+
+    @unittest.skipUnless(_TEXTFSM, 'textfsm is not installed')
+    def test_textfsm(self):
+        _install([Template('show ip', textfsm=_INTERFACES)])
+        self.assertEqual(
+            [(r['NAME'], r['STATUS']) for r in parse_output(
+                'r1', None, 'show ip', 'Gi0/0 up\nGi0/1 down\n')],
+            [('Gi0/0', 'up'), ('Gi0/1', 'down')])
+
+
+class ParsePipelineTest(unittest.TestCase):
+    def items(self, devices=1):
+        for device in range(devices):
+            yield from from_outputs('r1' if devices == 1 else
+                                    'r{}'.format(device), _OUTPUTS)
+
+    def test_in_process(self):
+        self.assertEqual(list(ParsePipeline(_TEMPLATES, workers=1).run(
+            self.items())), _RECORDS)
+
+    def test_process_pool(self):
+        _records = list(ParsePipeline(_TEMPLATES, workers=2, batch_size=4,
+                                      in_flight=1).run(self.items(50)))
+        self.assertEqual(len(_records), 150)
+        self.assertEqual(sum(r.get('version') == '15.2(4)M7'
+                             for r in _records), 50)
+
+
+class SourcesTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+
+    def job(self, name, fmt):
+        _path = os.path.join(self._directory.name, name)
+        with JobWriter(_path, fmt=fmt) as job:
+            job.write_device('r1', _OUTPUTS)
+            job.write_device('r2', error='Connection refused')
+            job.write_device('r3', {'DATE/TIME: t CLI: show clock': '1\n\n'})
+        return _path
+
+    def test_from_job(self):
+        _expected = list(from_outputs('r1', _OUTPUTS)) + \
+            [('r3', 't', 'show clock', '1\n\n')]
+        self.assertEqual(list(from_job(self.job('job.txt', 'text'))),
+                         _expected)
+        self.assertEqual(list(from_job(self.job('job.jsonl.gz', 'jsonl'))),
+                         _expected)
+
+    def test_from_store(self):
+        with ConfigStore(os.path.join(self._directory.name, 'configs')) \
+                as store:
+            store.record('r1', 'show version', 'Version 1,\n', 100)
+            self.assertEqual(list(from_store(store)),
+                             [('r1', 100, 'show version', 'Version 1,\n')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+__author__ = 'rafael'
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from icmp import PingResult
+from policy import Deadline, Policy, PolicyEngine, RTOEstimator
+from result import CheckResult, Status
+
+
+class RTOEstimatorTest(unittest.TestCase):
+    def test_initial(self):
+        _estimator = RTOEstimator(initial=1.0)
+        self.assertEqual(_estimator.timeout(), 1.0)
+        self.assertEqual(_estimator.hedge_delay(), 0.5)
+
+    def test_first_sample(self):
+        _estimator = RTOEstimator(minimum=0.01)
+        _estimator.update(0.1)
+        self.assertEqual((_estimator.srtt, _estimator.rttvar), (0.1, 0.05))
+        self.assertAlmostEqual(_estimator.timeout(), 0.3)
+
+    def test_smoothing(self):
+        # RFC 6298 2.3: RTTVAR is updated with the old SRTT.
+        _estimator = RTOEstimator(minimum=0.01)
+        _estimator.update(0.1)
+        _estimator.update(0.2)
+        self.assertAlmostEqual(_estimator.rttvar, 0.75 * 0.05 + 0.25 * 0.1)
+        self.assertAlmostEqual(_estimator.srtt, 0.875 * 0.1 + 0.125 * 0.2)
+        self.assertAlmostEqual(_estimator.timeout(),
+                               _estimator.srtt + 4 * _estimator.rttvar)
+        self.assertAlmostEqual(_estimator.hedge_delay(),
+                               _estimator.srtt + 2 * _estimator.rttvar)
+
+    def test_bounds(self):
+        _estimator = RTOEstimator(minimum=0.2, maximum=2.0)
+        _estimator.update(0.001)
+        self.assertEqual(_estimator.timeout(), 0.2)
+        self.assertEqual(_estimator.hedge_delay(), 0.1)
+        _estimator.update(5.0)
+        self.assertEqual(_estimator.timeout(), 2.0)
+
+    def test_backoff(self):
+        _estimator = RTOEstimator(initial=1.0, maximum=3.0)
+        _estimator.backoff()
+        self.assertEqual(_estimator.timeout(), 2.0)
+        _estimator.backoff()
+        self.assertEqual(_estimator.timeout(), 3.0)
+        _estimator.update(0.1)
+        self.assertAlmostEqual(_estimator.timeout(), 0.3)
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_unbounded(self):
+        _deadline = Deadline()
+        self.assertIsNone(_deadline.remaining())
+        self.assertFalse(_deadline.expired())
+        self.assertEqual(_deadline.cap(5.0), 5.0)
+        self.assertIsNone(_deadline.within(None).expires)
+
+    def test_bounded(self):
+        with mock.patch('time.monotonic', return_value=100.0) as now:
+            _deadline = Deadline(10)
+            self.assertEqual(_deadline.cap(30.0), 10.0)
+            self.assertEqual(_deadline.within(5).expires, 105.0)
+            self.assertEqual(_deadline.within(50).expires, 110.0)
+            now.return_value = 111.0
+            self.assertEqual(_deadline.remaining(), 0.0)
+            self.assertTrue(_deadline.expired())
+
+
+class PolicyTest(unittest.TestCase):
+    def test_delay_has_full_jitter(self):
+        _policy = Policy(base_delay=0.1, max_delay=0.3)
+        for attempt, ceiling in ((0, 0.1), (1, 0.2), (5, 0.3)):
+            for _ in range(50):
+                self.assertTrue(0 <= _policy.delay(attempt) <= ceiling)
+
+
+def _result(status=Status.OK, latency=0.05, **kwargs):
+    return CheckResult('socket', 'r1', status, latency, status.value,
+                       **kwargs)
+
+
+class PolicyEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = PolicyEngine({
+            'socket': Policy(retries=2, base_delay=0, budget=5.0,
+                             initial=1.0, minimum=0.01),
+            'dns': Policy(retries=1, base_delay=0, budget=5.0, hedge=True,
+                          initial=0.1, minimum=0.01)})
+        self.addCleanup(self.engine.close)
+
+    def test_retries_timeouts_and_backs_off(self):
+        _attempts = []
+
+        def attempt(timeout, number):
+            _attempts.append((timeout, number))
+            return _result(Status.TIMEOUT if number < 2 else Status.OK)
+        self.assertEqual(self.engine.run('socket', 'r1', attempt).status,
+                         Status.OK)
+        self.assertEqual(_attempts, [(1.0, 0), (2.0, 1), (4.0, 2)])
+
+    def test_learns_from_first_attempt_only(self):
+        self.engine.run('socket', 'r1', lambda timeout, number: _result())
+        self.engine.run('socket', 'r1', lambda timeout, number:
+                        _result(latency=0.0, cached=True))
+        self.assertEqual(self.engine.estimator('socket', 'r1').srtt, 0.05)
+
+    def test_other_failures_are_not_retried(self):
+        _numbers = []
+
+        def attempt(timeout, number):
+            _numbers.append(number)
+            return _result(Status.FAIL)
+        self.engine.run('socket', 'r1', attempt)
+        self.assertEqual(_numbers, [0])
+
+    def test_expired_deadline(self):
+        _deadline = Deadline(0)
+        _result = self.engine.run('socket', 'r1', self.never, _deadline)
+        self.assertEqual((_result.status, _result.target),
+                         (Status.TIMEOUT, 'r1'))
+
+    def never(self, timeout, number):
+        self.fail('attempt ran past the deadline')
+
+    def test_hedge(self):
+        _caller = threading.current_thread()
+        _threads = {}
+
+        def attempt(timeout, number):
+            _threads[number] = threading.current_thread() is _caller
+            if number == 0:
+                time.sleep(0.3)
+                return _result(Status.TIMEOUT, 0.3)
+            return _result(latency=0.01)
+        _outcome = self.engine.run('dns', 'ns', attempt)
+        self.assertEqual((_outcome.status, _outcome.latency),
+                         (Status.OK, 0.01))
+        self.assertEqual(_threads, {0: True, 1: False})
+
+    def test_fast_primary_is_not_hedged(self):
+        _numbers = []
+
+        def attempt(timeout, number):
+            _numbers.append(number)
+            return _result(latency=0.001)
+        self.engine.run('dns', 'ns', attempt)
+        time.sleep(0.1)  # past the hedge delay
+        self.assertEqual(_numbers, [0])
+
+    def test_host_learns_echo_rtt(self):
+        _ping = PingResult('r1', '192.0.2.1', 3)
+        _ping.samples = [10.0, 20.0, 30.0]
+        _host = CheckResult('host', 'r1', Status.OK, 0.45, '', (3,), _ping)
+        with mock.patch('toolkit.Toolkit.probe_host', return_value=_host):
+            self.engine.host('r1', 3)
+        self.assertAlmostEqual(self.engine.estimator('host', 'r1').srtt, 0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
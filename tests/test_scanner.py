@@ -0,0 +1,51 @@
+__author__ = 'rafael'
+
+import socket
+import unittest
+
+from loopback import FilteredPort, TCPListener
+from scanner import PortScanner, parse_ports
+
+
+class ParsePortsTest(unittest.TestCase):
+    def test_forms(self):
+        self.assertEqual(parse_ports(22), [22])
+        self.assertEqual(parse_ports('22, 80,8000-8002'),
+                         [22, 80, 8000, 8001, 8002])
+        self.assertEqual(parse_ports([443, '8080-8081', ' 53 ']),
+                         [443, 8080, 8081, 53])
+
+    def test_duplicates_removed_in_order(self):
+        self.assertEqual(parse_ports('80,22,79-81,22'), [80, 22, 79, 81])
+
+    def test_empty_items(self):
+        self.assertEqual(parse_ports(''), [])
+        self.assertEqual(parse_ports('22,,'), [22])
+        self.assertEqual(parse_ports([]), [])
+
+    def test_reversed_range_is_empty(self):
+        self.assertEqual(parse_ports('10-5'), [])
+
+    def test_invalid(self):
+        for spec in ('ssh', '1-x', '80-'):
+            with self.assertRaises(ValueError):
+                parse_ports(spec)
+
+
+class PortScannerTest(unittest.TestCase):
+    def test_states(self):
+        _closed = socket.socket()
+        _closed.bind(('127.0.0.1', 0))
+        _closed_port = _closed.getsockname()[1]
+        _closed.close()
+        with TCPListener() as listener, FilteredPort() as filtered:
+            _results = list(PortScanner(timeout=0.2).scan(
+                ['127.0.0.1'], [listener.port, _closed_port, filtered.port]))
+        _states = {result.port: result.state for result in _results}
+        self.assertEqual(_states, {listener.port: 'open',
+                                   _closed_port: 'closed',
+                                   filtered.port: 'filtered'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+__author__ = 'rafael'
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from sink import JobWriter, split_key
+
+_OUTPUTS = {'DATE/TIME: 2024-01-02 03:04:05.678 CLI: show version': 'v1\n',
+            'DATE/TIME: 2024-01-02 03:04:06.000 CLI: pwd': '/\n'}
+
+
+class SplitKeyTest(unittest.TestCase):
+    def test_commander_key(self):
+        self.assertEqual(
+            split_key('DATE/TIME: 2024-01-02 03:04:05 CLI: show ip route'),
+            ('2024-01-02 03:04:05', 'show ip route'))
+
+    def test_command_containing_separator(self):
+        self.assertEqual(split_key('DATE/TIME: t CLI: echo " CLI: "'),
+                         ('t', 'echo " CLI: "'))
+
+    def test_other_key(self):
+        self.assertEqual(split_key('show version'), (None, 'show version'))
+
+
+class JobWriterTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self._directory.name, name)
+
+    def test_text(self):
+        with JobWriter(self.path('job.txt')) as job:
+            job.write_device('10.0.0.1\n', _OUTPUTS)
+            job.write_device('10.0.0.2', error='Connection refused')
+        with open(self.path('job.txt')) as source:
+            self.assertEqual(source.read(), ''.join(
+                ['\nDevice [10.0.0.1]:\n'] +
+                ['{}\n{}'.format(k, v) for k, v in _OUTPUTS.items()] +
+                ['\nDevice [10.0.0.2]:\nConnection refused\n']))
+        self.assertEqual(job.devices, 2)
+
+    def test_jsonl_gzip(self):
+        with JobWriter(self.path('job.jsonl.gz'), fmt='jsonl',
+                       fsync='close') as job:
+            job.write_device('10.0.0.1', _OUTPUTS)
+            job.write_device('10.0.0.2', error='timed out')
+        with gzip.open(self.path('job.jsonl.gz'), 'rt') as source:
+            _records = [json.loads(line) for line in source]
+        self.assertEqual(_records, [
+            {'device': '10.0.0.1', 'timestamp': '2024-01-02 03:04:05.678',
+             'command': 'show version', 'output': 'v1\n'},
+            {'device': '10.0.0.1', 'timestamp': '2024-01-02 03:04:06.000',
+             'command': 'pwd', 'output': '/\n'},
+            {'device': '10.0.0.2', 'error': 'timed out'}])
+
+    def test_appends_across_jobs(self):
+        for device in ('a', 'b'):
+            with JobWriter(self.path('job.jsonl'), fmt='jsonl') as job:
+                job.write_device(device, error='x')
+        with open(self.path('job.jsonl')) as source:
+            self.assertEqual([json.loads(line)['device'] for line in source],
+                             ['a', 'b'])
+
+    def test_blocks_do_not_interleave(self):
+        _outputs = {'DATE/TIME: t CLI: cmd{}'.format(i): 'line\n' * 50
+                    for i in range(20)}
+        with JobWriter(self.path('job.txt'), flush_interval=0) as job:
+            _threads = [threading.Thread(
+                target=job.write_device, args=('dev{}'.format(n), _outputs))
+                for n in range(16)]
+            for thread in _threads:
+                thread.start()
+            for thread in _threads:
+                thread.join()
+        with open(self.path('job.txt')) as source:
+            _blocks = source.read().split('\nDevice [')[1:]
+        self.assertEqual(len(_blocks), 16)
+        for block in _blocks:
+            self.assertEqual(block.count('CLI: cmd'), 20)
+
+    def test_close_twice(self):
+        job = JobWriter(self.path('job.txt'))
+        job.close()
+        job.close()
+
+    def test_rejects_unknown_options(self):
+        with self.assertRaises(ValueError):
+            JobWriter(self.path('job.txt'), fmt='xml')
+        with self.assertRaises(ValueError):
+            JobWriter(self.path('job.txt'), fsync='always')
+
+
+if __name__ == '__main__':
+    unittest.main()